@@ -0,0 +1,210 @@
+import csv
+import hashlib
+import io
+import json
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import numpy as np
+import streamlit as st
+
+from commune_metrics import commune_metrics
+from geometry import communes_for_points
+from spatial_index import EARTH_RADIUS_KM
+
+# ==========================================
+# تحليل إمكانية الوصول والتغطية لكل بلدية
+# مسافات haversine كمصفوفات numpy بين نقاط عينة داخل البلديات وكل المرافق
+# ==========================================
+# تباعد شبكة العينات بالدرجات (حوالي 3 كم)
+ACCESS_GRID_DEGREES = 0.03
+# عدد صفوف مصفوفة المسافات في كل دفعة (يحد من استهلاك الذاكرة مع آلاف المرافق)
+ACCESS_CHUNK_ROWS = 512
+# نصف قطر التغطية المقبول لكل مستوى (كم)
+COVERAGE_RADIUS_KM = {
+    "مستشفى": 30,
+    "عيادة H24": 20,
+    "عيادة H12": 15,
+    "عيادة H8": 10,
+    "قاعة علاج": 5,
+}
+ACCESS_METRICS = {
+    "nearest_km": "المسافة إلى أقرب مرفق (كم)",
+    "mean_km": "متوسط مسافة السكان (كم)",
+    "per_facility": "السكان لكل مرفق",
+    "uncovered": "السكان خارج التغطية",
+}
+# عدد الأرقام بعد الفاصلة في الجدول (السكان أعداد صحيحة)
+METRIC_DIGITS = {"nearest_km": 1, "mean_km": 1, "per_facility": 0, "uncovered": 0}
+CHOROPLETH_RAMP = ("#ffffb2", "#fecc5c", "#fd8d3c", "#f03b20", "#bd0026")
+CHOROPLETH_MISSING = "#9e9e9e"
+
+
+def nearest(lats, lons, f_lats, f_lons, chunk_rows=ACCESS_CHUNK_ROWS):
+    # (المسافة بالكم، رقم أقرب مرفق) لكل نقطة
+    lats, lons = np.radians(lats), np.radians(lons)
+    f_lats, f_lons = np.radians(f_lats), np.radians(f_lons)
+    cos_f = np.cos(f_lats)
+    distances = np.empty(len(lats))
+    indexes = np.empty(len(lats), dtype=int)
+    for start in range(0, len(lats), chunk_rows):
+        lat = lats[start:start + chunk_rows, None]
+        lon = lons[start:start + chunk_rows, None]
+        a = np.sin((f_lats - lat) / 2) ** 2 + np.cos(lat) * cos_f * np.sin((f_lons - lon) / 2) ** 2
+        best = np.argmin(a, axis=1)
+        indexes[start:start + chunk_rows] = best
+        a_best = np.clip(a[np.arange(len(best)), best], 0.0, 1.0)
+        distances[start:start + chunk_rows] = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a_best))
+    return distances, indexes
+
+
+@dataclass(frozen=True)
+class CommuneSamples:
+    names: Tuple[str, ...]
+    population: np.ndarray
+    area_km2: np.ndarray
+    density: np.ndarray
+    label_lat: np.ndarray
+    label_lon: np.ndarray
+    # نقاط العينة: الموضع، رقم البلدية، وحصتها من سكان البلدية
+    lat: np.ndarray
+    lon: np.ndarray
+    commune: np.ndarray
+    weight: np.ndarray
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _build_samples(version, _layer):
+    # المسافة "إلى البلدية" تُقاس من موضع اسمها (نقطة داخلية بعيدة عن الحدود)
+    metrics = commune_metrics(_layer)
+    names = metrics.names
+    population, label_lon, label_lat = metrics.population, metrics.anchor_lon, metrics.anchor_lat
+
+    min_x, min_y, max_x, max_y = _layer.extent
+    xs, ys = np.meshgrid(np.arange(min_x + ACCESS_GRID_DEGREES / 2, max_x, ACCESS_GRID_DEGREES),
+                         np.arange(min_y + ACCESS_GRID_DEGREES / 2, max_y, ACCESS_GRID_DEGREES))
+    xs, ys = xs.ravel(), ys.ravel()
+    position = {n: i for i, n in enumerate(names)}
+    owner = np.array([position.get(c, -1) for c in communes_for_points(_layer, xs, ys)], dtype=int)
+    inside = owner >= 0
+    # البلديات الصغيرة التي لم تقع فيها أي نقطة من الشبكة تُمثل بنقطة اسمها
+    missing = np.setdiff1d(np.arange(len(names)), owner[inside])
+    lon = np.concatenate([xs[inside], label_lon[missing]])
+    lat = np.concatenate([ys[inside], label_lat[missing]])
+    commune = np.concatenate([owner[inside], missing])
+    counts = np.bincount(commune, minlength=len(names))
+    weight = population[commune] / counts[commune]
+    return CommuneSamples(names, population, metrics.area_km2, metrics.density, label_lat, label_lon, lat, lon, commune, weight)
+
+
+@dataclass
+class AccessibilityResult:
+    samples: CommuneSamples
+    # مستوى -> مقياس -> قيمة لكل بلدية (nan إذا لم يوجد أي مرفق من هذا المستوى)
+    metrics: Dict[str, Dict[str, np.ndarray]]
+    # مستوى -> [(رقم المرفق، سكان حوضه، سكانه داخل نصف القطر)]
+    catchments: Dict[str, list]
+    counts: Dict[str, np.ndarray]
+
+    def values(self, level, metric):
+        return dict(zip(self.samples.names, self.metrics[level][metric].tolist()))
+
+    def commune_rows(self, level):
+        m, counts = self.metrics[level], self.counts[level]
+        rows = []
+        for i, name in enumerate(self.samples.names):
+            rows.append({
+                "البلدية": name,
+                "السكان": int(self.samples.population[i]),
+                "المساحة (كم²)": _rounded(self.samples.area_km2[i], 1),
+                "الكثافة (نسمة/كم²)": _rounded(self.samples.density[i], 1),
+                "عدد المرافق": int(counts[i]),
+                **{label: _rounded(m[key][i], METRIC_DIGITS[key]) for key, label in ACCESS_METRICS.items()},
+            })
+        return rows
+
+    def to_csv(self):
+        # جدول واحد لكل المستويات، utf-8 مع BOM حتى يفتحه Excel بالعربية
+        buffer = io.StringIO()
+        fields = ["البلدية", "السكان", "المساحة (كم²)", "الكثافة (نسمة/كم²)"] + [f"{level} - {label}" for level in self.metrics for label in ["عدد المرافق", *ACCESS_METRICS.values()]]
+        writer = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+        for i, name in enumerate(self.samples.names):
+            row = {"البلدية": name, "السكان": int(self.samples.population[i]),
+                   "المساحة (كم²)": _rounded(self.samples.area_km2[i], 1),
+                   "الكثافة (نسمة/كم²)": _rounded(self.samples.density[i], 1)}
+            for level, m in self.metrics.items():
+                row[f"{level} - عدد المرافق"] = int(self.counts[level][i])
+                for key, label in ACCESS_METRICS.items():
+                    row[f"{level} - {label}"] = _rounded(m[key][i], METRIC_DIGITS[key])
+            writer.writerow(row)
+        return buffer.getvalue().encode("utf-8-sig")
+
+
+def _rounded(value, digits):
+    if np.isnan(value):
+        return None
+    return round(float(value), digits) if digits else int(round(float(value)))
+
+
+def _analyze_level(samples, f_lat, f_lon, f_commune, radius_km):
+    n = len(samples.names)
+    counts = np.bincount(f_commune[f_commune >= 0], minlength=n)
+    if len(f_lat) == 0:
+        nan = np.full(n, np.nan)
+        return {"nearest_km": nan, "mean_km": nan, "per_facility": nan, "uncovered": samples.population.copy()}, counts, []
+    label_km, _ = nearest(samples.label_lat, samples.label_lon, f_lat, f_lon)
+    sample_km, sample_nearest = nearest(samples.lat, samples.lon, f_lat, f_lon)
+    weighted = np.bincount(samples.commune, weights=sample_km * samples.weight, minlength=n)
+    uncovered = np.bincount(samples.commune, weights=samples.weight * (sample_km > radius_km), minlength=n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_km = np.where(samples.population > 0, weighted / samples.population, np.nan)
+        per_facility = np.where(counts > 0, samples.population / counts, np.nan)
+    # حوض كل مرفق: سكان العينات التي هو أقرب مرفق لها
+    catchment = np.bincount(sample_nearest, weights=samples.weight, minlength=len(f_lat))
+    within = np.bincount(sample_nearest, weights=samples.weight * (sample_km <= radius_km), minlength=len(f_lat))
+    metrics = {"nearest_km": label_km, "mean_km": mean_km, "per_facility": per_facility, "uncovered": uncovered}
+    return metrics, counts, list(zip(catchment.tolist(), within.tolist()))
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _analyze(version, markers_key, levels, _layer, _facilities):
+    samples = _build_samples(version, _layer)
+    position = {n: i for i, n in enumerate(samples.names)}
+    metrics, counts, catchments = {}, {}, {}
+    for level in levels:
+        chosen = [f for f in _facilities if f[0] == level]
+        f_lat = np.array([f[1] for f in chosen], dtype=float)
+        f_lon = np.array([f[2] for f in chosen], dtype=float)
+        f_commune = np.array([position.get(f[3], -1) for f in chosen], dtype=int)
+        metrics[level], counts[level], level_catchments = _analyze_level(
+            samples, f_lat, f_lon, f_commune, COVERAGE_RADIUS_KM.get(level, 10))
+        catchments[level] = [(f[4], pop, covered) for f, (pop, covered) in zip(chosen, level_catchments)]
+    return AccessibilityResult(samples, metrics, catchments, counts)
+
+
+def accessibility(layer, markers, levels, commune_of=lambda marker: marker.get("commune")) -> AccessibilityResult:
+    # النتيجة مخزنة حتى تتغير مواقع أو أنواع أو بلديات المرافق
+    facilities = tuple(
+        (m.get("type", "مستشفى"), m["lat"], m["lon"], commune_of(m), m.get("id"))
+        for m in markers
+    )
+    markers_key = hashlib.sha1(json.dumps(facilities, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return _analyze(layer.version, markers_key, tuple(levels), layer, facilities)
+
+
+def choropleth_colors(values):
+    # خمس فئات متساوية بين أصغر وأكبر قيمة؛ البلديات بدون قيمة بالرمادي
+    finite = [v for v in values.values() if not np.isnan(v)]
+    if not finite:
+        return {name: CHOROPLETH_MISSING for name in values}, []
+    low, high = min(finite), max(finite)
+    step = (high - low) / len(CHOROPLETH_RAMP) or 1.0
+    colors = {}
+    for name, value in values.items():
+        if np.isnan(value):
+            colors[name] = CHOROPLETH_MISSING
+        else:
+            colors[name] = CHOROPLETH_RAMP[min(int((value - low) / step), len(CHOROPLETH_RAMP) - 1)]
+    breaks = [(color, low + i * step, low + (i + 1) * step) for i, color in enumerate(CHOROPLETH_RAMP)]
+    return colors, breaks
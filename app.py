@@ -1,15 +1,34 @@
 import streamlit as st
 import folium
-from streamlit_folium import st_folium
 import os
-import json
 import streamlit.components.v1 as components
 from branca.element import MacroElement
 from jinja2 import Template
 
+from geometry import commune_key
+from layer_registry import commune_in_region, component_bounds, fit_zoom, get_registry, padded, qualify_communes, region_styles, style_key, view_bounds
+from simplify import level_of_detail
+from storage import ConflictError, get_backend
+from importer import import_facilities
+from spatial_index import FacilityIndex
+from search_index import SearchIndex
+from marker_canvas import FacilityCanvasLayer
+from topology_layer import TopoJsonLayer
+from map_export import EXPORT_DPI, EXPORT_FORMATS, RASTER_ARABIC, SHEET_SIZES_MM, ArabicTextError, commune_sheets, export_sheets, saved_view_sheet, type_sheets
+from marker_icons import DEFAULT_TEXT_X, DEFAULT_TEXT_Y, FACILITY_COLORS, DivIconLayer, IconStyleSheet, commune_label_html, facility_icon_html
+from label_placement import LabelPlacer, apply_offsets, commune_labels, place_commune_labels, zoom_key
+from accessibility import ACCESS_METRICS, CHOROPLETH_MISSING, COVERAGE_RADIUS_KM, accessibility, choropleth_colors
+from perf import get_monitor, perf_enabled, stage, start, stop
+from map_cache import folium_component, get_render_cache, render_feature_group, render_map, state_key
+
 # إعداد الصفحة لتكون واسعة ومتوافقة مع الجوال
 st.set_page_config(page_title="الخريطة الصحية - د. عليلي صابر", page_icon="🗺️", layout="wide", initial_sidebar_state="auto")
 
+# مراقبة الأداء (HEALTHMAP_PERF=1): زمن وحجم كل مرحلة في هذا التشغيل، مع لوحة في آخر القائمة الجانبية
+perf_monitor = get_monitor(os.environ.get("HEALTHMAP_PERF_LOG")) if perf_enabled() else None
+if perf_monitor:
+    perf_monitor.begin_rerun(st.session_state.setdefault("perf_session", os.urandom(4).hex()))
+
 # ==========================================
 # إعدادات الـ CSS والطباعة الاحترافية (إخفاء كل شيء ما عدا الخريطة)
 # ==========================================
@@ -82,76 +101,159 @@ st.markdown("""
 # ==========================================
 # قاموس الألوان والنظام
 # ==========================================
-FACILITY_COLORS = {
-    "مستشفى": "#b71c1c", 
-    "عيادة H24": "#d32f2f", 
-    "عيادة H12": "#f57c00", 
-    "عيادة H8": "#1976d2", 
-    "قاعة علاج": "#388e3c"
-}
+# عدد المرافق في كل صفحة من تبويب التعديل
+MANAGE_PAGE_SIZE = 20
+# فوق هذا العدد من المرافق تُرسم على Canvas مع تجميع حسب النوع بدل DivIcon لكل مرفق (HEALTHMAP_CANVAS_THRESHOLD)
+CANVAS_MARKER_THRESHOLD = int(os.environ.get("HEALTHMAP_CANVAS_THRESHOLD", 300))
+# التكبير عند الانتقال إلى مرفق من نتائج البحث (البلدية تُكبّر لتظهر كاملة)
+FACILITY_FOCUS_ZOOM = 15
 
 DATA_FILE = "saved_data.json"
+DATA_DB = "saved_data.sqlite"
+# نوع التخزين: json (ملف واحد) أو sqlite (سجل لكل مرفق، مناسب لعدة مستخدمين في نفس الوقت)
+STORAGE_BACKEND = os.environ.get("HEALTHMAP_STORAGE", "json")
+
+# ملفات الحدود (ولاية في كل ملف، *_communes.geojson) مفهرسة بإطار كل بلدية؛ لا تُحمّل إلا الولاية
+# المختارة في التبويبات والولايات الظاهرة في الخريطة، وتُشارك بين الجلسات (للقراءة فقط)
+with stage("geojson_load"):
+    registry = get_registry()
+    if st.session_state.get("region") not in registry.regions:
+        st.session_state.region = registry.default_region
+    region = st.session_state.region
+    commune_layer = registry.layer(region) if region else None
+geojson_data = commune_layer.geojson if commune_layer else None
+
+def locate_commune(lon, lat):
+    # "الولاية/البلدية": البلديات المتشابهة الاسم في ولايتين لا تختلط
+    return registry.locate_key(lon, lat)
+
+def commune_styles_of(region_name):
+    # commune_styles مفاتيحها "الولاية/البلدية"
+    return region_styles(st.session_state.commune_styles, region_name, registry.default_region)
+
+if STORAGE_BACKEND == "sqlite":
+    # عند أول تشغيل تُرحّل بيانات saved_data.json تلقائياً
+    backend = get_backend("sqlite", DATA_DB, DATA_FILE, locate_commune)
+else:
+    backend = get_backend("json", DATA_FILE)
 
 def load_data():
-    default_data = {
-        "markers": [], 
-        "commune_styles": {}, 
-        "global_settings": {
-            "lang": "العربية", 
-            "show_names": True,
-            "show_hospital_names": True,
-            "hospital_font_size": 14,
-            "map_zoom": 9,
-            "map_center": [35.3, 4.5]
-        }
+    default_settings = {
+        "lang": "العربية", 
+        "show_names": True,
+        "show_hospital_names": True,
+        "hospital_font_size": 14,
+        "auto_labels": True,
+        "map_zoom": 9,
+        "map_center": [35.3, 4.5]
+    }
+    commune_styles, global_settings = backend.load_settings()
+    if global_settings is None:
+        global_settings = default_settings
+    if "map_zoom" not in global_settings:
+        global_settings["map_zoom"] = 9
+        global_settings["map_center"] = [35.3, 4.5]
+    # كل المرافق بلا تصفية: المحرر والبحث والتحليل ولائحة المرافق تحتاجها كلها، وطبقة المرافق مخزنة بمفتاح ثابت
+    # (تصفيتها بإطار العرض تغير المفتاح وترسل الطبقة من جديد مع كل تحريك). الاستعلام بالإطار (bbox) متاح في الخلفيات
+    # لكن رسم الخريطة لا يستعمله عمداً
+    markers = qualify_communes(backend.load_markers(), registry.default_region)
+    return {"markers": markers, "commune_styles": commune_styles, "global_settings": global_settings}
+
+def note_write():
+    # إذا كان تعديلنا هو الوحيد منذ آخر تحميل فلا داعي لإعادة التحميل
+    revision = backend.revision()
+    if revision == st.session_state.data_revision + 1:
+        st.session_state.data_revision = revision
+
+def new_marker(fac_type, name_ar, name_fr, lat, lon, commune):
+    default_color = FACILITY_COLORS.get(fac_type, "#b71c1c")
+    return {
+        "type": fac_type, "name_ar": name_ar, "name_fr": name_fr, 
+        "lat": lat, "lon": lon, "text_x": 0, "text_y": 35,      
+        "font_size": st.session_state.global_settings["hospital_font_size"], "name_color": default_color,  
+        "label_size": 15, "label_color": default_color,
+        "commune": commune
     }
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if "global_settings" not in data:
-                    data["global_settings"] = default_data["global_settings"]
-                if "map_zoom" not in data["global_settings"]:
-                    data["global_settings"]["map_zoom"] = 9
-                    data["global_settings"]["map_center"] = [35.3, 4.5]
-                return data
-        except json.decoder.JSONDecodeError:
-            return default_data
-    return default_data
-
-def save_data():
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump({
-            "markers": st.session_state.markers,
-            "commune_styles": st.session_state.commune_styles,
-            "global_settings": st.session_state.global_settings
-        }, f, ensure_ascii=False, indent=4)
-
-if 'data_loaded' not in st.session_state:
+
+def save_global_settings():
+    backend.set_global_settings(st.session_state.global_settings)
+    note_write()
+
+def reset_marker_widgets(marker_id):
+    for key in [k for k in st.session_state if str(k).endswith(f"_{marker_id}")]:
+        del st.session_state[key]
+
+# إعادة التحميل فقط عند أول تشغيل أو إذا كتبت جلسة أخرى في التخزين
+if st.session_state.get('data_revision') != backend.revision():
+    revision = backend.revision()
+    start("load_data")
     saved_info = load_data()
+    stop("load_data", items=len(saved_info["markers"]))
+    # الحقول المرتبطة بمرافق عدلتها جلسة أخرى تُمسح حتى لا تعيد كتابة القيم القديمة
+    old_versions = {m['id']: m['version'] for m in st.session_state.get('markers', [])}
+    for m in saved_info["markers"]:
+        if old_versions.get(m['id'], m['version']) != m['version']:
+            reset_marker_widgets(m['id'])
     st.session_state.markers = saved_info.get("markers", [])
     st.session_state.commune_styles = saved_info.get("commune_styles", {})
     st.session_state.global_settings = saved_info.get("global_settings")
-    st.session_state.data_loaded = True
+    st.session_state.data_revision = revision
+
+# فهرس مكاني لمرافق الجلسة (أقرب مرفق، المرافق داخل دائرة، المرافق في كل بلدية)،
+# لا يُعاد فهرسة إلا المرافق الجديدة أو المعدلة
+if 'facility_index' not in st.session_state:
+    st.session_state.facility_index = FacilityIndex(locate_commune)
+st.session_state.facility_index.sync(st.session_state.markers)
 
-geojson_file = "msila_communes.geojson"
-geojson_data = None
-if os.path.exists(geojson_file):
-    with open(geojson_file, "r", encoding="utf-8") as f:
-        geojson_data = json.load(f)
-    geojson_data['features'] = [f for f in geojson_data.get('features', []) if f.get('geometry', {}).get('type') in ['Polygon', 'MultiPolygon']]
+def facility_title(marker):
+    return marker.get('name_ar') or marker.get('name_fr', '')
+
+# فهرس البحث بالاسم (مرافق الجلسة وبلديات كل الولايات من فهارسها المحفوظة)، يُحدّث جزئياً مثل الفهرس المكاني
+if 'search_index' not in st.session_state:
+    st.session_state.search_index = SearchIndex()
+search_index = st.session_state.search_index
+with stage("search_index"):
+    search_index.sync_facilities(st.session_state.markers, facility_title)
+    search_index.sync_communes(registry.regions.values())
 
 # ==========================================
 # القائمة الجانبية (بنظام التبويبات العصري للموبايل)
 # ==========================================
 st.sidebar.markdown("### لوحة التحكم")
+
+def focus_result(entry):
+    # يُنفذ قبل إعادة التشغيل: الخريطة تتحرك في المتصفح دون إعادة بنائها (مفتاحها لا يتغير)
+    zoom = fit_zoom(entry.bbox) if entry.bbox else FACILITY_FOCUS_ZOOM
+    seq = st.session_state.get("map_focus", {}).get("seq", 0) + 1
+    # المكون لا يتحرك إلا إذا تغير المركز، فإزاحة لا تُرى تسمح بإعادة اختيار نفس النتيجة بعد التحريك
+    focus = {"zoom": zoom, "center": [entry.lat + (seq % 2) * 1e-6, entry.lon], "seq": seq}
+    st.session_state.map_focus = st.session_state.map_focus_pending = focus
+    if entry.kind == "commune":
+        st.session_state.region = entry.key[1]
+        st.session_state.selected_commune = entry.key[2]
+    else:
+        st.session_state.manage_search = entry.label
+        st.session_state.manage_types = []
+        st.session_state.manage_page = 1
+        st.session_state.manage_selected = entry.key[1]
+
+with stage("search"):
+    map_query = st.sidebar.text_input("🔎 بحث عن بلدية أو مرفق (عربي أو فرنسي):", key="map_search")
+    if map_query.strip():
+        results = search_index.search(map_query)
+        if not results:
+            st.sidebar.caption("لا توجد نتائج.")
+        for n, (entry, _) in enumerate(results):
+            icon = "🗺️" if entry.kind == "commune" else "📍"
+            st.sidebar.button(f"{icon} {entry.label} ({entry.detail})", key=f"map_search_{n}",
+                              on_click=focus_result, args=(entry,), use_container_width=True)
 # تقسيم القائمة الجانبية إلى 4 تبويبات مرتبة
-tab_general, tab_add, tab_manage, tab_export = st.sidebar.tabs(["⚙️ إعدادات", "➕ إضافة", "🛠️ تعديل", "📤 تصدير"])
+tab_general, tab_add, tab_manage, tab_analysis, tab_export = st.sidebar.tabs(["⚙️ إعدادات", "➕ إضافة", "🛠️ تعديل", "📊 تحليل", "📤 تصدير"])
 
 # ------------------------------------------
 # 1. تبويب الإعدادات العامة وتلوين البلديات
 # ------------------------------------------
-with tab_general:
+with tab_general, stage("general_tab"):
     st.markdown("#### الإعدادات العامة")
     current_lang = st.session_state.global_settings["lang"]
     current_show_names = st.session_state.global_settings["show_names"]
@@ -164,27 +266,40 @@ with tab_general:
     
     new_show_hosp = st.checkbox("👁️ إظهار جميع أسماء المرافق", value=current_show_hosp)
     new_font_size = st.slider("🔠 الحجم الافتراضي لخط المرافق:", 8, 35, current_font_size, 1)
+    current_auto_labels = st.session_state.global_settings.get("auto_labels", True)
+    new_auto_labels = st.checkbox("🏷️ ترتيب الأسماء تلقائياً بدون تداخل", value=current_auto_labels)
 
     if (new_lang != current_lang or new_show_names != current_show_names or 
-        new_show_hosp != current_show_hosp or new_font_size != current_font_size):
+        new_show_hosp != current_show_hosp or new_font_size != current_font_size or
+        new_auto_labels != current_auto_labels):
         st.session_state.global_settings.update({
             "lang": new_lang, "show_names": new_show_names,
-            "show_hospital_names": new_show_hosp, "hospital_font_size": new_font_size
+            "show_hospital_names": new_show_hosp, "hospital_font_size": new_font_size,
+            "auto_labels": new_auto_labels
         })
-        save_data()
+        save_global_settings()
         st.rerun()
 
     lang = st.session_state.global_settings["lang"]
     show_names = st.session_state.global_settings["show_names"]
     show_hospital_names = st.session_state.global_settings["show_hospital_names"]
     global_font_size = st.session_state.global_settings["hospital_font_size"]
+    auto_labels = st.session_state.global_settings.get("auto_labels", True)
+
+    if len(registry.regions) > 1:
+        # الولاية التي تعمل عليها التبويبات (التلوين، التحليل، التصدير)؛ الخريطة تعرض كل الولايات الظاهرة
+        st.selectbox("🗺️ الولاية:", list(registry.regions), key="region")
+        registry_stats = registry.stats()
+        st.caption(f"الولايات المحملة: {len(registry_stats['loaded'])} من {registry_stats['regions']}")
 
     st.markdown("---")
     st.markdown("#### 🎨 تلوين البلديات")
     if geojson_data:
-        commune_list = sorted([f['properties'].get('name:ar', f['properties'].get('name', '')) for f in geojson_data['features']])
-        selected_commune = st.selectbox("اختر بلدية لتعديلها:", commune_list)
-        current_style = st.session_state.commune_styles.get(selected_commune, {"color": "#e3f2fd", "show_name": show_names, "lang": lang})
+        if st.session_state.get("selected_commune") not in commune_layer.commune_list:
+            st.session_state.pop("selected_commune", None)
+        selected_commune = st.selectbox("اختر بلدية لتعديلها:", commune_layer.commune_list, key="selected_commune")
+        st.caption(f"🏥 عدد المرافق في هذه البلدية: {len(st.session_state.facility_index.in_commune(style_key(region, selected_commune)))}")
+        current_style = commune_styles_of(region).get(selected_commune, {"color": "#e3f2fd", "show_name": show_names, "lang": lang})
         
         new_color = st.color_picker("🎨 لون الخلفية:", current_style["color"])
         new_show = st.checkbox(f"👁️ إظهار اسم '{selected_commune}'", value=current_style["show_name"], key="show_ind")
@@ -192,19 +307,28 @@ with tab_general:
         
         col_a, col_b = st.columns(2)
         if col_a.button("💾 حفظ البلدية", use_container_width=True):
-            st.session_state.commune_styles[selected_commune] = {"color": new_color, "show_name": new_show, "lang": new_lang_ind}
-            save_data()
+            style_name = style_key(region, selected_commune)
+            st.session_state.commune_styles[style_name] = {"color": new_color, "show_name": new_show, "lang": new_lang_ind}
+            backend.set_commune_style(style_name, st.session_state.commune_styles[style_name])
+            note_write()
             st.rerun()
         if col_b.button("🔄 إرجاع", use_container_width=True):
-            if selected_commune in st.session_state.commune_styles:
-                del st.session_state.commune_styles[selected_commune]
-                save_data()
+            # المفتاح القديم (بدون ولاية) يخص الولاية الافتراضية
+            style_names = [style_key(region, selected_commune)]
+            if region == registry.default_region:
+                style_names.append(selected_commune)
+            style_names = [name for name in style_names if name in st.session_state.commune_styles]
+            for style_name in style_names:
+                del st.session_state.commune_styles[style_name]
+                backend.delete_commune_style(style_name)
+                note_write()
+            if style_names:
                 st.rerun()
 
 # ------------------------------------------
 # 2. تبويب إضافة مرفق جديد
 # ------------------------------------------
-with tab_add:
+with tab_add, stage("add_tab"):
     st.markdown("#### 📍 إضافة مرفق صحي")
     facility_types = list(FACILITY_COLORS.keys())
     fac_type = st.selectbox("🏥 نوع المرفق:", facility_types)
@@ -215,80 +339,204 @@ with tab_add:
 
     if st.button("➕ إضافة للخريطة", use_container_width=True, type="primary"):
         if place_name_ar or place_name_fr:
-            default_color = FACILITY_COLORS.get(fac_type, "#b71c1c")
-            st.session_state.markers.append({
-                "type": fac_type, "name_ar": place_name_ar, "name_fr": place_name_fr, 
-                "lat": lat, "lon": lon, "text_x": 0, "text_y": 35,      
-                "font_size": global_font_size, "name_color": default_color,  
-                "label_size": 15, "label_color": default_color  
-            })
-            save_data()
+            st.session_state.markers.append(backend.insert_marker(
+                new_marker(fac_type, place_name_ar, place_name_fr, lat, lon, locate_commune(lon, lat))
+            ))
+            note_write()
             st.success("✅ تم الإضافة بنجاح!")
             st.rerun()
 
+    st.markdown("---")
+    st.markdown("#### 📥 استيراد جماعي")
+    st.caption("ملف CSV (بما فيه المصدّر من Excel) أو GeoJSON، بأعمدة: type, name_ar, name_fr, lat, lon")
+    import_file = st.file_uploader("اختر الملف:", type=["csv", "geojson", "json"], key="import_file")
+    if import_file is not None and st.button("📥 استيراد", use_container_width=True):
+        report = import_facilities(
+            import_file, import_file.name, locate_commune if commune_layer else None, facility_types, st.session_state.markers
+        )
+        if report.markers:
+            # كل المرافق المستوردة تُكتب في معاملة واحدة ثم إعادة تشغيل واحدة
+            records = [new_marker(r["type"], r["name_ar"], r["name_fr"], r["lat"], r["lon"], r["commune"]) for r in report.markers]
+            st.session_state.markers.extend(backend.insert_markers(records))
+            note_write()
+        st.session_state.import_report = report
+        st.rerun()
+
+    report = st.session_state.get("import_report")
+    if report is not None:
+        st.success(f"✅ تم استيراد {len(report.markers)} مرفق من {report.rows} سطر "
+                   f"({report.rows_per_second:,.0f} سطر/ثانية)")
+        if report.duplicates:
+            st.info(f"تم تجاهل {report.duplicates} مرفق مكرر (نفس الاسم ونفس الموضع).")
+        if report.errors:
+            st.warning(f"⚠️ {len(report.errors)} سطر مرفوض:")
+            st.dataframe([{"السطر": row, "السبب": reason} for row, reason in report.errors], hide_index=True, use_container_width=True)
+
 # ------------------------------------------
 # 3. تبويب تعديل وإدارة المرافق
 # ------------------------------------------
-with tab_manage:
+with tab_manage, stage("manage_tab"):
     st.markdown("#### 🛠️ تحريك وتعديل المرافق")
     if len(st.session_state.markers) == 0:
         st.info("لم يتم إضافة أي مرافق بعد.")
     else:
-        for i, marker in enumerate(st.session_state.markers):
+        # البحث (من الفهرس، الأقرب أولاً) والتصفية والتقسيم إلى صفحات، وحقول التعديل تُبنى للمرفق المختار فقط
+        search = st.text_input("🔎 بحث بالاسم (عربي أو فرنسي):", key="manage_search").strip()
+        type_filter = st.multiselect("🏥 تصفية حسب النوع:", facility_types, key="manage_types")
+        marker_index = {m['id']: i for i, m in enumerate(st.session_state.markers)}
+        if search:
+            found = [entry.key[1] for entry, _ in search_index.search(search, limit=len(marker_index), kind="facility")]
+        else:
+            found = list(marker_index)
+        matches = [
+            marker_id for marker_id in found if marker_id in marker_index and
+            (not type_filter or st.session_state.markers[marker_index[marker_id]].get('type') in type_filter)
+        ]
+        if not matches:
+            st.info("لا توجد مرافق مطابقة للبحث.")
+        else:
+            page_count = (len(matches) - 1) // MANAGE_PAGE_SIZE + 1
+            if st.session_state.get("manage_page", 1) > page_count:
+                st.session_state.manage_page = page_count
+            page = 1
+            if page_count > 1:
+                page = st.number_input(f"📄 الصفحة (من {page_count}):", min_value=1, max_value=page_count, step=1, key="manage_page")
+            page_ids = matches[(page - 1) * MANAGE_PAGE_SIZE:page * MANAGE_PAGE_SIZE]
+            page_titles = {}
+            for marker_id in page_ids:
+                m = st.session_state.markers[marker_index[marker_id]]
+                page_titles[marker_id] = f"📍 {facility_title(m)} ({m.get('type', 'مستشفى')})"
+
+            if st.session_state.get("manage_selected") not in page_ids:
+                st.session_state.pop("manage_selected", None)
+            mid = st.radio(f"المرافق ({len(matches)}):", page_ids, format_func=page_titles.get, key="manage_selected")
+
+            conflict = False
+            i = marker_index[mid]
+            marker = st.session_state.markers[i]
             display_title = marker.get('name_ar', marker.get('name_fr', ''))
             current_type = marker.get('type', 'مستشفى')
+
+            st.markdown("---")
+            st.markdown(f"**✏️ {display_title} ({current_type})**")
+            new_type = st.selectbox("النوع:", facility_types, index=facility_types.index(current_type), key=f"type_{mid}")
+            new_name_ar = st.text_input("الاسم (عربي):", marker.get('name_ar', ''), key=f"name_ar_{mid}")
+            new_name_fr = st.text_input("الاسم (فرنسي):", marker.get('name_fr', ''), key=f"name_fr_{mid}")
             
-            with st.expander(f"📍 {display_title} ({current_type})"):
-                new_type = st.selectbox("النوع:", facility_types, index=facility_types.index(current_type), key=f"type_{i}")
-                new_name_ar = st.text_input("الاسم (عربي):", marker.get('name_ar', ''), key=f"name_ar_{i}")
-                new_name_fr = st.text_input("الاسم (فرنسي):", marker.get('name_fr', ''), key=f"name_fr_{i}")
-                
-                def_col = FACILITY_COLORS.get(current_type, "#b71c1c")
-                curr_name_color = marker.get('name_color', def_col)
-                curr_lbl_size = marker.get('label_size', 15)
-                curr_lbl_color = marker.get('label_color', def_col)
-                
-                st.markdown("**🎨 تخصيص اسم المرفق:**")
-                col_n1, col_n2 = st.columns(2)
-                new_font = col_n1.slider("الحجم:", 8, 45, marker.get('font_size', global_font_size), key=f"font_{i}")
-                new_name_color = col_n2.color_picker("اللون:", curr_name_color, key=f"ncolor_{i}")
-                
-                new_lbl_size = curr_lbl_size
-                new_lbl_color = curr_lbl_color
-                if new_type in ["عيادة H24", "عيادة H12", "عيادة H8"]:
-                    lbl_name = new_type.split()[1]
-                    st.markdown(f"**🎨 تخصيص الرمز {lbl_name}:**")
-                    col_l1, col_l2 = st.columns(2)
-                    new_lbl_size = col_l1.slider("حجم الرمز:", 8, 45, curr_lbl_size, key=f"lsize_{i}")
-                    new_lbl_color = col_l2.color_picker("لون الرمز:", curr_lbl_color, key=f"lcolor_{i}")
-
-                st.markdown("**موضع النص (تحريك حر):**")
-                col_x, col_y = st.columns(2)
-                new_text_x = col_x.number_input("يمين/يسار:", value=marker.get('text_x', 0), step=5, key=f"tx_{i}")
-                new_text_y = col_y.number_input("أعلى/أسفل:", value=marker.get('text_y', 35), step=5, key=f"ty_{i}")
-                
-                st.markdown("**الإحداثيات الجغرافية:**")
-                new_lat = st.number_input("خط العرض:", value=marker['lat'], format="%.6f", key=f"lat_{i}")
-                new_lon = st.number_input("خط الطول:", value=marker['lon'], format="%.6f", key=f"lon_{i}")
-                
-                # الحفظ التلقائي عند التعديل
-                marker.update({
-                    "type": new_type, "name_ar": new_name_ar, "name_fr": new_name_fr,
-                    "lat": new_lat, "lon": new_lon, "text_x": new_text_x, "text_y": new_text_y,
-                    "font_size": new_font, "name_color": new_name_color,
-                    "label_size": new_lbl_size, "label_color": new_lbl_color
-                })
-                save_data()
-
-                if st.button("🗑️ حذف المرفق", key=f"del_{i}", use_container_width=True):
+            def_col = FACILITY_COLORS.get(current_type, "#b71c1c")
+            curr_name_color = marker.get('name_color', def_col)
+            curr_lbl_size = marker.get('label_size', 15)
+            curr_lbl_color = marker.get('label_color', def_col)
+            
+            st.markdown("**🎨 تخصيص اسم المرفق:**")
+            col_n1, col_n2 = st.columns(2)
+            new_font = col_n1.slider("الحجم:", 8, 45, marker.get('font_size', global_font_size), key=f"font_{mid}")
+            new_name_color = col_n2.color_picker("اللون:", curr_name_color, key=f"ncolor_{mid}")
+            
+            new_lbl_size = curr_lbl_size
+            new_lbl_color = curr_lbl_color
+            if new_type in ["عيادة H24", "عيادة H12", "عيادة H8"]:
+                lbl_name = new_type.split()[1]
+                st.markdown(f"**🎨 تخصيص الرمز {lbl_name}:**")
+                col_l1, col_l2 = st.columns(2)
+                new_lbl_size = col_l1.slider("حجم الرمز:", 8, 45, curr_lbl_size, key=f"lsize_{mid}")
+                new_lbl_color = col_l2.color_picker("لون الرمز:", curr_lbl_color, key=f"lcolor_{mid}")
+
+            st.markdown("**موضع النص (تحريك حر):**")
+            col_x, col_y = st.columns(2)
+            new_text_x = col_x.number_input("يمين/يسار:", value=marker.get('text_x', 0), step=5, key=f"tx_{mid}")
+            new_text_y = col_y.number_input("أعلى/أسفل:", value=marker.get('text_y', 35), step=5, key=f"ty_{mid}")
+            label_pinned = (new_text_x, new_text_y) != (DEFAULT_TEXT_X, DEFAULT_TEXT_Y)
+            if auto_labels:
+                st.caption("📌 موضع مثبت يدوياً" if label_pinned else "🏷️ الموضع يُرتب تلقائياً، وتعديله يثبته")
+            
+            st.markdown("**الإحداثيات الجغرافية:**")
+            new_lat = st.number_input("خط العرض:", value=marker['lat'], format="%.6f", key=f"lat_{mid}")
+            new_lon = st.number_input("خط الطول:", value=marker['lon'], format="%.6f", key=f"lon_{mid}")
+            
+            # الحفظ التلقائي عند التعديل (فقط للمرافق التي تغيرت فعلاً)
+            updated = {
+                "type": new_type, "name_ar": new_name_ar, "name_fr": new_name_fr,
+                "lat": new_lat, "lon": new_lon, "text_x": new_text_x, "text_y": new_text_y,
+                "font_size": new_font, "name_color": new_name_color,
+                "label_size": new_lbl_size, "label_color": new_lbl_color
+            }
+            if any(marker.get(k) != v for k, v in updated.items()):
+                if (new_lat, new_lon) != (marker['lat'], marker['lon']) or 'commune' not in marker:
+                    updated["commune"] = locate_commune(new_lon, new_lat)
+                try:
+                    st.session_state.markers[i] = backend.update_marker(dict(marker, **updated))
+                    note_write()
+                except ConflictError:
+                    conflict = True
+
+            if auto_labels and label_pinned and st.button("🏷️ إرجاع للترتيب التلقائي", key=f"autolabel_{mid}", use_container_width=True):
+                try:
+                    st.session_state.markers[i] = backend.update_marker(
+                        dict(st.session_state.markers[i], text_x=DEFAULT_TEXT_X, text_y=DEFAULT_TEXT_Y))
+                    note_write()
+                except ConflictError:
+                    conflict = True
+                else:
+                    reset_marker_widgets(mid)
+                    st.rerun()
+
+            if st.button("🗑️ حذف المرفق", key=f"del_{mid}", use_container_width=True):
+                try:
+                    backend.delete_marker(mid, marker['version'])
                     st.session_state.markers.pop(i)
-                    save_data()
+                    note_write()
+                except ConflictError:
+                    conflict = True
+                else:
                     st.rerun()
 
+            if conflict:
+                # تعديلات جلسة أخرى لها الأولوية: نعيد التحميل في التشغيل القادم
+                st.session_state.data_revision = None
+                st.warning("⚠️ تم تعديل هذا المرفق من جلسة أخرى، تم تحميل آخر نسخة.")
+
+# ------------------------------------------
+# 4. تبويب تحليل التغطية وإمكانية الوصول لكل بلدية
+# ------------------------------------------
+# ألوان البلديات حسب مقياس التحليل (None = ألوان البلديات العادية)
+choropleth = None
+with tab_analysis, stage("analysis_tab"):
+    st.markdown("#### 📊 التغطية وإمكانية الوصول")
+    if geojson_data:
+        # يُعاد الحساب فقط إذا تغيرت مواقع أو أنواع المرافق
+        access = accessibility(
+            commune_layer, st.session_state.markers, list(FACILITY_COLORS),
+            lambda m: commune_in_region(st.session_state.facility_index.commune_of(m["id"]), region)
+        )
+        access_level = st.selectbox("🏥 مستوى المرفق:", list(FACILITY_COLORS), key="access_level")
+        st.caption(f"📏 نصف قطر التغطية لهذا المستوى: {COVERAGE_RADIUS_KM.get(access_level, 10)} كم")
+        access_metric = st.selectbox(
+            "🗺️ تلوين الخريطة حسب:", ["none"] + list(ACCESS_METRICS),
+            format_func=lambda key: ACCESS_METRICS.get(key, "ألوان البلديات (بدون تحليل)"), key="access_metric"
+        )
+        if access_metric != "none":
+            choropleth, breaks = choropleth_colors(access.values(access_level, access_metric))
+            legend = "".join(
+                f"<div><span style='background: {color}; padding: 0 12px; margin-left: 6px;'></span>{low:,.1f} - {high:,.1f}</div>"
+                for color, low, high in breaks
+            )
+            legend += f"<div><span style='background: {CHOROPLETH_MISSING}; padding: 0 12px; margin-left: 6px;'></span>لا يوجد مرفق</div>"
+            st.markdown(f"<div style='direction: rtl; font-size: 13px;'>{legend}</div>", unsafe_allow_html=True)
+
+        st.dataframe(access.commune_rows(access_level), hide_index=True, use_container_width=True)
+        with st.expander("🏥 حوض كل مرفق (السكان الأقرب إليه)"):
+            names_by_id = {m["id"]: m.get("name_ar") or m.get("name_fr", "") for m in st.session_state.markers}
+            st.dataframe([
+                {"المرفق": names_by_id.get(marker_id, ""), "سكان الحوض": int(pop), "داخل نصف القطر": int(covered)}
+                for marker_id, pop, covered in access.catchments[access_level]
+            ], hide_index=True, use_container_width=True)
+        st.download_button("⬇️ تحميل الجدول (CSV)", access.to_csv(), file_name="accessibility.csv", mime="text/csv", use_container_width=True)
+
 # ------------------------------------------
-# 4. تبويب تصدير وطباعة الخريطة (PDF فقط)
+# 5. تبويب تصدير وطباعة الخريطة (PDF فقط)
 # ------------------------------------------
-with tab_export:
+with tab_export, stage("export_tab"):
     st.markdown("#### 📤 تصدير الخريطة")
     components.html("""
         <script>
@@ -353,21 +601,44 @@ with tab_export:
         </div>
     """, height=150)
 
+    # تصدير من الخادم: لا يعتمد على المتصفح ولا على البلاطات، ويدعم ورقة لكل بلدية أو لكل نوع
+    if commune_layer:
+        st.markdown("---")
+        st.markdown("#### 🗂️ تصدير من الخادم (SVG / PNG / PDF)")
+        export_format = st.selectbox("الصيغة:", EXPORT_FORMATS, key="export_format")
+        export_size = st.selectbox("حجم الورقة:", list(SHEET_SIZES_MM), key="export_size")
+        export_mode = st.radio("الأوراق:", ["الخريطة المحفوظة", "ورقة لكل بلدية", "ورقة لكل نوع مرفق"], key="export_mode")
+        export_title = st.text_input("عنوان الخريطة:", "الخريطة الصحية لولاية المسيلة", key="export_title")
+        if export_format != "SVG" and RASTER_ARABIC is None:
+            st.warning("⚠️ هذا الخادم لا يستطيع رسم النص العربي في PNG/PDF (ينقص arabic-reshaper و python-bidi). استعمل SVG.")
+        if st.button("⚙️ إنشاء الملف", use_container_width=True):
+            st.session_state.pop("export_file", None)
+            with st.spinner("جاري رسم الأوراق..."):
+                if export_mode == "ورقة لكل بلدية":
+                    sheets = commune_sheets(commune_layer, region, st.session_state.markers, st.session_state.facility_index, export_size, export_title)
+                elif export_mode == "ورقة لكل نوع مرفق":
+                    sheets = type_sheets(st.session_state.global_settings, st.session_state.markers, list(FACILITY_COLORS), export_size, export_title)
+                else:
+                    sheets = [saved_view_sheet(st.session_state.global_settings, st.session_state.markers, export_size, export_title)]
+                try:
+                    st.session_state.export_file = export_sheets(
+                        sheets, export_format, commune_layer, commune_styles_of(region),
+                        st.session_state.global_settings, FACILITY_COLORS
+                    )
+                except ArabicTextError as error:
+                    st.error(f"⚠️ {error}")
+        if "export_file" in st.session_state:
+            content, mime, file_name = st.session_state.export_file
+            st.download_button("⬇️ تحميل الملف", content, file_name=file_name, mime=mime, use_container_width=True)
+        st.caption(f"💡 SVG ملف متجه يحافظ على النص العربي كما هو؛ PNG و PDF صور نقطية بدقة {EXPORT_DPI} نقطة/بوصة "
+                   "(PDF ليس ملفاً متجهاً). الخط العربي للصيغ النقطية عبر متغير HEALTHMAP_FONT.")
+
 # ==========================================
 # 3. إعداد الخريطة ورسم البيانات
 # ==========================================
 saved_zoom = st.session_state.global_settings.get("map_zoom", 9)
 saved_center = st.session_state.global_settings.get("map_center", [35.3, 4.5])
 
-m = folium.Map(
-    location=saved_center, 
-    zoom_start=saved_zoom, 
-    tiles=None, 
-    control_scale=True,
-    zoom_snap=0.25,  
-    zoom_delta=0.25
-)
-
 class DynamicScalePlugin(MacroElement):
     _template = Template("""
     {% macro script(this, kwargs) %}
@@ -384,110 +655,149 @@ class DynamicScalePlugin(MacroElement):
     {% endmacro %}
     """)
 
-m.add_child(DynamicScalePlugin())
+def build_base_map():
+    m = folium.Map(
+        location=saved_center, 
+        zoom_start=saved_zoom, 
+        tiles=None, 
+        control_scale=True,
+        zoom_snap=0.25,  
+        zoom_delta=0.25
+    )
+    m.add_child(DynamicScalePlugin())
+    # أنماط الأيقونات المشتركة تُرسل مرة واحدة مع الخريطة الأساسية
+    m.add_child(IconStyleSheet(FACILITY_COLORS))
+    return m
 
-if geojson_data:
+# ------------------------------------------
+# الخريطة الأساسية والطبقات المتغيرة (البلديات، أسماؤها والمرافق) تُرسم مرة واحدة لكل حالة
+# وتُشارك بين الجلسات عبر ذاكرة الرسم؛ المجموعات المتغيرة تُرسل منفصلة عن الخريطة الأساسية،
+# فتبقى الخريطة محملة في المتصفح عند تحريكها أو تغير الألوان أو الأسماء أو المرافق
+# ------------------------------------------
+render_cache = get_render_cache()
+
+def map_view(base, focus=None):
+    # التكبير والإطار الحاليان في المتصفح (آخر قيمة أرجعها المكون)، وإلا العرض المحفوظ؛
+    # نتيجة بحث اختيرت للتو تسبق ما أرجعه المكون لأن الخريطة لم تتحرك بعد
+    if focus is not None:
+        return focus["zoom"], view_bounds(focus["center"], focus["zoom"])
+    returned = st.session_state.get(base["key"]) or {}
+    zoom = returned.get("zoom") or saved_zoom
+    return zoom, component_bounds(returned.get("bounds")) or view_bounds(saved_center, zoom)
+
+def build_communes(layer, styles, colors, lod_zoom):
+    # كل بلديات الولاية (وليس الإطار الظاهر فقط، حتى لا يتغير النص بالتحريك) بالمستوى المبسط المناسب للتكبير
+    # بدل كل الرؤوس، كـ TopoJSON مكمّم (كل حد مشترك مرة واحدة) يُفك في المتصفح
+    start("commune_layer")
     def style_function(feature):
-        name_ar_key = feature['properties'].get('name:ar', feature['properties'].get('name', ''))
-        style = st.session_state.commune_styles.get(name_ar_key, {"color": "#e3f2fd"})
+        name_ar_key = commune_key(feature)
+        if colors is not None:
+            return {'fillColor': colors.get(name_ar_key, CHOROPLETH_MISSING), 'color': '#0d47a1', 'weight': 1.5, 'fillOpacity': 0.75}
+        style = styles.get(name_ar_key, {"color": "#e3f2fd"})
         opacity = 0.7 if style["color"] != "#e3f2fd" else 0.4
         return {'fillColor': style["color"], 'color': '#0d47a1', 'weight': 1.5, 'fillOpacity': opacity}
 
-    folium.GeoJson(
-        geojson_data, name="بلديات المسيلة", style_function=style_function,
-        highlight_function=lambda feature: {'weight': 3, 'color': '#b71c1c', 'fillOpacity': 0.8}
-    ).add_to(m)
-
-    for feature in geojson_data['features']:
-        props = feature['properties']
-        geom = feature['geometry']
-        name_ar_key = props.get('name:ar', props.get('name', ''))
-        c_style = st.session_state.commune_styles.get(name_ar_key, {"show_name": show_names, "lang": lang})
-        
-        if c_style["show_name"]:
-            lang_key_to_use = 'name:ar' if c_style["lang"] == "العربية" else 'name:fr'
-            name_to_display = props.get(lang_key_to_use, props.get('name', ''))
-            coords = []
-            if geom['type'] == 'Polygon': coords = geom['coordinates'][0]
-            elif geom['type'] == 'MultiPolygon': coords = geom['coordinates'][0][0]
-            
-            if coords:
-                lats = [p[1] for p in coords]
-                lons = [p[0] for p in coords]
-                folium.Marker(
-                    location=[sum(lats)/len(lats), sum(lons)/len(lons)],
-                    icon=folium.DivIcon(html=f"""<div style="font-size: 13px; font-weight: bold; color: #1a237e; background: transparent; text-shadow: -1px -1px 0 #fff, 1px -1px 0 #fff, -1px 1px 0 #fff, 1px 1px 0 #fff; transform: translate(-50%, -50%) scale(var(--marker-scale, 1)); transition: transform 0.2s ease-out; transform-origin: center center; white-space: nowrap; direction: {"rtl" if c_style["lang"] == "العربية" else "ltr"}; pointer-events: none;">{name_to_display}</div>""")
-                ).add_to(m)
-
-for marker in st.session_state.markers:
-    m_type = marker.get('type', 'مستشفى')
-    
-    def_col = FACILITY_COLORS.get(m_type, "#b71c1c")
-    t_x = marker.get('text_x', 0)
-    t_y = marker.get('text_y', 35)
-    f_size = marker.get('font_size', global_font_size)
-    n_color = marker.get('name_color', def_col)
-    
-    lbl_size = marker.get('label_size', 15)
-    lbl_color = marker.get('label_color', def_col)
-    
-    if m_type in ["عيادة H24", "عيادة H12", "عيادة H8"]:
-        label_text = m_type.split(" ")[1]
-        top_lbl = f"<div style='color: {lbl_color}; font-weight: 900; font-size: {lbl_size}px; background: transparent; text-shadow: -1px -1px 0 #fff, 1px -1px 0 #fff, -1px 1px 0 #fff, 1px 1px 0 #fff;'>{label_text}</div>"
-        emoji = "🏥"
-    elif m_type == "قاعة علاج":
-        top_lbl = ""
-        emoji = "🩺"
-    else: 
-        top_lbl = ""
-        emoji = f"<div style='color: #b71c1c; font-weight: 900; font-size: 24px; font-family: Arial, sans-serif;'>H</div>"
-
-    name_ar = marker.get('name_ar', '')
-    name_fr = marker.get('name_fr', '')
-    display_name = name_ar if lang == "العربية" and name_ar else name_fr if name_fr else name_ar
-    
-    text_html = ""
-    if show_hospital_names:
-        text_html = f"""
-        <div style='
-            position: absolute;
-            top: {t_y}px;
-            left: {t_x}px;
-            transform: translateX(-50%);
-            direction: {"rtl" if lang == "العربية" else "ltr"}; 
-            font-family: Arial, sans-serif; 
-            font-weight: 900; 
-            font-size: {f_size}px; 
-            color: {n_color}; 
-            background: transparent;
-            white-space: nowrap; 
-            text-align: center; 
-            text-shadow: -1px -1px 0 #fff, 1px -1px 0 #fff, -1px 1px 0 #fff, 1px 1px 0 #fff;
-            pointer-events: none;
-        '>
-            {display_name}
-        </div>
-        """
+    group = folium.FeatureGroup(name="البلديات")
+    features = layer.geojson['features']
+    communes = TopoJsonLayer(
+        level_of_detail(layer).topojson(lod_zoom), features, style_function,
+        highlight={'weight': 3, 'color': '#b71c1c', 'fillOpacity': 0.8}
+    )
+    group.add_child(communes)
+    stop("commune_layer", items=len(features), bytes=len(communes.topojson_json))
+    return group
 
-    icon_html = f"""
-    <div style="position: relative; display: flex; flex-direction: column; align-items: center; justify-content: center; transform: translate(-50%, -50%) scale(var(--marker-scale, 1)); transform-origin: center center; transition: transform 0.2s ease-out; width: 40px; height: 40px;">
-        <div style="display: flex; flex-direction: column; align-items: center;">
-            {top_lbl}
-            <div style="font-size: 18px; filter: drop-shadow(2px 3px 3px rgba(0,0,0,0.4));">{emoji}</div>
-        </div>
-        {text_html}
-    </div>
-    """
+# ------------------------------------------
+# ترتيب الأسماء بدون تداخل عند مستوى التكبير الحالي في المتصفح،
+# فتغيير التكبير يعيد إرسال الأسماء فقط؛ الترتيب محفوظ لكل مستوى في الجلسة ويُحدّث جزئياً عند تعديل مرفق
+# ------------------------------------------
 
-    folium.Marker(
-        location=[marker["lat"], marker["lon"]],
-        icon=folium.DivIcon(html=icon_html) 
-    ).add_to(m)
+def build_commune_labels(labels):
+    start("commune_labels")
+    group = folium.FeatureGroup(name="أسماء البلديات")
+    icons = [(label.lat, label.lon, commune_label_html(text, label_lang)) for label, text, label_lang in labels]
+    layer = DivIconLayer(icons)
+    group.add_child(layer)
+    stop("commune_labels", items=len(icons), bytes=len(layer.icons_json))
+    return group
+
+def build_facility_markers(view_zoom, obstacles):
+    start("facility_markers")
+    group = folium.FeatureGroup(name="المرافق الصحية")
+    markers = st.session_state.markers
+    if view_zoom is not None:
+        placer = st.session_state.setdefault("label_placer", LabelPlacer())
+        placer.sync(markers, lang, show_hospital_names, global_font_size)
+        markers = apply_offsets(markers, placer.offsets(view_zoom, obstacles))
+    if len(markers) > CANVAS_MARKER_THRESHOLD:
+        facilities = FacilityCanvasLayer(
+            markers, lang, show_hospital_names, global_font_size, FACILITY_COLORS
+        )
+        size = len(facilities.points_json)
+    else:
+        facilities = DivIconLayer(
+            (marker["lat"], marker["lon"], facility_icon_html(marker, lang, show_hospital_names, global_font_size, FACILITY_COLORS))
+            for marker in markers
+        )
+        size = len(facilities.icons_json)
+    group.add_child(facilities)
+    stop("facility_markers", items=len(markers), bytes=size)
+    return group
+
+start("map_build")
+cache_before = render_cache.stats()
+base_map = render_cache.get_or_render(
+    state_key("base_map", saved_zoom, saved_center),
+    lambda: render_map(build_base_map())
+)
+current_view, current_bounds = map_view(base_map, st.session_state.pop("map_focus_pending", None))
+view_zoom = zoom_key(current_view) if auto_labels else None
+
+# الولايات التي يقطعها الإطار الظاهر (مع هامش)، كل واحدة كاملة في مجموعة: التحريك داخل نفس الولايات
+# لا يغير نص أي مجموعة فلا يُرسل شيء جديد للخريطة؛ ألوان التحليل للولاية المختارة فقط
+dynamic_layers = []
+region_labels = []
+for view_region, view_layer, _ in registry.visible(padded(current_bounds)):
+    view_styles = commune_styles_of(view_region)
+    view_colors = choropleth if view_region == region else None
+    lod_level = level_of_detail(view_layer).level_for(current_view)
+    dynamic_layers.append(render_cache.get_or_render(
+        state_key("communes", len(dynamic_layers), view_layer.version, lod_level, view_styles, view_colors),
+        lambda: render_feature_group(build_communes(view_layer, view_styles, view_colors, current_view), len(dynamic_layers))
+    ))
+    region_labels.extend(
+        (label._replace(key=style_key(view_region, label.key)), text, label_lang)
+        for label, text, label_lang in commune_labels(view_layer, view_styles, show_names, lang)
+    )
+# أسماء البلديات تُرتب وتُرسل لكل الولايات الظاهرة كاملة وليس للإطار فقط: النتيجة لا تتغير بالتحريك داخل نفس الولايات،
+# فلا تُعاد مجموعة الأسماء، وتبقى عوائق أسماء المرافق نفسها ويبقى ترتيبها المحفوظ (التحديث الجزئي) صالحاً
+if auto_labels:
+    shown = {label.key for label in place_commune_labels([label for label, _, _ in region_labels], view_zoom)}
+    region_labels = [item for item in region_labels if item[0].key in shown]
+label_obstacles = tuple(label for label, _, _ in region_labels)
+if region_labels:
+    dynamic_layers.append(render_cache.get_or_render(
+        state_key("commune_labels", len(dynamic_layers), region_labels),
+        lambda: render_feature_group(build_commune_labels(region_labels), len(dynamic_layers))
+    ))
+facility_zoom = view_zoom if show_hospital_names else None
+dynamic_layers.append(render_cache.get_or_render(
+    state_key("facilities", len(dynamic_layers), st.session_state.markers, lang, show_hospital_names, global_font_size,
+              facility_zoom, label_obstacles if facility_zoom is not None else None),
+    lambda: render_feature_group(build_facility_markers(facility_zoom, label_obstacles), len(dynamic_layers))
+))
+cache_after = render_cache.stats()
+stop("map_build", items=len(st.session_state.markers),
+     hits=cache_after["hits"] - cache_before["hits"], misses=cache_after["misses"] - cache_before["misses"])
 
 # ==========================================
 # استشعار حركة الخريطة (نظام الحفظ اليدوي الذكي)
 # ==========================================
-map_data = st_folium(m, use_container_width=True, height=700, returned_objects=["zoom", "center"])
+with stage("st_folium"):
+    # الانتقال إلى نتيجة البحث: التكبير والمركز يُطبقان على الخريطة الموجودة في المتصفح
+    map_focus = st.session_state.get("map_focus") or {}
+    map_data = folium_component(base_map, dynamic_layers, height=700, returned_objects=["zoom", "center", "bounds"],
+                                zoom=map_focus.get("zoom"), center=map_focus.get("center"))
 
 if map_data and map_data.get("zoom") is not None and map_data.get("center") is not None:
     current_zoom = map_data["zoom"]
@@ -505,6 +815,36 @@ if map_data and map_data.get("zoom") is not None and map_data.get("center") is n
         if col2.button("💾 حفظ العرض الافتراضي", use_container_width=True):
             st.session_state.global_settings["map_zoom"] = current_zoom
             st.session_state.global_settings["map_center"] = current_center
-            save_data()
+            # الخريطة الجديدة تبدأ من العرض المحفوظ، لا من آخر نتيجة بحث
+            st.session_state.pop("map_focus", None)
+            save_global_settings()
             st.success("تم حفظ الموضع بنجاح!")
             st.rerun()
+
+
+# ==========================================
+# لوحة الأداء (للمسؤول، فقط مع HEALTHMAP_PERF=1)
+# ==========================================
+if perf_monitor:
+    last_rerun = perf_monitor.end_rerun()
+    rolling = perf_monitor.percentiles()
+    with st.sidebar.expander("⏱️ الأداء"):
+        st.caption(f"هذا التشغيل: {last_rerun['total_ms']:.0f} ms — عدد التشغيلات منذ بدء الخادم: {perf_monitor.reruns}")
+        perf_rows = []
+        # مراحل هذا التشغيل، ثم المراحل التي لم تعمل فيه (طبقات مخزنة، كتابة مؤجلة) بنسبها فقط
+        for name in list(last_rerun["stages"]) + [n for n in rolling if n not in last_rerun["stages"] and n != "total"]:
+            entry = last_rerun["stages"].get(name, {})
+            p = rolling.get(name, {})
+            perf_rows.append({
+                "المرحلة": name, "ms": entry.get("ms"), "مرات": entry.get("calls", 0),
+                "الحجم": entry.get("bytes"), "العناصر": entry.get("items"),
+                "p50": p.get("p50"), "p95": p.get("p95"), "p99": p.get("p99"),
+            })
+        st.dataframe(perf_rows, use_container_width=True, hide_index=True)
+        total = rolling.get("total", {})
+        st.caption(f"آخر {total.get('n', 0)} تشغيل: p50 {total.get('p50', 0):.0f} ms · p95 {total.get('p95', 0):.0f} ms · p99 {total.get('p99', 0):.0f} ms")
+        cache_stats = render_cache.stats()
+        st.caption(f"ذاكرة رسم الخريطة: {cache_stats['hits']} إصابة ({cache_stats['disk_hits']} من القرص) · "
+                   f"{cache_stats['misses']} إخفاق · {cache_stats['entries']} جزء · {cache_stats['bytes'] / 1024 / 1024:.1f} MB"
+                   + (f" · القرص: {cache_stats['disk_entries']} جزء · {cache_stats['disk_bytes'] / 1024 / 1024:.1f} MB"
+                      if render_cache.disk_dir else ""))
@@ -0,0 +1,367 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import folium
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import perf
+from geometry import commune_key, communes_for_points, load_communes
+from marker_icons import FACILITY_COLORS, DivIconLayer, facility_icon_html
+from storage import get_backend
+
+# ==========================================
+# قياس أداء التطبيق على بيانات اصطناعية (بدون متصفح، عبر AppTest)
+# لكل مجموعة بيانات: التشغيل الأول، إعادات التشغيل بدون تغيير، وتعديل مرفق واحد
+# python benchmark.py --markers 10 100 1000 10000 --styled 0 47 --out benchmark.json
+# الجدول في stdout، وتحذيرات Streamlit (تشغيل بدون خادم) في stderr
+# ==========================================
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+GEOJSON_FILE = "msila_communes.geojson"
+# ملفات مشتقة من الحدود تُنسخ مع الحدود حتى لا يُقاس بناؤها في كل مجموعة
+GEOJSON_ARTIFACTS = (".lod.json", ".topo.json", ".bbox.json")
+STAGES = ("geojson_load", "load_data", "general_tab", "add_tab", "manage_tab", "analysis_tab", "export_tab",
+          "commune_layer", "commune_labels", "facility_markers", "map_build", "st_folium", "save_data", "save_write")
+FOLIUM_COMPONENT = "streamlit_folium.st_folium"
+STYLE_COLORS = ("#ffcdd2", "#c8e6c9", "#bbdefb", "#fff9c4", "#d1c4e9", "#ffe0b2")
+DEFAULT_SETTINGS = {
+    "lang": "العربية",
+    "show_names": True,
+    "show_hospital_names": True,
+    "hospital_font_size": 14,
+    "map_zoom": 9,
+    "map_center": [35.3, 4.5]
+}
+
+
+def synthetic_markers(layer, count, seed=0):
+    # نقاط عشوائية داخل حدود البلديات، بأنواع وأسماء متنوعة
+    rng = random.Random(seed)
+    min_x, min_y, max_x, max_y = layer.extent
+    types = list(FACILITY_COLORS)
+    markers = []
+    while len(markers) < count:
+        lons = [rng.uniform(min_x, max_x) for _ in range(count)]
+        lats = [rng.uniform(min_y, max_y) for _ in range(count)]
+        for lon, lat, commune in zip(lons, lats, communes_for_points(layer, lons, lats)):
+            if commune is None or len(markers) == count:
+                continue
+            n = len(markers)
+            m_type = types[n % len(types)]
+            color = FACILITY_COLORS[m_type]
+            markers.append({
+                "id": f"bench{n:06d}", "version": 1,
+                "type": m_type, "name_ar": f"مرفق {n}", "name_fr": f"Structure {n}",
+                "lat": round(lat, 6), "lon": round(lon, 6), "text_x": 0, "text_y": 35,
+                "font_size": DEFAULT_SETTINGS["hospital_font_size"], "name_color": color,
+                "label_size": 15, "label_color": color,
+                "commune": commune
+            })
+    return markers
+
+
+def synthetic_styles(layer, count):
+    styles = {}
+    for n, feature in enumerate(layer.geojson["features"][:count]):
+        styles[commune_key(feature)] = {
+            "color": STYLE_COLORS[n % len(STYLE_COLORS)],
+            "show_name": True,
+            "lang": "العربية" if n % 2 == 0 else "Français"
+        }
+    return styles
+
+
+# ------------------------------------------
+# أيقونات المرافق: DivIconLayer بالأصناف المشتركة مقابل الشكل القديم (Marker + DivIcon لكل مرفق)
+# python benchmark.py --markers --icons 5000 (بدون --markers فارغة تُقاس مجموعات AppTest أيضاً)
+# ------------------------------------------
+ICON_LANG = "العربية"
+LEGACY_HALO = "text-shadow: -1px -1px 0 #fff, 1px -1px 0 #fff, -1px 1px 0 #fff, 1px 1px 0 #fff;"
+
+
+def legacy_icon_html(marker):
+    # نفس HTML الأيقونة قبل IconStyleSheet (أنماط كاملة داخل كل أيقونة)
+    m_type = marker.get('type', 'مستشفى')
+    def_col = FACILITY_COLORS.get(m_type, "#b71c1c")
+    lbl_color = marker.get('label_color', def_col)
+    if m_type in ["عيادة H24", "عيادة H12", "عيادة H8"]:
+        top_lbl = f"<div style='color: {lbl_color}; font-weight: 900; font-size: {marker.get('label_size', 15)}px; background: transparent; {LEGACY_HALO}'>{m_type.split(' ')[1]}</div>"
+        emoji = "🏥"
+    elif m_type == "قاعة علاج":
+        top_lbl, emoji = "", "🩺"
+    else:
+        top_lbl, emoji = "", "<div style='color: #b71c1c; font-weight: 900; font-size: 24px; font-family: Arial, sans-serif;'>H</div>"
+    text_html = f"""
+            <div style='
+                position: absolute;
+                top: {marker.get('text_y', 35)}px;
+                left: {marker.get('text_x', 0)}px;
+                transform: translateX(-50%);
+                direction: rtl;
+                font-family: Arial, sans-serif;
+                font-weight: 900;
+                font-size: {marker.get('font_size', DEFAULT_SETTINGS['hospital_font_size'])}px;
+                color: {marker.get('name_color', def_col)};
+                background: transparent;
+                white-space: nowrap;
+                text-align: center;
+                {LEGACY_HALO}
+                pointer-events: none;
+            '>
+                {marker.get('name_ar', '')}
+            </div>
+            """
+    return f"""
+        <div style="position: relative; display: flex; flex-direction: column; align-items: center; justify-content: center; transform: translate(-50%, -50%) scale(var(--marker-scale, 1)); transform-origin: center center; transition: transform 0.2s ease-out; width: 40px; height: 40px;">
+            <div style="display: flex; flex-direction: column; align-items: center;">
+                {top_lbl}
+                <div style="font-size: 18px; filter: drop-shadow(2px 3px 3px rgba(0,0,0,0.4));">{emoji}</div>
+            </div>
+            {text_html}
+        </div>
+        """
+
+
+def rendered_group_js(fill):
+    # حجم وزمن JavaScript المجموعة وحدها (الخريطة الفارغة تُطرح)
+    empty = folium.Map(location=[35.3, 4.5], zoom_start=9)
+    empty_size = len(empty.get_root().render())
+    m = folium.Map(location=[35.3, 4.5], zoom_start=9)
+    group = folium.FeatureGroup(name="المرافق الصحية")
+    started = time.perf_counter()
+    fill(group)
+    group.add_to(m)
+    size = len(m.get_root().render()) - empty_size
+    return size, time.perf_counter() - started
+
+
+def icon_layer_items(markers):
+    return [(m["lat"], m["lon"], facility_icon_html(m, ICON_LANG, True, DEFAULT_SETTINGS["hospital_font_size"], FACILITY_COLORS))
+            for m in markers]
+
+
+def bench_icons(markers):
+    # JavaScript مجموعة المرافق وزمن رسمها بالشكلين (بدون Streamlit)
+    def legacy(group):
+        for marker in markers:
+            folium.Marker(location=[marker["lat"], marker["lon"]], icon=folium.DivIcon(html=legacy_icon_html(marker))).add_to(group)
+
+    def templated(group):
+        group.add_child(DivIconLayer(icon_layer_items(markers)))
+
+    legacy_bytes, legacy_seconds = rendered_group_js(legacy)
+    new_bytes, new_seconds = rendered_group_js(templated)
+    return {"markers": len(markers), "legacy_bytes": legacy_bytes, "legacy_seconds": legacy_seconds,
+            "bytes": new_bytes, "seconds": new_seconds}
+
+
+def prepare_dataset(directory, layer, markers, styled):
+    source = os.path.join(REPO_DIR, GEOJSON_FILE)
+    shutil.copy2(source, directory)
+    for suffix in GEOJSON_ARTIFACTS:
+        if os.path.exists(source + suffix):
+            shutil.copy2(source + suffix, directory)
+    data = {
+        "markers": synthetic_markers(layer, markers),
+        "commune_styles": synthetic_styles(layer, styled),
+        "global_settings": DEFAULT_SETTINGS
+    }
+    with open(os.path.join(directory, "saved_data.json"), "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+def folium_payload(at):
+    # حجم وسائط مكون st_folium كما تُرسل للمتصفح
+    pending = [at._tree]
+    while pending:
+        node = pending.pop()
+        pending.extend(getattr(node, "children", {}).values())
+        proto = getattr(node, "proto", None)
+        if getattr(proto, "component_name", "") == FOLIUM_COMPONENT:
+            args = json.loads(proto.json_args)
+            parts = {k: len(v.encode("utf-8")) for k, v in args.items() if isinstance(v, str)}
+            return len(proto.json_args.encode("utf-8")), parts
+    return 0, {}
+
+
+def storage_bytes(directory, backend):
+    if backend == "sqlite":
+        return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+                   if name.startswith("saved_data.sqlite"))
+    return os.path.getsize(os.path.join(directory, "saved_data.json"))
+
+
+class StageTimer:
+    def __init__(self):
+        self.times = {}
+        self.bytes_written = 0
+
+    def __call__(self, name, seconds, info):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        if name == "save_write":
+            self.bytes_written += info.get("bytes", 0)
+
+    def reset(self):
+        self.times, self.bytes_written = {}, 0
+
+
+def timed_run(at, timer, run):
+    timer.reset()
+    started = time.perf_counter()
+    run()
+    total = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return {"total": total, "stages": dict(timer.times), "bytes_written": timer.bytes_written}
+
+
+def median_run(runs):
+    stages = {name: statistics.median(r["stages"].get(name, 0.0) for r in runs)
+              for name in {n for r in runs for n in r["stages"]}}
+    return {"total": statistics.median(r["total"] for r in runs), "stages": stages, "runs": len(runs)}
+
+
+def edit_marker(at):
+    # تحريك نص المرفق المختار في تبويب التعديل: كتابة سجل واحد
+    mid = at.radio(key="manage_selected").value
+    field = at.number_input(key=f"tx_{mid}")
+    return lambda: field.set_value(field.value + 5).run()
+
+
+def bench_dataset(layer, markers, styled, backend, reruns, timeout):
+    directory = tempfile.mkdtemp(prefix="healthmap_bench_")
+    cwd = os.getcwd()
+    timer = StageTimer()
+    previous_backend = os.environ.get("HEALTHMAP_STORAGE")
+    try:
+        prepare_dataset(directory, layer, markers, styled)
+        os.chdir(directory)
+        os.environ["HEALTHMAP_STORAGE"] = backend
+        # الموارد المخزنة مرتبطة بالمسارات النسبية (الملفات، التخزين): كل مجموعة تبدأ من الصفر
+        st.cache_resource.clear()
+        st.cache_data.clear()
+        perf.add_listener(timer)
+
+        at = AppTest.from_file(os.path.join(REPO_DIR, "app.py"), default_timeout=timeout)
+        cold = timed_run(at, timer, at.run)
+        payload, parts = folium_payload(at)
+        warm = median_run([timed_run(at, timer, at.run) for _ in range(reruns)])
+
+        before = storage_bytes(directory, backend)
+        edit = timed_run(at, timer, edit_marker(at)) if markers else None
+        if edit is not None and backend == "json":
+            # الكتابة المؤجلة تُفرغ فوراً حتى تُحسب ضمن التعديل (نفس مفتاح get_backend في app.py)
+            timer.reset()
+            get_backend("json", "saved_data.json").flush()
+            edit["bytes_written"] += timer.bytes_written
+            edit["stages"]["save_write"] = edit["stages"].get("save_write", 0.0) + timer.times.get("save_write", 0.0)
+        elif edit is not None:
+            # SQLite لا يمر عبر save_write: ما أضيف إلى الملف وسجل WAL
+            edit["bytes_written"] = max(storage_bytes(directory, backend) - before, 0)
+        return {
+            "markers": markers, "styled": styled, "backend": backend,
+            "cold": cold, "warm": warm, "edit": edit,
+            "payload_bytes": payload, "payload_parts": parts,
+            "file_bytes": storage_bytes(directory, backend),
+        }
+    finally:
+        perf.remove_listener(timer)
+        os.chdir(cwd)
+        if previous_backend is None:
+            os.environ.pop("HEALTHMAP_STORAGE", None)
+        else:
+            os.environ["HEALTHMAP_STORAGE"] = previous_backend
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result):
+    return (result["markers"], result["styled"], result["backend"])
+
+
+def print_table(results, baseline=None):
+    base = {case_key(r): r for r in (baseline or {}).get("results", [])}
+    header = f"{'markers':>7} {'styled':>6} {'backend':>7} {'cold s':>7} {'warm s':>7} {'edit s':>7} {'map KB':>8} {'written':>9}"
+    print(header + ("   vs baseline (warm, KB)" if base else ""))
+    for r in results:
+        edit = r["edit"]["total"] if r["edit"] else 0.0
+        written = r["edit"]["bytes_written"] if r["edit"] else 0
+        line = (f"{r['markers']:>7} {r['styled']:>6} {r['backend']:>7} {r['cold']['total']:>7.2f} "
+                f"{r['warm']['total']:>7.2f} {edit:>7.2f} {r['payload_bytes'] / 1024:>8.1f} {written:>9}")
+        old = base.get(case_key(r))
+        if old:
+            line += f"   x{r['warm']['total'] / old['warm']['total']:.2f}, x{r['payload_bytes'] / max(old['payload_bytes'], 1):.2f}"
+        print(line)
+    stage_names = [s for s in STAGES if any(s in r["warm"]["stages"] for r in results)]
+    print("\nwarm stages (ms): " + ", ".join(stage_names))
+    for r in results:
+        print(f"{r['markers']:>7} {r['styled']:>6} {r['backend']:>7} " +
+              " ".join(f"{r['warm']['stages'].get(s, 0.0) * 1000:>9.1f}" for s in stage_names))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HealthMap rerun latency, map payload and persistence benchmark")
+    parser.add_argument("--markers", type=int, nargs="*", default=[10, 100, 1000, 10000])
+    parser.add_argument("--styled", type=int, nargs="+", default=[0, 47])
+    parser.add_argument("--backend", choices=["json", "sqlite"], nargs="+", default=["json"])
+    parser.add_argument("--reruns", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--baseline", help="نتائج سابقة للمقارنة")
+    parser.add_argument("--icons", type=int, default=0, help="عدد المرافق لمقارنة أيقونات DivIconLayer بالشكل القديم")
+    args = parser.parse_args(argv)
+
+    layer = load_communes(os.path.join(REPO_DIR, GEOJSON_FILE))
+    if layer is None:
+        sys.exit(f"{GEOJSON_FILE} not found")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    icons = None
+    if args.icons:
+        print(f"... icons: {args.icons} markers", file=sys.stderr)
+        icons = bench_icons(synthetic_markers(layer, args.icons))
+
+    results = []
+    for backend in args.backend:
+        for styled in args.styled:
+            for markers in args.markers:
+                print(f"... {markers} markers, {styled} styled communes, {backend}", file=sys.stderr)
+                results.append(bench_dataset(layer, markers, styled, backend, args.reruns, args.timeout))
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "streamlit": st.__version__,
+        "results": results,
+        "icons": icons,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if results:
+        print_table(results, baseline)
+    if icons:
+        print(f"\nicons ({icons['markers']} markers): legacy {icons['legacy_bytes'] / 1024:.0f} KB "
+              f"{icons['legacy_seconds']:.2f} s -> {icons['bytes'] / 1024:.0f} KB {icons['seconds']:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
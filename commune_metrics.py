@@ -0,0 +1,178 @@
+from dataclasses import dataclass
+from typing import Mapping, Optional, Tuple
+
+import numpy as np
+import streamlit as st
+
+from geometry import polygons
+from spatial_index import EARTH_RADIUS_KM
+
+# ==========================================
+# مقاييس البلديات: موضع الاسم (أبعد نقطة داخلية عن الحدود)، المساحة، المحيط، الإطار والكثافة
+# تُحسب مرة واحدة لكل نسخة من الحدود وتُشارك بين الخريطة والتحليل والتصدير
+# ==========================================
+# دقة موضع الاسم (كم)
+LABEL_PRECISION_KM = 0.1
+# عدد النقاط في كل دفعة من مصفوفة (نقاط × أضلاع)
+POLYLABEL_CHUNK = 256
+POLYLABEL_MAX_LEVELS = 32
+
+
+def commune_population(feature):
+    try:
+        return int(float(feature["properties"].get("population", 0)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _project(ring, lon0, lat0):
+    # إسقاط محلي متساوي المسافات حول مركز البلدية (كم)
+    rad = np.radians(np.asarray(ring, dtype=float)[:, :2])
+    return np.column_stack([(rad[:, 0] - np.radians(lon0)) * np.cos(np.radians(lat0)),
+                            rad[:, 1] - np.radians(lat0)]) * EARTH_RADIUS_KM
+
+
+def _signed_distance(points, a, b):
+    # المسافة إلى أقرب ضلع، موجبة داخل المضلع (زوجية تقاطع الشعاع مع كل الحلقات) وسالبة خارجه
+    result = np.empty(len(points))
+    ab = b - a
+    length2 = np.maximum((ab ** 2).sum(axis=1), 1e-18)
+    for start in range(0, len(points), POLYLABEL_CHUNK):
+        px = points[start:start + POLYLABEL_CHUNK, 0, None]
+        py = points[start:start + POLYLABEL_CHUNK, 1, None]
+        t = np.clip(((px - a[:, 0]) * ab[:, 0] + (py - a[:, 1]) * ab[:, 1]) / length2, 0.0, 1.0)
+        dx = a[:, 0] + t * ab[:, 0] - px
+        dy = a[:, 1] + t * ab[:, 1] - py
+        distance = np.sqrt((dx ** 2 + dy ** 2).min(axis=1))
+        straddles = (a[:, 1] > py) != (b[:, 1] > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = ab[:, 0] * (py - a[:, 1]) / ab[:, 1] + a[:, 0]
+        inside = np.count_nonzero(straddles & (px < x_cross), axis=1) % 2 == 1
+        result[start:start + POLYLABEL_CHUNK] = np.where(inside, distance, -distance)
+    return result
+
+
+def polylabel(rings, precision=LABEL_PRECISION_KM):
+    # نفس فكرة polylabel (تقسيم رباعي مع حد أعلى d + h√2)، لكن كل مستوى من الخلايا يُقيّم دفعة واحدة
+    # rings: كل حلقات المضلع (أو الأجزاء) بإحداثيات مسقطة؛ يُرجع (x, y, المسافة إلى الحدود)
+    a = np.concatenate([r[:-1] for r in rings])
+    b = np.concatenate([r[1:] for r in rings])
+    points = np.concatenate(rings)
+    min_x, min_y = points.min(axis=0)
+    max_x, max_y = points.max(axis=0)
+    cell = min(max_x - min_x, max_y - min_y)
+    if cell <= 0:
+        return min_x, min_y, 0.0
+
+    best = np.array([(min_x + max_x) / 2, (min_y + max_y) / 2])
+    best_d = _signed_distance(best[None, :], a, b)[0]
+
+    h = cell / 2
+    xs = np.arange(min_x, max_x, cell) + h
+    ys = np.arange(min_y, max_y, cell) + h
+    centers = np.array(np.meshgrid(xs, ys)).reshape(2, -1).T
+    for _ in range(POLYLABEL_MAX_LEVELS):
+        d = _signed_distance(centers, a, b)
+        i = np.argmax(d)
+        if d[i] > best_d:
+            best, best_d = centers[i], d[i]
+        # الخلايا التي لا يمكن أن تحتوي نقطة أفضل بأكثر من الدقة المطلوبة تُترك
+        centers = centers[d + h * np.sqrt(2) - best_d > precision]
+        if len(centers) == 0:
+            break
+        h /= 2
+        centers = np.concatenate([centers + [dx, dy] for dx in (-h, h) for dy in (-h, h)])
+    return best[0], best[1], max(best_d, 0.0)
+
+
+@dataclass(frozen=True)
+class CommuneMetrics:
+    names: Tuple[str, ...]
+    index: Mapping[str, int]
+    # موضع الاسم (lon, lat) ومسافته إلى أقرب حد (كم)
+    anchor_lon: np.ndarray
+    anchor_lat: np.ndarray
+    anchor_clearance_km: np.ndarray
+    area_km2: np.ndarray
+    perimeter_km: np.ndarray
+    # (min_x, min_y, max_x, max_y) لكل بلدية
+    bbox: np.ndarray
+    population: np.ndarray
+    density: np.ndarray
+
+    def anchor(self, name) -> Optional[Tuple[float, float]]:
+        i = self.index.get(name)
+        if i is None or np.isnan(self.anchor_lon[i]):
+            return None
+        return float(self.anchor_lon[i]), float(self.anchor_lat[i])
+
+    def values(self, name):
+        i = self.index[name]
+        return {
+            "area_km2": float(self.area_km2[i]),
+            "perimeter_km": float(self.perimeter_km[i]),
+            "population": int(self.population[i]),
+            "density": float(self.density[i]),
+        }
+
+
+def build_metrics(layer, precision=LABEL_PRECISION_KM) -> CommuneMetrics:
+    names = tuple(layer.by_name)
+    n = len(names)
+    bbox = np.array([layer.bounds[name] for name in names], dtype=float).reshape(n, 4)
+    lon0 = (bbox[:, 0] + bbox[:, 2]) / 2
+    lat0 = (bbox[:, 1] + bbox[:, 3]) / 2
+
+    # كل أضلاع كل البلديات في مصفوفة واحدة: المساحة والمحيط بتجميع حسب البلدية
+    projected, owners, is_outer = [], [], []
+    for i, name in enumerate(names):
+        for polygon in polygons(layer.by_name[name]["geometry"]):
+            for k, ring in enumerate(polygon):
+                if len(ring) < 4:
+                    continue
+                projected.append(_project(ring, lon0[i], lat0[i]))
+                owners.append(i)
+                is_outer.append(k == 0)
+    area = np.zeros(n)
+    perimeter = np.zeros(n)
+    if projected:
+        sizes = np.array([len(r) - 1 for r in projected])
+        a = np.concatenate([r[:-1] for r in projected])
+        b = np.concatenate([r[1:] for r in projected])
+        ring_of_edge = np.repeat(np.arange(len(projected)), sizes)
+        # مساحة كل حلقة (shoelace)، الخارجية موجبة والثقوب سالبة مهما كان اتجاه الرسم
+        ring_area = np.abs(np.bincount(ring_of_edge, weights=a[:, 0] * b[:, 1] - b[:, 0] * a[:, 1]) / 2)
+        ring_area = np.where(is_outer, ring_area, -ring_area)
+        area = np.bincount(owners, weights=ring_area, minlength=n)
+        edge_km = np.sqrt(((b - a) ** 2).sum(axis=1))
+        perimeter = np.bincount(np.array(owners)[ring_of_edge], weights=edge_km, minlength=n)
+
+    anchor_lon = np.full(n, np.nan)
+    anchor_lat = np.full(n, np.nan)
+    clearance = np.zeros(n)
+    ring_owner = np.array(owners)
+    for i in range(n):
+        rings = [projected[k] for k in np.flatnonzero(ring_owner == i)] if projected else []
+        if not rings:
+            continue
+        x, y, clearance[i] = polylabel(rings, precision)
+        anchor_lon[i] = lon0[i] + np.degrees(x / EARTH_RADIUS_KM / np.cos(np.radians(lat0[i])))
+        anchor_lat[i] = lat0[i] + np.degrees(y / EARTH_RADIUS_KM)
+
+    population = np.array([commune_population(layer.by_name[name]) for name in names], dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        density = np.where(area > 0, population / area, np.nan)
+    return CommuneMetrics(
+        names=names, index={name: i for i, name in enumerate(names)},
+        anchor_lon=anchor_lon, anchor_lat=anchor_lat, anchor_clearance_km=clearance,
+        area_km2=area, perimeter_km=perimeter, bbox=bbox, population=population, density=density,
+    )
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _build_commune_metrics(version, _layer):
+    return build_metrics(_layer)
+
+
+def commune_metrics(layer) -> CommuneMetrics:
+    return _build_commune_metrics(layer.version, layer)
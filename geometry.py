@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+
+import numpy as np
+import streamlit as st
+
+# ==========================================
+# طبقة تحميل حدود البلديات (تُقرأ مرة واحدة لكل نسخة من الملف)
+# ==========================================
+COMMUNE_GEOMETRY_TYPES = ("Polygon", "MultiPolygon")
+
+
+def commune_key(feature):
+    # المفتاح المستعمل في commune_styles هو الاسم العربي للبلدية
+    props = feature.get("properties", {})
+    return props.get("name:ar", props.get("name", ""))
+
+
+@dataclass(frozen=True)
+class CommuneLayer:
+    path: str
+    version: str
+    geojson: dict
+    commune_list: Tuple[str, ...]
+    by_name: Mapping[str, dict]
+    bounds: Mapping[str, Tuple[float, float, float, float]]
+    # حلقات كل بلدية كمصفوفات numpy: [(الحلقة الخارجية، [الثقوب])]
+    rings: Mapping[str, list]
+
+    @property
+    def extent(self):
+        # الإطار المحيط بالولاية كاملة (min_x, min_y, max_x, max_y)
+        boxes = list(self.bounds.values())
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    return []
+
+
+def _feature_bounds(feature):
+    xs, ys = [], []
+    for polygon in polygons(feature["geometry"]):
+        xs.extend(p[0] for p in polygon[0])
+        ys.extend(p[1] for p in polygon[0])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def point_in_ring(x, y, ring):
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def point_in_feature(x, y, feature):
+    for polygon in polygons(feature["geometry"]):
+        if point_in_ring(x, y, polygon[0]) and not any(point_in_ring(x, y, hole) for hole in polygon[1:]):
+            return True
+    return False
+
+
+def _rings_contain(ring, xs, ys):
+    # اختبار تقاطع الشعاع لكل النقاط ضد كل أضلاع الحلقة دفعة واحدة
+    x1, y1 = ring[:-1, 0], ring[:-1, 1]
+    x2, y2 = ring[1:, 0], ring[1:, 1]
+    py = ys[:, None]
+    straddles = (y1 > py) != (y2 > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = (x2 - x1) * (py - y1) / (y2 - y1) + x1
+    return np.count_nonzero(straddles & (xs[:, None] < x_cross), axis=1) % 2 == 1
+
+
+def communes_for_points(layer, lons, lats):
+    # نسخة متجهة من CommuneIndex.commune_at لعدد كبير من النقاط
+    xs = np.asarray(lons, dtype=float)
+    ys = np.asarray(lats, dtype=float)
+    result = np.full(len(xs), None, dtype=object)
+    pending = np.ones(len(xs), dtype=bool)
+    for name, (min_x, min_y, max_x, max_y) in layer.bounds.items():
+        candidates = np.flatnonzero(pending & (xs >= min_x) & (xs <= max_x) & (ys >= min_y) & (ys <= max_y))
+        if len(candidates) == 0:
+            continue
+        inside = np.zeros(len(candidates), dtype=bool)
+        for outer, holes in layer.rings[name]:
+            hit = _rings_contain(outer, xs[candidates], ys[candidates])
+            for hole in holes:
+                hit &= ~_rings_contain(hole, xs[candidates], ys[candidates])
+            inside |= hit
+        result[candidates[inside]] = name
+        pending[candidates[inside]] = False
+    return result.tolist()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def parse_communes(raw):
+    # عناصر البلديات فقط (مضلعات)، بمفتاح الاسم العربي
+    geojson_data = json.loads(raw)
+    geojson_data["features"] = [
+        f for f in geojson_data.get("features", [])
+        if (f.get("geometry") or {}).get("type") in COMMUNE_GEOMETRY_TYPES
+    ]
+    return geojson_data
+
+
+def build_layer(path, version, raw) -> CommuneLayer:
+    # مشترك بين كل الجلسات: لا يجب تعديل الكائن المُرجع
+    geojson_data = parse_communes(raw)
+    by_name = {commune_key(f): f for f in geojson_data["features"]}
+    return CommuneLayer(
+        path=path,
+        version=version,
+        geojson=geojson_data,
+        commune_list=tuple(sorted(by_name)),
+        by_name=MappingProxyType(by_name),
+        bounds=MappingProxyType({name: _feature_bounds(f) for name, f in by_name.items()}),
+        rings=MappingProxyType({
+            name: [
+                (np.asarray(polygon[0], dtype=float)[:, :2], [np.asarray(h, dtype=float)[:, :2] for h in polygon[1:]])
+                for polygon in polygons(f["geometry"])
+            ]
+            for name, f in by_name.items()
+        }),
+    )
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _build_layer(path, version, _raw):
+    return build_layer(path, version, _raw)
+
+
+def read_file(path):
+    # (المحتوى، البصمة sha1)
+    with open(path, "rb") as f:
+        raw = f.read()
+    return raw, hashlib.sha1(raw).hexdigest()
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _load_version(path, mtime_ns, size):
+    # التوقيع (mtime, size) يتجنب قراءة الملف، والبصمة sha1 تتجنب إعادة التحليل
+    # إذا تغير التوقيع فقط دون المحتوى
+    raw, version = read_file(path)
+    return _build_layer(path, version, raw)
+
+
+def load_communes(path) -> Optional[CommuneLayer]:
+    if not os.path.exists(path):
+        return None
+    return _load_version(path, *file_signature(path))
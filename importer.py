@@ -0,0 +1,158 @@
+import codecs
+import csv
+import io
+import json
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+
+# ==========================================
+# الاستيراد الجماعي للمرافق (CSV أو GeoJSON)
+# القراءة على دفعات، التحقق من الإحداثيات، وتحديد الولاية والبلدية لكل مرفق (أي ولاية، لا الولاية المعروضة فقط)
+# ==========================================
+IMPORT_CHUNK_SIZE = 1000
+
+COLUMN_ALIASES = {
+    "type": ("type", "النوع", "نوع المرفق", "nature", "categorie", "catégorie"),
+    "name_ar": ("name_ar", "name:ar", "الاسم", "الاسم (عربي)", "nom_ar"),
+    "name_fr": ("name_fr", "name:fr", "nom", "nom_fr", "الاسم (فرنسي)", "name"),
+    "lat": ("lat", "latitude", "y", "خط العرض"),
+    "lon": ("lon", "lng", "long", "longitude", "x", "خط الطول"),
+}
+
+# تسميات فرنسية شائعة في قوائم الوزارة
+FRENCH_TYPE_ALIASES = {
+    "hopital": "مستشفى",
+    "hôpital": "مستشفى",
+    "eph": "مستشفى",
+    "salle de soins": "قاعة علاج",
+    "sds": "قاعة علاج",
+}
+
+
+@dataclass
+class ImportReport:
+    markers: list = field(default_factory=list)
+    # (رقم السطر، سبب الرفض)
+    errors: list = field(default_factory=list)
+    duplicates: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+def _type_aliases(facility_types):
+    aliases = {}
+    for t in facility_types:
+        aliases[t.lower()] = t
+        # "عيادة H24" -> "h24"
+        aliases[t.split()[-1].lower()] = t
+    for alias, t in FRENCH_TYPE_ALIASES.items():
+        if t in facility_types:
+            aliases[alias] = t
+    return aliases
+
+
+def _text_stream(binary):
+    # utf-8 (مع أو بدون BOM) وإلا cp1256 الذي يستعمله Excel العربي
+    sample = binary.read(65536)
+    binary.seek(0)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "cp1256"
+    return io.TextIOWrapper(binary, encoding=encoding, newline="")
+
+
+def read_csv_rows(binary):
+    text = _text_stream(binary)
+    sample = text.read(8192)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(text, dialect=dialect)
+    # الأسطر مرقمة كما في الجدول (السطر 1 هو العناوين)
+    for row_number, row in enumerate(reader, start=2):
+        yield row_number, {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+
+
+def read_geojson_rows(binary):
+    data = json.load(_text_stream(binary))
+    for row_number, feature in enumerate(data.get("features", []), start=1):
+        geometry = feature.get("geometry") or {}
+        row = {str(k).strip().lower(): str(v).strip() for k, v in (feature.get("properties") or {}).items() if v is not None}
+        if geometry.get("type") == "Point":
+            row["lon"], row["lat"] = (str(c) for c in geometry["coordinates"][:2])
+        yield row_number, row
+
+
+def _field(row, name):
+    for alias in COLUMN_ALIASES[name]:
+        if row.get(alias):
+            return row[alias]
+    return ""
+
+
+def _number(value):
+    return float(value.replace(",", "."))
+
+
+def _parse_row(row, type_aliases):
+    fac_type = type_aliases.get(_field(row, "type").lower())
+    if fac_type is None:
+        raise ValueError(f"نوع غير معروف: '{_field(row, 'type')}'")
+    name_ar, name_fr = _field(row, "name_ar"), _field(row, "name_fr")
+    if not (name_ar or name_fr):
+        raise ValueError("الاسم مفقود")
+    try:
+        lat, lon = _number(_field(row, "lat")), _number(_field(row, "lon"))
+    except ValueError:
+        raise ValueError("إحداثيات غير صالحة")
+    return {"type": fac_type, "name_ar": name_ar, "name_fr": name_fr, "lat": lat, "lon": lon}
+
+
+def dedupe_key(record):
+    # نفس الاسم في نفس الموضع تقريباً (حوالي 10 أمتار)
+    name = (record.get("name_ar") or record.get("name_fr") or "").strip().lower()
+    return name, round(record["lat"], 4), round(record["lon"], 4)
+
+
+def import_facilities(binary, filename, locate, facility_types, existing_markers=(), chunk_size=IMPORT_CHUNK_SIZE):
+    # locate(lon, lat) -> "الولاية/البلدية" أو None خارج كل الولايات (LayerRegistry.locate_key)؛ None = بدون تحقق
+    started = time.perf_counter()
+    report = ImportReport()
+    type_aliases = _type_aliases(facility_types)
+    seen = {dedupe_key(m) for m in existing_markers}
+
+    is_geojson = filename.lower().endswith((".geojson", ".json"))
+    rows = read_geojson_rows(binary) if is_geojson else read_csv_rows(binary)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        report.rows += len(chunk)
+        for row_number, row in chunk:
+            try:
+                record = _parse_row(row, type_aliases)
+            except ValueError as e:
+                report.errors.append((row_number, str(e)))
+                continue
+            commune = locate(record["lon"], record["lat"]) if locate is not None else None
+            if locate is not None and commune is None:
+                report.errors.append((row_number, "خارج حدود الولايات"))
+                continue
+            key = dedupe_key(record)
+            if key in seen:
+                report.duplicates += 1
+                continue
+            seen.add(key)
+            record["commune"] = commune
+            report.markers.append(record)
+    report.seconds = time.perf_counter() - started
+    return report
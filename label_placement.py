@@ -0,0 +1,330 @@
+import collections
+import math
+from typing import NamedTuple, Optional, Tuple
+
+from commune_metrics import commune_metrics
+from geometry import commune_key
+from marker_canvas import display_name
+from marker_icons import DEFAULT_TEXT_X, DEFAULT_TEXT_Y, FACILITY_COLORS, marker_scale
+
+# ==========================================
+# ترتيب أسماء المرافق والبلديات بدون تداخل لكل مستوى تكبير
+# كل اسم صندوق بالبكسل (من حجم الخط وطول النص) حول موضع المرفق المسقط، والصناديق الموضوعة
+# في شبكة منتظمة: فحص موضع مرشح لا يقارن إلا بالصناديق في نفس الخلايا
+# الموضع الذي عدّله المستخدم يدوياً (text_x/text_y غير الافتراضيين) مثبت ولا يُحرك،
+# والاسم الذي لا يجد موضعاً خالياً يُخفى عند هذا التكبير ويظهر عند التكبير أكثر
+# ==========================================
+# عرض الحرف التقريبي وارتفاع السطر نسبة إلى حجم الخط (Arial عريض)
+LABEL_CHAR_WIDTH = 0.6
+LABEL_LINE_HEIGHT = 1.2
+# حجم خلية الشبكة (بكسل)
+LABEL_GRID_PX = 64
+# صندوق المرفق (.hm-facility) والجزء المرسوم منه (الرمز والشارة) الذي لا يغطيه اسم
+FACILITY_BOX_PX = 40
+ICON_BOX_PX = 28
+LABEL_GAP_PX = 2
+COMMUNE_FONT_PX = 13
+# مستويات التكبير تُقرّب لخطوة zoom_snap، وعدد المستويات المحفوظة لكل جلسة
+LABEL_ZOOM_STEP = 0.25
+LABEL_ZOOM_CACHE = 8
+# الأولوية: المستشفيات ثم العيادات حسب الترتيب في قاموس الألوان
+TYPE_PRIORITY = {m_type: i for i, m_type in enumerate(FACILITY_COLORS)}
+
+
+class LabelSpec(NamedTuple):
+    lon: float
+    lat: float
+    # أبعاد الاسم قبل تكبير الأيقونات (0 إذا لم يُعرض اسم)
+    width: float
+    height: float
+    # الموضع المثبت يدوياً، أو None للترتيب التلقائي
+    pinned: Optional[Tuple[float, float]]
+    priority: tuple
+
+
+class CenteredLabel(NamedTuple):
+    # اسم في وسط نقطة (أسماء البلديات)
+    key: str
+    lon: float
+    lat: float
+    width: float
+    height: float
+
+
+def zoom_key(zoom):
+    return round(float(zoom) / LABEL_ZOOM_STEP) * LABEL_ZOOM_STEP
+
+
+def world_pixel(lon, lat, zoom):
+    # نفس إسقاط Leaflet (مركاتور) بالبكسل عند مستوى التكبير
+    size = 256 * 2 ** zoom
+    lat = math.radians(max(-85.0511, min(85.0511, lat)))
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0
+    return x * size, y * size
+
+
+def text_size(text, font_size):
+    return len(text) * font_size * LABEL_CHAR_WIDTH, font_size * LABEL_LINE_HEIGHT
+
+
+def label_spec(marker, lang, show_names, default_font_size):
+    text = display_name(marker, lang) if show_names else ""
+    font_size = marker.get('font_size', default_font_size)
+    width, height = text_size(text, font_size) if text else (0.0, 0.0)
+    offset = (marker.get('text_x', DEFAULT_TEXT_X), marker.get('text_y', DEFAULT_TEXT_Y))
+    pinned = offset if offset != (DEFAULT_TEXT_X, DEFAULT_TEXT_Y) else None
+    m_type = marker.get('type', 'مستشفى')
+    return LabelSpec(
+        float(marker["lon"]), float(marker["lat"]), width, height, pinned,
+        (TYPE_PRIORITY.get(m_type, len(TYPE_PRIORITY)), -font_size, str(marker.get("id", ""))),
+    )
+
+
+def candidates(width, height):
+    # مواضع text_x/text_y المرشحة بالترتيب، الموضع الافتراضي أولاً
+    # الاسم يتوسط text_x أفقياً وأعلاه عند text_y، داخل صندوق المرفق الذي مركزه (20, 20)
+    c, r = FACILITY_BOX_PX / 2, ICON_BOX_PX / 2 + LABEL_GAP_PX
+    below, above, middle = DEFAULT_TEXT_Y, c - r - height, c - height / 2
+    right, left = c + r + width / 2, c - r - width / 2
+    return [(round(x), round(y)) for x, y in (
+        (DEFAULT_TEXT_X, below), (c, below), (DEFAULT_TEXT_X, above), (c, above),
+        (right, middle), (left, middle), (right, below), (left, below), (right, above), (left, above),
+    )]
+
+
+class LabelLayout:
+    # الصناديق الموضوعة عند مستوى تكبير واحد، مفهرسة في شبكة خلايا
+    def __init__(self, zoom, cell=LABEL_GRID_PX):
+        self.zoom = zoom
+        self.scale = marker_scale(zoom)
+        self.cell = cell
+        self.boxes = {}
+        self.cells = collections.defaultdict(set)
+        self.points = {}
+        self.offsets = {}
+
+    def _cells_of(self, box):
+        cell = self.cell
+        return [(i, j) for i in range(int(box[0] // cell), int(box[2] // cell) + 1)
+                for j in range(int(box[1] // cell), int(box[3] // cell) + 1)]
+
+    def add(self, key, box):
+        self.boxes[key] = box
+        for cell in self._cells_of(box):
+            self.cells[cell].add(key)
+
+    def remove(self, key):
+        box = self.boxes.pop(key, None)
+        if box is not None:
+            for cell in self._cells_of(box):
+                self.cells[cell].discard(key)
+
+    def near(self, box):
+        keys = set()
+        for cell in self._cells_of(box):
+            keys.update(self.cells.get(cell, ()))
+        return keys
+
+    def collides(self, box, ignore=()):
+        # يتوقف عند أول تقاطع؛ يُستدعى لكل موضع مرشح لكل اسم
+        cell, cells, boxes = self.cell, self.cells, self.boxes
+        x0, y0, x1, y1 = box
+        for i in range(int(x0 // cell), int(x1 // cell) + 1):
+            for j in range(int(y0 // cell), int(y1 // cell) + 1):
+                for key in cells.get((i, j), ()):
+                    other = boxes[key]
+                    if x0 < other[2] and other[0] < x1 and y0 < other[3] and other[1] < y1 and key not in ignore:
+                        return True
+        return False
+
+    def point(self, lon, lat):
+        # مركز الأيقونة: DivIcon الافتراضي 12x12 ومرساته في وسطه
+        x, y = world_pixel(lon, lat, self.zoom)
+        return x - 6, y - 6
+
+    def icon_box(self, center):
+        half = ICON_BOX_PX / 2 * self.scale
+        return (center[0] - half, center[1] - half, center[0] + half, center[1] + half)
+
+    def label_box(self, center, offset, width, height):
+        # نفس رسم .hm-name: left/top داخل صندوق المرفق ثم translateX(-50%)، والكل مكبر حول المركز
+        s = self.scale
+        left = center[0] + s * (offset[0] - FACILITY_BOX_PX / 2 - width / 2)
+        top = center[1] + s * (offset[1] - FACILITY_BOX_PX / 2)
+        return (left, top, left + s * width, top + s * height)
+
+    def centered_box(self, label):
+        x, y = self.point(label.lon, label.lat)
+        half_w, half_h = label.width * self.scale / 2, label.height * self.scale / 2
+        return (x - half_w, y - half_h, x + half_w, y + half_h)
+
+    def _add_marker(self, mid, spec):
+        center = self.points[mid] = self.point(spec.lon, spec.lat)
+        self.add(("icon", mid), self.icon_box(center))
+        if spec.pinned is not None and spec.width:
+            self.add(("label", mid), self.label_box(center, spec.pinned, spec.width, spec.height))
+
+    def _place(self, mid, spec):
+        # أول موضع خالٍ، وإلا يُخفى الاسم (None)
+        center = self.points[mid]
+        ignore = (("icon", mid),)
+        self.offsets[mid] = None
+        for offset in candidates(spec.width, spec.height):
+            box = self.label_box(center, offset, spec.width, spec.height)
+            if not self.collides(box, ignore):
+                self.offsets[mid] = offset
+                self.add(("label", mid), box)
+                return
+
+    def build(self, specs, obstacles=()):
+        for label in obstacles:
+            self.add(("fixed", label.key), self.centered_box(label))
+        # الأيقونات والأسماء المثبتة أولاً، ثم الأسماء التلقائية حسب الأولوية
+        for mid, spec in specs.items():
+            self._add_marker(mid, spec)
+        auto = [mid for mid, spec in specs.items() if spec.pinned is None and spec.width]
+        for mid in sorted(auto, key=lambda mid: specs[mid].priority):
+            self._place(mid, specs[mid])
+
+    def _around(self, box):
+        # منطقة يمكن أن تقع فيها أسماء مرافق قريبة من الصندوق
+        margin = LABEL_GRID_PX * self.scale
+        return (box[0] - margin, box[1] - margin, box[2] + margin, box[3] + margin)
+
+    def update(self, changed, specs):
+        # changed: المرافق المضافة أو المعدلة أو المحذوفة منذ آخر ترتيب
+        # يُعاد ترتيب أسمائها، وأسماء الجيران التي أصبحت تتداخل معها، والأسماء المخفية حول مواضعها القديمة والجديدة
+        regions = []
+        for mid in changed:
+            for key in (("icon", mid), ("label", mid)):
+                if key in self.boxes:
+                    regions.append(self._around(self.boxes[key]))
+                    self.remove(key)
+            self.points.pop(mid, None)
+            self.offsets.pop(mid, None)
+        affected = set()
+        for mid in changed:
+            spec = specs.get(mid)
+            if spec is None:
+                continue
+            self._add_marker(mid, spec)
+            if spec.pinned is None and spec.width:
+                affected.add(mid)
+            for key in (("icon", mid), ("label", mid)):
+                if key in self.boxes:
+                    regions.append(self._around(self.boxes[key]))
+        for region in regions:
+            for kind, other in self.near(region):
+                if kind == "icon" and other not in affected and other in self.offsets:
+                    label = self.boxes.get(("label", other))
+                    if label is None or self.collides(label, (("label", other), ("icon", other))):
+                        affected.add(other)
+        for mid in affected:
+            self.remove(("label", mid))
+            self.offsets.pop(mid, None)
+        for mid in sorted(affected, key=lambda mid: specs[mid].priority):
+            self._place(mid, specs[mid])
+
+
+def commune_labels(layer, commune_styles, show_names, lang):
+    # أسماء البلديات المطلوب عرضها حسب إعدادات كل بلدية، الأكثر سكاناً أولاً: [(CenteredLabel، النص، اللغة)]
+    metrics = commune_metrics(layer)
+    labels = []
+    for feature in layer.geojson["features"]:
+        name = commune_key(feature)
+        style = commune_styles.get(name, {"show_name": show_names, "lang": lang})
+        anchor = metrics.anchor(name) if style["show_name"] else None
+        if anchor is None:
+            continue
+        props = feature["properties"]
+        text = props.get('name:ar' if style["lang"] == "العربية" else 'name:fr', props.get('name', ''))
+        labels.append((CenteredLabel(name, anchor[0], anchor[1], *text_size(text, COMMUNE_FONT_PX)), text, style["lang"]))
+    labels.sort(key=lambda item: -metrics.population[metrics.index[item[0].key]])
+    return labels
+
+
+def place_commune_labels(labels, zoom):
+    # أسماء البلديات لا تتحرك عن موضعها (أبعد نقطة عن الحدود): الاسم الذي يغطي اسماً أهم منه لا يُعرض
+    # labels مرتبة حسب الأهمية؛ يُرجع الأسماء المعروضة بنفس الترتيب
+    layout = LabelLayout(zoom_key(zoom))
+    shown = []
+    for label in labels:
+        box = layout.centered_box(label)
+        if not layout.collides(box):
+            layout.add(label.key, box)
+            shown.append(label)
+    return shown
+
+
+def place_facility_labels(markers, zoom, lang, show_names, default_font_size, obstacles=()):
+    # ترتيب كامل بدون ذاكرة (التصدير)؛ يُرجع {id: (text_x, text_y) أو None للاسم المخفي} للأسماء التلقائية فقط
+    layout = LabelLayout(zoom_key(zoom))
+    layout.build({m["id"]: label_spec(m, lang, show_names, default_font_size) for m in markers}, obstacles)
+    return layout.offsets
+
+
+def apply_offsets(markers, offsets):
+    # نسخ للرسم فقط (لا تُحفظ): الموضع المختار، أو hide_name للاسم المخفي
+    placed = []
+    for m in markers:
+        offset = offsets.get(m["id"], False)
+        if offset is None:
+            m = dict(m, hide_name=True)
+        elif offset:
+            m = dict(m, text_x=offset[0], text_y=offset[1])
+        placed.append(m)
+    return placed
+
+
+class LabelPlacer:
+    # ترتيب الأسماء لمرافق الجلسة، محفوظ لكل مستوى تكبير (LRU)
+    # عند تعديل مرفق واحد لا يُعاد إلا ترتيب جواره في كل مستوى محفوظ
+    def __init__(self, max_zooms=LABEL_ZOOM_CACHE):
+        self.max_zooms = max_zooms
+        self.specs = {}
+        self.versions = {}
+        self.settings = None
+        # (التكبير، أسماء البلديات) -> (الترتيب، المرافق المتغيرة منذ آخر استعمال)
+        self._layouts = collections.OrderedDict()
+
+    def sync(self, markers, lang, show_names, default_font_size):
+        # مثل FacilityIndex.sync: لا يُعاد حساب صندوق الاسم إلا للمرافق الجديدة أو التي تغير رقم نسختها
+        settings = (lang, show_names, default_font_size)
+        if settings != self.settings:
+            self._layouts.clear()
+            self.specs, self.versions = {}, {}
+            self.settings = settings
+        changed = set()
+        current = set()
+        for marker in markers:
+            mid = marker["id"]
+            current.add(mid)
+            if mid not in self.specs or self.versions[mid] != marker.get("version"):
+                spec = label_spec(marker, *settings)
+                if spec != self.specs.get(mid):
+                    changed.add(mid)
+                self.specs[mid] = spec
+                self.versions[mid] = marker.get("version")
+        for mid in [mid for mid in self.specs if mid not in current]:
+            del self.specs[mid], self.versions[mid]
+            changed.add(mid)
+        if changed:
+            for _, pending in self._layouts.values():
+                pending.update(changed)
+        return len(changed)
+
+    def offsets(self, zoom, obstacles=()):
+        key = (zoom_key(zoom), tuple(obstacles))
+        entry = self._layouts.get(key)
+        if entry is None:
+            layout = LabelLayout(key[0])
+            layout.build(self.specs, obstacles)
+            entry = self._layouts[key] = (layout, set())
+            while len(self._layouts) > self.max_zooms:
+                self._layouts.popitem(last=False)
+        elif entry[1]:
+            entry[0].update(entry[1], self.specs)
+            entry[1].clear()
+        self._layouts.move_to_end(key)
+        return entry[0].offsets
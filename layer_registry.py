@@ -0,0 +1,251 @@
+import collections
+import glob
+import json
+import math
+import os
+import threading
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+import streamlit as st
+
+from geometry import build_layer, commune_key, file_signature, read_file
+from search_index import commune_texts
+from spatial_index import commune_index
+from storage import atomic_write
+
+# ==========================================
+# سجل طبقات الحدود لعدة ولايات: كل ملف حدود (ولاية) مفهرس بإطار كل بلدية فيه وأسمائها للبحث،
+# والفهرس يُحفظ بجانب الملف (.bbox.json) فلا يُقرأ أي ملف حدود عند بدء التشغيل
+# تُحمّل فقط الولايات التي يقطعها إطار الخريطة الظاهر، وتخرج الأقدم استعمالاً (LRU)
+# ==========================================
+# ملفات الحدود (ولاية في كل ملف)، واسم الولاية هو اسم الملف بدون _communes.geojson
+BOUNDARY_PATTERN = os.environ.get("HEALTHMAP_BOUNDARIES", "*_communes.geojson")
+REGION_SUFFIXES = ("_communes.geojson", ".geojson")
+# الحد الأقصى للولايات المحملة في الذاكرة في نفس الوقت
+MAX_LOADED_LAYERS = int(os.environ.get("HEALTHMAP_MAX_LAYERS", 8))
+# الولاية التي تتبعها أنماط البلديات القديمة (بدون اسم ولاية)، وإلا أول ولاية بالترتيب
+DEFAULT_REGION = os.environ.get("HEALTHMAP_DEFAULT_REGION") or None
+INDEX_SUFFIX = ".bbox.json"
+# هامش حول الإطار الظاهر (نسبة من عرضه وارتفاعه) حتى لا تظهر حواف فارغة عند التحريك القليل
+VIEW_PADDING = 0.25
+# أبعاد الخريطة التقريبية (بكسل) لحساب الإطار قبل أن يُرجعه المتصفح
+MAP_VIEW_PX = (1200, 700)
+# مفاتيح commune_styles: "الولاية/البلدية"
+STYLE_SEPARATOR = "/"
+
+
+def region_id(path):
+    name = os.path.basename(path)
+    for suffix in REGION_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def style_key(region, name):
+    return f"{region}{STYLE_SEPARATOR}{name}"
+
+
+def region_styles(commune_styles, region, default_region):
+    # أنماط بلديات ولاية واحدة بالاسم فقط؛ المفاتيح القديمة بدون ولاية تخص الولاية الافتراضية
+    prefix = region + STYLE_SEPARATOR
+    styles = {}
+    if region == default_region:
+        styles.update((key, style) for key, style in commune_styles.items() if STYLE_SEPARATOR not in key)
+    styles.update((key[len(prefix):], style) for key, style in commune_styles.items() if key.startswith(prefix))
+    return styles
+
+
+def qualify_communes(markers, default_region):
+    # بلدية المرفق محفوظة "الولاية/البلدية" (نفس الاسم قد يتكرر في ولايتين)؛ القيم القديمة بالاسم فقط تخص الولاية الافتراضية
+    return [m if not m.get("commune") or STYLE_SEPARATOR in m["commune"]
+            else dict(m, commune=style_key(default_region, m["commune"])) for m in markers]
+
+
+def commune_in_region(key, region):
+    # اسم البلدية من مفتاح "الولاية/البلدية" إذا كانت من هذه الولاية، وإلا None
+    prefix = region + STYLE_SEPARATOR
+    return key[len(prefix):] if key and key.startswith(prefix) else None
+
+
+# ------------------------------------------
+# الإطارات: (min_x, min_y, max_x, max_y) بالدرجات
+# ------------------------------------------
+def component_bounds(value):
+    # الحدود كما يُرجعها st_folium: {"_southWest": {lat, lng}, "_northEast": {lat, lng}}
+    try:
+        south_west, north_east = value["_southWest"], value["_northEast"]
+        return (float(south_west["lng"]), float(south_west["lat"]), float(north_east["lng"]), float(north_east["lat"]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def view_bounds(center, zoom, width=MAP_VIEW_PX[0], height=MAP_VIEW_PX[1]):
+    # الإطار الظاهر تقريباً حول مركز وتكبير (نفس إسقاط Leaflet)
+    size = 256 * 2 ** zoom
+    lat = math.radians(max(-85.0511, min(85.0511, center[0])))
+    cx = (center[1] + 180.0) / 360.0 * size
+    cy = (1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0 * size
+
+    def unproject(x, y):
+        return x / size * 360.0 - 180.0, math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / size))))
+
+    min_x, max_y = unproject(cx - width / 2, cy - height / 2)
+    max_x, min_y = unproject(cx + width / 2, cy + height / 2)
+    return min_x, min_y, max_x, max_y
+
+
+def fit_zoom(bounds, width=MAP_VIEW_PX[0], height=MAP_VIEW_PX[1], max_zoom=18):
+    # أكبر تكبير صحيح يظهر فيه الإطار كاملاً (مع الهامش) في الخريطة
+    def y_of(lat):
+        lat = math.radians(max(-85.0511, min(85.0511, lat)))
+        return (1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0
+
+    dx = max((bounds[2] - bounds[0]) / 360.0, 1e-9)
+    dy = max(y_of(bounds[1]) - y_of(bounds[3]), 1e-9)
+    scale = min(width / dx, height / dy) / (1 + 2 * VIEW_PADDING) / 256
+    return max(0, min(max_zoom, int(math.floor(math.log2(scale)))))
+
+
+def padded(bounds, fraction=VIEW_PADDING):
+    dx, dy = (bounds[2] - bounds[0]) * fraction, (bounds[3] - bounds[1]) * fraction
+    return bounds[0] - dx, bounds[1] - dy, bounds[2] + dx, bounds[3] + dy
+
+
+def _intersecting(boxes, bounds):
+    return ((boxes[:, 0] <= bounds[2]) & (boxes[:, 2] >= bounds[0]) &
+            (boxes[:, 1] <= bounds[3]) & (boxes[:, 3] >= bounds[1]))
+
+
+class RegionEntry(NamedTuple):
+    region: str
+    path: str
+    signature: Tuple[int, int]
+    extent: Tuple[float, float, float, float]
+    names: Tuple[str, ...]
+    # إطار كل بلدية بنفس ترتيب names
+    boxes: np.ndarray
+    # أسماء كل بلدية باللغات (للبحث) بنفس الترتيب
+    texts: Tuple[Tuple[str, ...], ...]
+
+
+def _read_index(path, signature):
+    try:
+        with open(path + INDEX_SUFFIX, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # فهرس قديم بدون الأسماء يُعاد بناؤه
+    return index if index.get("signature") == list(signature) and "texts" in index else None
+
+
+def region_entry(path) -> Optional[RegionEntry]:
+    # الفهرس المحفوظ صالح لنفس التوقيع (mtime, size)، وإلا يُقرأ الملف مرة واحدة ويُعاد بناؤه
+    signature = file_signature(path)
+    index = _read_index(path, signature)
+    if index is None:
+        raw, version = read_file(path)
+        layer = build_layer(path, version, raw)
+        texts = {commune_key(feature): commune_texts(feature["properties"]) for feature in layer.geojson["features"]}
+        index = {"signature": list(signature), "names": list(layer.commune_list),
+                 "boxes": [list(layer.bounds[name]) for name in layer.commune_list],
+                 "texts": [texts.get(name, []) for name in layer.commune_list]}
+        try:
+            atomic_write(path + INDEX_SUFFIX, json.dumps(index, ensure_ascii=False, separators=(",", ":")))
+        except OSError:
+            # مجلد للقراءة فقط: نكتفي بالذاكرة
+            pass
+    if not index["names"]:
+        return None
+    boxes = np.array(index["boxes"], dtype=float).reshape(-1, 4)
+    extent = (float(boxes[:, 0].min()), float(boxes[:, 1].min()), float(boxes[:, 2].max()), float(boxes[:, 3].max()))
+    return RegionEntry(region_id(path), path, signature, extent, tuple(index["names"]), boxes,
+                       tuple(tuple(texts) for texts in index["texts"]))
+
+
+class LayerRegistry:
+    # مشترك بين الجلسات؛ الطبقات المحملة في LRU محدود بعدد الولايات
+    def __init__(self, paths, max_layers=MAX_LOADED_LAYERS, default_region=DEFAULT_REGION):
+        entries = [entry for entry in (region_entry(path) for path in sorted(paths)) if entry is not None]
+        self.regions = {entry.region: entry for entry in entries}
+        self.default_region = default_region if default_region in self.regions else next(iter(self.regions), None)
+        self.max_layers = max(max_layers, 1)
+        self._lock = threading.Lock()
+        self._layers = collections.OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def extent(self):
+        boxes = [entry.extent for entry in self.regions.values()]
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    def regions_in(self, bounds):
+        # الولايات التي يقطع إطارها المنطقة، الأقرب إلى مركزها أولاً
+        cx, cy = (bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2
+        hits = [entry for entry in self.regions.values()
+                if entry.extent[0] <= bounds[2] and entry.extent[2] >= bounds[0]
+                and entry.extent[1] <= bounds[3] and entry.extent[3] >= bounds[1]]
+        hits.sort(key=lambda e: ((e.extent[0] + e.extent[2]) / 2 - cx) ** 2 + ((e.extent[1] + e.extent[3]) / 2 - cy) ** 2)
+        return [entry.region for entry in hits]
+
+    def communes_in(self, region, bounds):
+        entry = self.regions[region]
+        return tuple(name for name, hit in zip(entry.names, _intersecting(entry.boxes, bounds)) if hit)
+
+    def layer(self, region):
+        entry = self.regions[region]
+        signature = file_signature(entry.path)
+        with self._lock:
+            cached = self._layers.get(region)
+            if cached is not None and cached[0] == signature:
+                self._layers.move_to_end(region)
+                return cached[1]
+        if signature != entry.signature:
+            # الملف تغير منذ الفهرسة
+            entry = region_entry(entry.path) or entry
+            self.regions[region] = entry
+        raw, version = read_file(entry.path)
+        layer = build_layer(entry.path, version, raw)
+        with self._lock:
+            self._layers[region] = (signature, layer)
+            self._layers.move_to_end(region)
+            self.loads += 1
+            while len(self._layers) > self.max_layers:
+                self._layers.popitem(last=False)
+                self.evictions += 1
+        return layer
+
+    def visible(self, bounds):
+        # [(الولاية، الطبقة، بلدياتها التي تقطع الإطار)]؛ مكان واحد في LRU يبقى للولاية المختارة في التبويبات
+        regions = self.regions_in(bounds)[:max(self.max_layers - 1, 1)]
+        return [(region, self.layer(region), self.communes_in(region, bounds)) for region in regions]
+
+    def locate(self, lon, lat):
+        # (الولاية، البلدية) التي تقع فيها النقطة، بتحميل الولايات التي يحتويها إطارها فقط
+        for region in self.regions_in((lon, lat, lon, lat)):
+            name = commune_index(self.layer(region)).commune_at(lon, lat)
+            if name is not None:
+                return region, name
+        return None, None
+
+    def locate_key(self, lon, lat):
+        # مفتاح "الولاية/البلدية" للنقطة كما يُحفظ في المرافق، None خارج كل الولايات
+        region, name = self.locate(lon, lat)
+        return style_key(region, name) if name is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {"regions": len(self.regions), "loaded": list(self._layers),
+                    "loads": self.loads, "evictions": self.evictions}
+
+
+@st.cache_resource(show_spinner=False)
+def _build_registry(paths, max_layers):
+    return LayerRegistry(paths, max_layers)
+
+
+def get_registry(pattern=BOUNDARY_PATTERN, max_layers=MAX_LOADED_LAYERS) -> LayerRegistry:
+    # ملف حدود جديد (أو محذوف) يعطي سجلاً جديداً؛ الفهارس المحفوظة تجعل ذلك سريعاً
+    return _build_registry(tuple(sorted(glob.glob(pattern))), max_layers)
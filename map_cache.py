@@ -0,0 +1,291 @@
+import collections
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+from importlib import metadata
+
+import branca
+import folium
+import folium.elements
+import streamlit as st
+
+# folium_component و render_map يستعملان دوال streamlit_folium الداخلية ومعاملات مكونه كما هي في هذه النسخة
+# بالضبط (مثبتة في requirements.txt)؛ أي نسخة أخرى قد تكسر رسم الخريطة دون خطأ واضح
+STREAMLIT_FOLIUM_VERSION = "0.27.4"
+if metadata.version("streamlit-folium") != STREAMLIT_FOLIUM_VERSION:
+    raise ImportError(f"map_cache requires streamlit-folium=={STREAMLIT_FOLIUM_VERSION} "
+                      f"(installed: {metadata.version('streamlit-folium')})")
+
+from streamlit_folium import (
+    _component_func, _get_feature_group_string, _get_header, _get_html,
+    _get_map_string, generate_js_hash, get_full_id,
+)
+
+from storage import atomic_write
+
+# ==========================================
+# ذاكرة مشتركة بين الجلسات لنتيجة رسم الخريطة (نص JavaScript/HTML الذي يرسله st_folium)
+# المفتاح بصمة كل ما يؤثر على الرسم، فنفس الإعدادات لا تُبنى ولا تُرسم إلا مرة واحدة
+# الخريطة الأساسية وكل مجموعة متغيرة (الأسماء، المرافق) تُخزن كجزء مستقل
+# ==========================================
+# الحد الأقصى لحجم الذاكرة (ميغابايت)، ومجلد اختياري لطبقة ثانية على القرص بحدها الخاص
+RENDER_CACHE_MB = float(os.environ.get("HEALTHMAP_RENDER_CACHE_MB", 64))
+RENDER_CACHE_DIR = os.environ.get("HEALTHMAP_RENDER_CACHE_DIR") or None
+RENDER_DISK_MB = float(os.environ.get("HEALTHMAP_RENDER_DISK_MB", 512))
+# الملفات التي تحدد شكل الرسم: أي تعديل فيها (أو في نسخة folium أو streamlit_folium) يبطل الأجزاء المخزنة
+RENDER_SOURCES = ("app.py", "map_cache.py", "marker_icons.py", "marker_canvas.py", "topology_layer.py", "label_placement.py")
+
+
+def _code_version():
+    digest = hashlib.sha1(f"{folium.__version__}/{STREAMLIT_FOLIUM_VERSION}".encode("utf-8"))
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in RENDER_SOURCES:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+CODE_VERSION = _code_version()
+# ملفات القرص: <نسخة الرسم>-<المفتاح>.json؛ البادئة تسمح بحذف أجزاء النسخ السابقة عند التشغيل
+DISK_PREFIX = CODE_VERSION[:16] + "-"
+DISK_FILE = re.compile(r"^[0-9a-f]{16}-[0-9a-f]{40}\.json$")
+
+
+def state_key(*inputs):
+    # pickle أسرع بعدة مرات من json.dumps مع آلاف المرافق؛ اختلاف ترتيب المفاتيح يعطي مفتاحاً آخر فقط (إعادة رسم، لا خطأ)
+    return hashlib.sha1(pickle.dumps((CODE_VERSION, inputs), protocol=4)).hexdigest()
+
+
+def _part_size(part):
+    return sum(len(v) for v in part.values() if isinstance(v, str))
+
+
+class RenderCache:
+    # LRU محدود بالحجم في الذاكرة، وما يخرج منها يبقى على القرص إن وُجد مجلد (LRU ثانٍ بتاريخ التعديل)
+    def __init__(self, max_bytes, disk_dir=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._disk_entries = collections.OrderedDict()
+        self.bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, DISK_PREFIX + key + ".json")
+
+    def _scan_disk(self):
+        # أجزاء نسخ الرسم الأخرى لا تُقرأ أبداً (CODE_VERSION داخل كل مفتاح): تُحذف، والباقي يُرتب من الأقدم استعمالاً
+        found = []
+        for name in os.listdir(self.disk_dir):
+            if not DISK_FILE.match(name):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                if not name.startswith(DISK_PREFIX):
+                    os.remove(path)
+                    continue
+                info = os.stat(path)
+            except OSError:
+                continue
+            found.append((info.st_mtime, name[len(DISK_PREFIX):-len(".json")], info.st_size))
+        for _, key, size in sorted(found):
+            self._disk_entries[key] = size
+            self.disk_bytes += size
+        self._prune_disk()
+
+    def _prune_disk(self):
+        # يُستدعى تحت القفل؛ ملف حذفته عملية أخرى يُتجاهل
+        if self.max_disk_bytes is None:
+            return
+        while self.disk_bytes > self.max_disk_bytes and self._disk_entries:
+            key, size = self._disk_entries.popitem(last=False)
+            self.disk_bytes -= size
+            self.disk_evictions += 1
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    def _touch_disk(self, key):
+        # قراءة من القرص تجدد تاريخ الملف فيبقى في آخر ترتيب الحذف (وبعد إعادة التشغيل أيضاً)
+        try:
+            os.utime(self._disk_path(key))
+        except OSError:
+            pass
+        if key in self._disk_entries:
+            self._disk_entries.move_to_end(key)
+
+    def _remember(self, key, part):
+        size = _part_size(part)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (part, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                    part = json.load(f)
+            except (OSError, ValueError):
+                part = None
+            if part is not None:
+                with self._lock:
+                    self._remember(key, part)
+                    self._touch_disk(key)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return part
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, part):
+        with self._lock:
+            self._remember(key, part)
+        if self.disk_dir:
+            text = json.dumps(part, ensure_ascii=False)
+            size = len(text.encode("utf-8"))
+            if self.max_disk_bytes is not None and size > self.max_disk_bytes:
+                return
+            atomic_write(self._disk_path(key), text)
+            with self._lock:
+                self.disk_bytes += size - self._disk_entries.pop(key, 0)
+                self._disk_entries[key] = size
+                self._prune_disk()
+
+    def get_or_render(self, key, render):
+        part = self.get(key)
+        if part is None:
+            part = render()
+            self.put(key, part)
+        return part
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "evictions": self.evictions, "entries": len(self._entries), "bytes": self.bytes,
+                    "disk_evictions": self.disk_evictions, "disk_entries": len(self._disk_entries),
+                    "disk_bytes": self.disk_bytes}
+
+
+@st.cache_resource(show_spinner=False)
+def get_render_cache(max_mb=RENDER_CACHE_MB, disk_dir=RENDER_CACHE_DIR, max_disk_mb=RENDER_DISK_MB) -> RenderCache:
+    return RenderCache(int(max_mb * 1024 * 1024), disk_dir, int(max_disk_mb * 1024 * 1024))
+
+
+# ------------------------------------------
+# نفس خطوات st_folium، مقسمة إلى أجزاء يمكن تخزينها
+# ------------------------------------------
+def _links(folium_map):
+    def walk(element):
+        if isinstance(element, branca.colormap.ColorMap):
+            yield element
+        if isinstance(element, folium.elements.JSCSSMixin):
+            yield element
+        for child in getattr(element, "_children", {}).values():
+            yield from walk(child)
+
+    css_links, js_links = [], []
+    for element in walk(folium_map):
+        if isinstance(element, branca.colormap.ColorMap):
+            js_links.insert(0, "https://cdnjs.cloudflare.com/ajax/libs/d3/3.5.5/d3.min.js")
+            js_links.insert(0, "https://d3js.org/d3.v4.min.js")
+        css_links.extend(href for _, href in getattr(element, "default_css", []))
+        js_links.extend(src for _, src in getattr(element, "default_js", []))
+    return list(dict.fromkeys(css_links)), list(dict.fromkeys(js_links))
+
+
+def render_map(folium_map):
+    folium_map.get_root().render()
+    folium_map.render()
+    html = _get_html(folium_map)
+    header = _get_header(folium_map)
+    css_links, js_links = _links(folium_map)
+    script = _get_map_string(folium_map)
+    # بعد _get_map_string (يعيد تسمية الخريطة إلى map_div) كما في st_folium
+    map_id = get_full_id(folium_map)
+    return {
+        "script": script, "header": header, "html": html, "id": map_id,
+        "css_links": css_links, "js_links": js_links,
+        "bounds": folium_map.get_bounds(), "zoom": folium_map.options.get("zoom"),
+        # مفتاح المكون يتبع نص الخريطة الأساسية فقط: تغيير المجموعات لا يعيد تحميل الخريطة
+        "key": generate_js_hash(script, None, False),
+    }
+
+
+# ------------------------------------------
+# المكون يقارن نص feature_group كاملاً (ويُرسل كاملاً مع كل تشغيل): إذا تغيرت مجموعة واحدة يحذف كل المجموعات
+# من الخريطة وينفذ النص كله من جديد. لذلك تحمل كل مجموعة بصمة نصها، والمجموعة التي لم تتغير تُعاد إضافتها
+# من ذاكرة في المتصفح بدل إعادة بنائها (فك JSON وإنشاء طبقات Leaflet)؛ ما لم يعد في النص يُترك للحذف
+# ------------------------------------------
+_PART_SCRIPT = """
+if (window.__hm_parts && window.__hm_parts["{digest}"]) {{
+    window.__hm_part = window.__hm_parts["{digest}"];
+    map_div.addLayer(window.__hm_part);
+    window.feature_group.push(window.__hm_part);
+}} else {{
+{script}
+    window.__hm_part = feature_group_feature_group_{idx};
+}}
+window.__hm_parts_next["{digest}"] = window.__hm_part;
+"""
+_PARTS_BEGIN = "window.feature_group = [];\nwindow.__hm_parts_next = {};\n"
+_PARTS_END = "window.__hm_parts = window.__hm_parts_next;\n"
+
+
+def render_feature_group(group, idx):
+    # المجموعة تُرسم مرتبطة بخريطة فارغة: المرجع إلى الخريطة يصبح map_div كما في st_folium
+    script = _get_feature_group_string(group, folium.Map(tiles=None), idx)
+    digest = hashlib.sha1(script.encode("utf-8")).hexdigest()
+    return {"script": _PART_SCRIPT.format(digest=digest, script=script, idx=idx)}
+
+
+def folium_component(base, groups, height=700, returned_objects=None, zoom=None, center=None):
+    # بديل st_folium يستقبل أجزاء مرسومة مسبقاً (عرض الحاوية كاملاً)
+    (south, west), (north, east) = base["bounds"]
+    defaults = {
+        "last_clicked": None, "last_object_clicked": None, "last_object_clicked_count": None,
+        "last_object_clicked_tooltip": None, "last_object_clicked_popup": None,
+        "all_drawings": None, "last_active_drawing": None,
+        "bounds": {"_southWest": {"lat": south, "lng": west}, "_northEast": {"lat": north, "lng": east}},
+        "zoom": base["zoom"], "last_circle_radius": None, "last_circle_polygon": None,
+        "selected_layers": None, "selected_tags": None, "last_geocoder_result": None,
+    }
+    if returned_objects is not None:
+        defaults = {k: v for k, v in defaults.items() if k in returned_objects}
+    return _component_func(
+        script=base["script"], header=base["header"], html=base["html"], id=base["id"],
+        key=base["key"], height=height, width=None, returned_objects=returned_objects,
+        default=defaults, zoom=zoom, center=center,
+        feature_group=_PARTS_BEGIN + "".join(group["script"] for group in groups) + _PARTS_END if groups else None,
+        return_on_hover=False, layer_control=None, pixelated=False,
+        css_links=base["css_links"], js_links=base["js_links"], on_change=None, wrap_longitude=False,
+    )
@@ -0,0 +1,464 @@
+import io
+import math
+import os
+import re
+import zipfile
+from dataclasses import dataclass
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+import numpy as np
+import streamlit as st
+from PIL import Image, ImageDraw, ImageFont, features
+
+try:
+    # بدون libraqm يرسم Pillow الحروف منفصلة ومن اليسار لليمين: نشكّلها ونرتبها قبل الرسم
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:
+    arabic_reshaper = get_display = None
+
+from commune_metrics import commune_metrics
+from geometry import commune_key, polygons
+from layer_registry import style_key
+from marker_canvas import display_name
+from label_placement import COMMUNE_FONT_PX, apply_offsets, commune_labels, place_commune_labels, place_facility_labels
+from marker_icons import DEFAULT_LABEL_SIZE, DEFAULT_TEXT_X, DEFAULT_TEXT_Y, FACILITY_COLORS, icon_kind, marker_scale
+from simplify import level_of_detail
+
+# ==========================================
+# تصدير الخريطة من الخادم: SVG متجه، ثم PNG أو PDF بدون متصفح ولا بلاطات
+# الحدود تُسقط مرة واحدة (مركاتور) لكل مستوى تبسيط، وكل ورقة مجرد إزاحة وتكبير
+# ==========================================
+SHEET_SIZES_MM = {
+    "A4 أفقي": (297, 210),
+    "A4 عمودي": (210, 297),
+    "A3 أفقي": (420, 297),
+    "A3 عمودي": (297, 420),
+}
+SCREEN_DPI = 96
+EXPORT_DPI = 200
+# دقة التبسيط للملفات المتجهة (تُكبّر عند الطباعة)
+VECTOR_PIXEL_RATIO = 4
+PAGE_MARGIN_PX = 40
+TITLE_SIZE_PX = 34
+SUBTITLE_SIZE_PX = 20
+EXPORT_FORMATS = ("PDF", "PNG", "SVG")
+# خط يحتوي الحروف العربية للصيغ النقطية (PNG/PDF)؛ SVG يترك رسم النص للقارئ
+FONT_CANDIDATES = (
+    os.environ.get("HEALTHMAP_FONT", ""),
+    "arialbd.ttf",
+    "Arial Bold.ttf",
+    "DejaVuSans-Bold.ttf",
+    "NotoSansArabic-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+)
+HALO_COLOR = "#ffffff"
+ARABIC_TEXT = re.compile("[\u0600-\u06ff\u0750-\u077f\u08a0-\u08ff\ufb50-\ufdff\ufe70-\ufeff]")
+# طريقة رسم العربية في PNG/PDF: raqm (تشكيل Pillow نفسه)، reshaper (arabic-reshaper + python-bidi)، أو None
+RASTER_ARABIC = "raqm" if features.check("raqm") else "reshaper" if arabic_reshaper is not None else None
+
+
+class ArabicTextError(RuntimeError):
+    # الصيغ النقطية لا تستطيع رسم العربية على هذا الخادم
+    pass
+
+
+def _mercator(lonlat):
+    # إحداثيات مركاتور مطبّعة بين 0 و 1 (نفس إسقاط Leaflet)
+    lonlat = np.asarray(lonlat, dtype=float)
+    lat = np.radians(np.clip(lonlat[..., 1], -85.0511, 85.0511))
+    x = (lonlat[..., 0] + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0
+    return np.stack([x, y], axis=-1)
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _project_level(version, level, _collection):
+    # بلدية -> (مضلعات بحلقات مُسقطة، الإطار المحيط المُسقط)
+    projected = {}
+    for feature in _collection["features"]:
+        parts = [[_mercator(np.asarray(ring, dtype=float)[:, :2]) for ring in polygon] for polygon in polygons(feature["geometry"])]
+        if not parts:
+            continue
+        outer = np.vstack([polygon[0] for polygon in parts])
+        projected[commune_key(feature)] = (parts, (*outer.min(axis=0), *outer.max(axis=0)))
+    return projected
+
+
+def projected_communes(layer, zoom, pixel_ratio):
+    lod = level_of_detail(layer)
+    return _project_level(layer.version, lod.level_for(zoom, pixel_ratio), lod.select(zoom, pixel_ratio))
+
+
+@dataclass(frozen=True)
+class SheetView:
+    # مركز الورقة بإحداثيات مركاتور المطبّعة، والأبعاد بالبكسل (96 نقطة في البوصة)
+    center_x: float
+    center_y: float
+    zoom: float
+    width: float
+    height: float
+
+    @classmethod
+    def at(cls, center, zoom, width, height):
+        x, y = _mercator([center[1], center[0]])
+        return cls(float(x), float(y), zoom, width, height)
+
+    @classmethod
+    def fit(cls, bounds, width, height, margin=PAGE_MARGIN_PX, top=0):
+        # أكبر تكبير يُظهر الإطار كاملاً، مع ترك شريط بارتفاع top للعنوان
+        (x0, y1), (x1, y0) = _mercator([[bounds[0], bounds[1]], [bounds[2], bounds[3]]])
+        span = max((x1 - x0) / max(width - 2 * margin, 1), (y1 - y0) / max(height - 2 * margin - top, 1), 1e-12)
+        zoom = math.log2(1.0 / (256 * span))
+        return cls((x0 + x1) / 2, (y0 + y1) / 2 - top / 2 * span, zoom, width, height)
+
+    @property
+    def world_size(self):
+        return 256 * 2 ** self.zoom
+
+    def project(self, points):
+        offset = np.array([self.center_x, self.center_y])
+        return (np.asarray(points) - offset) * self.world_size + np.array([self.width / 2, self.height / 2])
+
+    def visible(self, bbox):
+        (x0, y0), (x1, y1) = self.project([[bbox[0], bbox[1]], [bbox[2], bbox[3]]])
+        return x1 >= 0 and y1 >= 0 and x0 <= self.width and y0 <= self.height
+
+
+@dataclass
+class Sheet:
+    name: str
+    title: str
+    view: SheetView
+    markers: list
+    # البلدية المحددة تُرسم بحدود مميزة (نفس highlight_function)
+    focus: str = None
+    # أبعاد الورقة بالملم
+    width_mm: float = 0
+    height_mm: float = 0
+    # سطر ثانٍ تحت العنوان (مقاييس البلدية)
+    subtitle: str = ""
+
+
+def page_size_px(size_name):
+    width_mm, height_mm = SHEET_SIZES_MM[size_name]
+    return width_mm, height_mm, width_mm / 25.4 * SCREEN_DPI, height_mm / 25.4 * SCREEN_DPI
+
+
+# ------------------------------------------
+# أسطح الرسم: نفس الأوامر تُكتب SVG أو تُرسم بـ Pillow
+# ------------------------------------------
+class SvgCanvas:
+    def __init__(self, width, height, width_mm, height_mm):
+        self.width, self.height = width, height
+        self.width_mm, self.height_mm = width_mm, height_mm
+        self.parts = []
+
+    def path(self, rings, fill, fill_opacity, stroke, stroke_width):
+        d = " ".join("M" + " L".join(f"{x:.1f},{y:.1f}" for x, y in ring) + "Z" for ring in rings)
+        self.parts.append(
+            f'<path d="{d}" fill="{fill}" fill-opacity="{fill_opacity}" fill-rule="evenodd" '
+            f'stroke="{stroke}" stroke-width="{stroke_width}" stroke-linejoin="round"/>'
+        )
+
+    def rect(self, x, y, w, h, fill, stroke=None, stroke_width=0, radius=0):
+        stroke_attr = f' stroke="{stroke}" stroke-width="{stroke_width}"' if stroke else ""
+        self.parts.append(f'<rect x="{x:.1f}" y="{y:.1f}" width="{w:.1f}" height="{h:.1f}" rx="{radius:.1f}" fill="{fill}"{stroke_attr}/>')
+
+    def circle(self, x, y, r, fill, stroke=None, stroke_width=0):
+        stroke_attr = f' stroke="{stroke}" stroke-width="{stroke_width}"' if stroke else ""
+        self.parts.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="{r:.1f}" fill="{fill}"{stroke_attr}/>')
+
+    def text(self, x, y, text, size, color, baseline="middle", rtl=False, halo=2):
+        baseline_attr = "hanging" if baseline == "top" else "central"
+        self.parts.append(
+            f'<text x="{x:.1f}" y="{y:.1f}" font-size="{size:.1f}" fill="{color}" text-anchor="middle" '
+            f'dominant-baseline="{baseline_attr}" direction="{"rtl" if rtl else "ltr"}" '
+            f'stroke="{HALO_COLOR}" stroke-width="{halo}" paint-order="stroke">{escape(text)}</text>'
+        )
+
+    def render(self):
+        header = (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width_mm}mm" height="{self.height_mm}mm" '
+            f'viewBox="0 0 {self.width:.1f} {self.height:.1f}" font-family="Arial, sans-serif" font-weight="900">'
+            f'<rect width="100%" height="100%" fill="#ffffff"/>'
+        )
+        return (header + "".join(self.parts) + "</svg>").encode("utf-8")
+
+
+@lru_cache(maxsize=64)
+def _font(size):
+    for candidate in FONT_CANDIDATES:
+        if not candidate:
+            continue
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def _rgb(color):
+    color = color.lstrip("#")
+    if len(color) == 3:
+        color = "".join(c * 2 for c in color)
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def _raster_text(text, rtl):
+    # (النص كما يُرسم، خيارات Pillow)
+    if not ARABIC_TEXT.search(text):
+        return text, {}
+    if RASTER_ARABIC == "raqm":
+        return text, {"direction": "rtl"} if rtl else {}
+    if RASTER_ARABIC == "reshaper":
+        return get_display(arabic_reshaper.reshape(text)), {}
+    raise ArabicTextError(
+        "لا يمكن رسم النص العربي في PNG/PDF على هذا الخادم (Pillow بدون libraqm، و arabic-reshaper "
+        "و python-bidi غير مثبتين). استعمل صيغة SVG، أو ثبّت الحزمتين من requirements.txt."
+    )
+
+
+class RasterCanvas:
+    def __init__(self, width, height, dpi=EXPORT_DPI):
+        self.k = dpi / SCREEN_DPI
+        self.dpi = dpi
+        self.image = Image.new("RGB", (max(1, round(width * self.k)), max(1, round(height * self.k))), "#ffffff")
+        self.draw = ImageDraw.Draw(self.image)
+
+    def path(self, rings, fill, fill_opacity, stroke, stroke_width):
+        scaled = [np.asarray(ring) * self.k for ring in rings]
+        all_points = np.vstack(scaled)
+        x0, y0 = np.floor(all_points.min(axis=0)).astype(int)
+        x1, y1 = np.ceil(all_points.max(axis=0)).astype(int)
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.image.width), min(y1, self.image.height)
+        if x1 > x0 and y1 > y0:
+            # الشفافية عبر قناع: كل حلقة تقلب الامتلاء (ثقوب evenodd)
+            mask = Image.new("L", (x1 - x0, y1 - y0), 0)
+            alpha = round(255 * fill_opacity)
+            for ring in scaled:
+                ring_mask = Image.new("1", mask.size, 0)
+                ImageDraw.Draw(ring_mask).polygon([(x - x0, y - y0) for x, y in ring], fill=1)
+                mask.paste(Image.eval(mask, lambda v: alpha - v), (0, 0), ring_mask)
+            self.image.paste(Image.new("RGB", mask.size, _rgb(fill)), (x0, y0), mask)
+        width = max(1, round(stroke_width * self.k))
+        for ring in scaled:
+            self.draw.line([tuple(p) for p in ring], fill=_rgb(stroke), width=width, joint="curve")
+
+    def rect(self, x, y, w, h, fill, stroke=None, stroke_width=0, radius=0):
+        k = self.k
+        self.draw.rounded_rectangle(
+            (x * k, y * k, (x + w) * k, (y + h) * k), radius=radius * k, fill=_rgb(fill),
+            outline=_rgb(stroke) if stroke else None, width=max(1, round(stroke_width * k)) if stroke else 0,
+        )
+
+    def circle(self, x, y, r, fill, stroke=None, stroke_width=0):
+        k = self.k
+        self.draw.ellipse(
+            ((x - r) * k, (y - r) * k, (x + r) * k, (y + r) * k), fill=_rgb(fill),
+            outline=_rgb(stroke) if stroke else None, width=max(1, round(stroke_width * k)) if stroke else 0,
+        )
+
+    def text(self, x, y, text, size, color, baseline="middle", rtl=False, halo=2):
+        text, options = _raster_text(text, rtl)
+        self.draw.text(
+            (x * self.k, y * self.k), text, font=_font(max(1, round(size * self.k))), fill=_rgb(color),
+            anchor="ma" if baseline == "top" else "mm",
+            stroke_width=max(1, round(halo * self.k / 2)), stroke_fill=HALO_COLOR, **options,
+        )
+
+
+# ------------------------------------------
+# رسم ورقة: البلديات، أسماؤها، ثم المرافق والعنوان
+# ------------------------------------------
+def _draw_symbol(canvas, cx, cy, marker, m_type, def_col, scale):
+    # رموز مرسومة بدل 🏥 و 🩺 حتى لا تعتمد الصيغ النقطية على خط الإيموجي
+    kind = icon_kind(m_type)
+    symbol_y = cy
+    if kind not in ("hospital", "care"):
+        lbl_size = marker.get('label_size', DEFAULT_LABEL_SIZE)
+        label_height, total = lbl_size * 1.2, lbl_size * 1.2 + 18 * 1.2
+        canvas.text(cx, cy + (-total / 2 + label_height / 2) * scale, m_type.split(" ")[1], lbl_size * scale,
+                    marker.get('label_color', def_col))
+        symbol_y = cy + (-total / 2 + label_height + 9 * 1.2) * scale
+    if kind == "hospital":
+        canvas.text(cx, symbol_y, "H", 24 * scale, "#b71c1c")
+    elif kind == "care":
+        canvas.circle(cx, symbol_y, 8 * scale, def_col, "#ffffff", 1.5 * scale)
+        canvas.rect(cx - 1.5 * scale, symbol_y - 5 * scale, 3 * scale, 10 * scale, "#ffffff")
+        canvas.rect(cx - 5 * scale, symbol_y - 1.5 * scale, 10 * scale, 3 * scale, "#ffffff")
+    else:
+        canvas.rect(cx - 8 * scale, symbol_y - 7 * scale, 16 * scale, 14 * scale, "#ffffff", def_col, 1.5 * scale, 2 * scale)
+        canvas.rect(cx - 1.5 * scale, symbol_y - 5 * scale, 3 * scale, 10 * scale, "#d32f2f")
+        canvas.rect(cx - 5 * scale, symbol_y - 1.5 * scale, 10 * scale, 3 * scale, "#d32f2f")
+
+
+def draw_sheet(canvas, sheet, layer, commune_styles, settings, type_colors, pixel_ratio):
+    view = sheet.view
+    lang = settings["lang"]
+    projected = projected_communes(layer, view.zoom, pixel_ratio)
+
+    # البلدية المحددة ترسم أخيراً حتى لا تغطي الجارات حدودها
+    for name, (parts, bbox) in sorted(projected.items(), key=lambda item: item[0] == sheet.focus):
+        if not view.visible(bbox):
+            continue
+        color = commune_styles.get(name, {}).get("color", "#e3f2fd")
+        opacity = 0.7 if color != "#e3f2fd" else 0.4
+        stroke, width = ("#b71c1c", 3) if name == sheet.focus else ("#0d47a1", 1.5)
+        for polygon in parts:
+            canvas.path([view.project(ring) for ring in polygon], color, opacity, stroke, width)
+
+    scale = marker_scale(view.zoom)
+    # نفس ترتيب الأسماء بدون تداخل في الخريطة، عند تكبير الورقة
+    auto_labels = settings.get("auto_labels", True)
+    labels = commune_labels(layer, commune_styles, settings["show_names"], lang)
+    if auto_labels:
+        shown = {label.key for label in place_commune_labels([label for label, _, _ in labels], view.zoom)}
+        labels = [item for item in labels if item[0].key in shown]
+    for label, text, label_lang in labels:
+        x, y = view.project(_mercator([label.lon, label.lat]))
+        if 0 <= x <= view.width and 0 <= y <= view.height:
+            canvas.text(x, y, text, COMMUNE_FONT_PX * scale, "#1a237e", rtl=label_lang == "العربية")
+
+    markers = sheet.markers
+    if auto_labels and settings["show_hospital_names"]:
+        markers = apply_offsets(markers, place_facility_labels(
+            markers, view.zoom, lang, True, settings["hospital_font_size"], [label for label, _, _ in labels]))
+    if markers:
+        points = view.project(_mercator([[m["lon"], m["lat"]] for m in markers]))
+        for marker, (x, y) in zip(markers, points):
+            if not (-50 <= x <= view.width + 50 and -50 <= y <= view.height + 50):
+                continue
+            m_type = marker.get('type', 'مستشفى')
+            def_col = type_colors.get(m_type, "#b71c1c")
+            # DivIcon الافتراضي 12x12 ومرساته في وسطه: مركز الأيقونة عند (-6, -6)
+            cx, cy = x - 6, y - 6
+            _draw_symbol(canvas, cx, cy, marker, m_type, def_col, scale)
+            name = display_name(marker, lang) if settings["show_hospital_names"] else ""
+            if name:
+                canvas.text(
+                    cx + (-20 + marker.get('text_x', DEFAULT_TEXT_X)) * scale,
+                    cy + (-20 + marker.get('text_y', DEFAULT_TEXT_Y)) * scale,
+                    name, marker.get('font_size', settings["hospital_font_size"]) * scale,
+                    marker.get('name_color', def_col), baseline="top", rtl=lang == "العربية",
+                )
+
+    if sheet.title:
+        canvas.text(view.width / 2, 20, sheet.title, TITLE_SIZE_PX, "#1a237e", baseline="top", rtl=lang == "العربية", halo=4)
+    if sheet.subtitle:
+        canvas.text(view.width / 2, 20 + TITLE_SIZE_PX * 1.3, sheet.subtitle, SUBTITLE_SIZE_PX, "#37474f",
+                    baseline="top", rtl=lang == "العربية", halo=3)
+
+
+# ------------------------------------------
+# الأوراق: الخريطة المحفوظة، ورقة لكل بلدية، ورقة لكل نوع
+# ------------------------------------------
+def saved_view_sheet(settings, markers, size_name, title):
+    width_mm, height_mm, width, height = page_size_px(size_name)
+    view = SheetView.at(settings["map_center"], settings["map_zoom"], width, height)
+    return Sheet("map", title, view, list(markers), width_mm=width_mm, height_mm=height_mm)
+
+
+def commune_sheets(layer, region, markers, facility_index, size_name, title):
+    width_mm, height_mm, width, height = page_size_px(size_name)
+    by_id = {m["id"]: m for m in markers}
+    metrics = commune_metrics(layer)
+    sheets = []
+    for name in layer.commune_list:
+        view = SheetView.fit(layer.bounds[name], width, height, top=TITLE_SIZE_PX * 2 + SUBTITLE_SIZE_PX)
+        in_commune = [by_id[mid] for mid in facility_index.in_commune(style_key(region, name)) if mid in by_id]
+        sheet_title = f"{title} - {name}" if title else name
+        values = metrics.values(name)
+        subtitle = f"{values['area_km2']:,.0f} كم² · {values['population']:,} نسمة"
+        if values['population']:
+            subtitle += f" · {values['density']:,.1f} نسمة/كم²"
+        sheets.append(Sheet(name, sheet_title, view, in_commune, focus=name, width_mm=width_mm, height_mm=height_mm,
+                            subtitle=f"{subtitle} · {len(in_commune)} مرفق"))
+    return sheets
+
+
+def type_sheets(settings, markers, facility_types, size_name, title):
+    width_mm, height_mm, width, height = page_size_px(size_name)
+    view = SheetView.at(settings["map_center"], settings["map_zoom"], width, height)
+    return [
+        Sheet(m_type, f"{title} - {m_type}" if title else m_type, view,
+              [m for m in markers if m.get("type", "مستشفى") == m_type], width_mm=width_mm, height_mm=height_mm)
+        for m_type in facility_types
+    ]
+
+
+def render_sheet(sheet, fmt, layer, commune_styles, settings, type_colors, dpi=EXPORT_DPI):
+    if fmt == "SVG":
+        canvas = SvgCanvas(sheet.view.width, sheet.view.height, sheet.width_mm, sheet.height_mm)
+        draw_sheet(canvas, sheet, layer, commune_styles, settings, type_colors, VECTOR_PIXEL_RATIO)
+        return canvas.render()
+    canvas = RasterCanvas(sheet.view.width, sheet.view.height, dpi)
+    draw_sheet(canvas, sheet, layer, commune_styles, settings, type_colors, dpi / SCREEN_DPI)
+    return canvas.image
+
+
+def _image_bytes(image, fmt, dpi):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, dpi=(dpi, dpi))
+    return buffer.getvalue()
+
+
+def export_sheets(sheets, fmt, layer, commune_styles, settings, type_colors, dpi=EXPORT_DPI):
+    # (المحتوى، نوع MIME، اسم الملف): PDF متعدد الصفحات، أو ZIP لعدة أوراق SVG/PNG
+    rendered = [render_sheet(s, fmt, layer, commune_styles, settings, type_colors, dpi) for s in sheets]
+    if fmt == "PDF":
+        buffer = io.BytesIO()
+        rendered[0].save(buffer, format="PDF", resolution=dpi, save_all=True, append_images=rendered[1:])
+        return buffer.getvalue(), "application/pdf", "health_map.pdf"
+    extension = fmt.lower()
+    files = [r if fmt == "SVG" else _image_bytes(r, fmt, dpi) for r in rendered]
+    if len(files) == 1:
+        return files[0], "image/svg+xml" if fmt == "SVG" else "image/png", f"health_map.{extension}"
+    buffer = io.BytesIO()
+    # PNG مضغوط أصلاً، فلا فائدة من ضغطه مرة ثانية داخل ZIP
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED if fmt == "SVG" else zipfile.ZIP_STORED) as archive:
+        for i, (sheet, data) in enumerate(zip(sheets, files), start=1):
+            archive.writestr(f"{i:02d}_{sheet.name}.{extension}", data)
+    return buffer.getvalue(), "application/zip", f"health_maps_{extension}.zip"
+
+
+if __name__ == "__main__":
+    # python map_export.py pdf commune out.pdf [saved_data.json|saved_data.sqlite] [عنوان] [الولاية]
+    import sys
+
+    from layer_registry import get_registry, qualify_communes, region_styles
+    from spatial_index import FacilityIndex
+    from storage import JsonBackend, SqliteBackend
+
+    fmt, mode, out_path = sys.argv[1].upper(), sys.argv[2], sys.argv[3]
+    data_path = sys.argv[4] if len(sys.argv) > 4 else "saved_data.json"
+    title = sys.argv[5] if len(sys.argv) > 5 else ""
+    registry = get_registry()
+    region = sys.argv[6] if len(sys.argv) > 6 else registry.default_region
+    if region not in registry.regions:
+        sys.exit(f"Unknown region {region!r} (available: {', '.join(registry.regions) or 'none'})")
+    cli_layer = registry.layer(region)
+    cli_backend = SqliteBackend(data_path) if data_path.endswith(".sqlite") else JsonBackend(data_path)
+    all_styles, cli_settings = cli_backend.load_settings()
+    if cli_settings is None:
+        sys.exit(f"No saved map settings in {data_path}")
+    # نفس أنماط التطبيق: مفاتيح "الولاية/البلدية"، والقديمة بدون ولاية للولاية الافتراضية
+    cli_styles = region_styles(all_styles, region, registry.default_region)
+    cli_markers = qualify_communes(cli_backend.load_markers(), registry.default_region)
+    if mode == "commune":
+        index = FacilityIndex(registry.locate_key)
+        index.sync(cli_markers)
+        cli_sheets = commune_sheets(cli_layer, region, cli_markers, index, "A4 أفقي", title)
+    elif mode == "type":
+        cli_sheets = type_sheets(cli_settings, cli_markers, list(FACILITY_COLORS), "A4 أفقي", title)
+    else:
+        cli_sheets = [saved_view_sheet(cli_settings, cli_markers, "A4 أفقي", title)]
+    try:
+        content, _, _ = export_sheets(cli_sheets, fmt, cli_layer, cli_styles, cli_settings, FACILITY_COLORS)
+    except ArabicTextError as error:
+        sys.exit(str(error))
+    with open(out_path, "wb") as f:
+        f.write(content)
+    print(f"{len(cli_sheets)} sheets written to {out_path}")
@@ -0,0 +1,191 @@
+import json
+
+from branca.element import MacroElement
+from jinja2 import Template
+
+# ==========================================
+# رسم المرافق على Canvas بدل DivIcon لكل مرفق (للأعداد الكبيرة)
+# مع تجميع المرافق حسب النوع عند التكبير المنخفض
+# ==========================================
+# تحت هذا المستوى من التكبير تُجمع المرافق المتقاربة من نفس النوع في دائرة واحدة
+CLUSTER_BELOW_ZOOM = 10
+CLUSTER_RADIUS_PX = 50
+CLINIC_TYPES = ("عيادة H24", "عيادة H12", "عيادة H8")
+
+
+def facility_symbol(m_type):
+    # نفس رموز DivIcon: H للمستشفى، H24/H12/H8 فوق 🏥 للعيادات، 🩺 لقاعة العلاج
+    if m_type in CLINIC_TYPES:
+        return {"label": m_type.split(" ")[1], "emoji": "🏥"}
+    if m_type == "قاعة علاج":
+        return {"emoji": "🩺"}
+    return {"letter": "H", "letterColor": "#b71c1c"}
+
+
+def display_name(marker, lang):
+    # hide_name: الاسم مخفي عند هذا التكبير (ترتيب الأسماء بدون تداخل)
+    if marker.get('hide_name'):
+        return ""
+    name_ar = marker.get('name_ar', '')
+    name_fr = marker.get('name_fr', '')
+    return name_ar if lang == "العربية" and name_ar else name_fr if name_fr else name_ar
+
+
+class FacilityCanvasLayer(MacroElement):
+    _template = Template("""
+    {% macro script(this, kwargs) %}
+    if (!window.FacilityCanvasLayer) {
+        window.FacilityCanvasLayer = L.Layer.extend({
+            initialize: function (points, options) {
+                this._points = points;
+                L.setOptions(this, options);
+            },
+            onAdd: function (map) {
+                this._map = map;
+                this._canvas = L.DomUtil.create('canvas', 'leaflet-zoom-hide');
+                this._canvas.style.position = 'absolute';
+                this._canvas.style.pointerEvents = 'none';
+                map.getPanes().overlayPane.appendChild(this._canvas);
+                map.on('moveend zoomend resize viewreset', this._redraw, this);
+                this._redraw();
+            },
+            onRemove: function (map) {
+                L.DomUtil.remove(this._canvas);
+                map.off('moveend zoomend resize viewreset', this._redraw, this);
+            },
+            _scale: function () {
+                // نفس معادلة DynamicScalePlugin
+                var scale = Math.pow(1.25, this._map.getZoom() - 9);
+                return Math.max(0.3, Math.min(scale, 3.5));
+            },
+            _redraw: function () {
+                var map = this._map, size = map.getSize(), ratio = window.devicePixelRatio || 1;
+                var canvas = this._canvas;
+                L.DomUtil.setPosition(canvas, map.containerPointToLayerPoint([0, 0]));
+                canvas.width = size.x * ratio;
+                canvas.height = size.y * ratio;
+                canvas.style.width = size.x + 'px';
+                canvas.style.height = size.y + 'px';
+                var ctx = canvas.getContext('2d');
+                ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+                var pad = 150, visible = [];
+                for (var i = 0; i < this._points.length; i++) {
+                    var p = this._points[i], pt = map.latLngToContainerPoint([p[0], p[1]]);
+                    if (pt.x < -pad || pt.y < -pad || pt.x > size.x + pad || pt.y > size.y + pad) continue;
+                    visible.push([pt, p]);
+                }
+                var scale = this._scale();
+                if (map.getZoom() < this.options.clusterBelowZoom) {
+                    this._drawClusters(ctx, visible, scale);
+                } else {
+                    for (var j = 0; j < visible.length; j++) this._drawSymbol(ctx, visible[j][0], visible[j][1], scale);
+                }
+            },
+            _drawClusters: function (ctx, visible, scale) {
+                var cell = this.options.clusterRadius, groups = {};
+                for (var i = 0; i < visible.length; i++) {
+                    var v = visible[i];
+                    var key = v[1][2] + ':' + Math.floor(v[0].x / cell) + ':' + Math.floor(v[0].y / cell);
+                    (groups[key] = groups[key] || []).push(v);
+                }
+                for (var k in groups) {
+                    var g = groups[k];
+                    if (g.length === 1) { this._drawSymbol(ctx, g[0][0], g[0][1], scale); continue; }
+                    var x = 0, y = 0;
+                    for (var n = 0; n < g.length; n++) { x += g[n][0].x; y += g[n][0].y; }
+                    x /= g.length; y /= g.length;
+                    var r = 12 + Math.min(14, Math.log(g.length) * 3);
+                    ctx.beginPath();
+                    ctx.arc(x, y, r, 0, 2 * Math.PI);
+                    ctx.globalAlpha = 0.85;
+                    ctx.fillStyle = this.options.kinds[g[0][1][2]].color;
+                    ctx.fill();
+                    ctx.globalAlpha = 1;
+                    ctx.lineWidth = 2;
+                    ctx.strokeStyle = '#fff';
+                    ctx.stroke();
+                    ctx.font = '900 12px Arial, sans-serif';
+                    ctx.fillStyle = '#fff';
+                    ctx.textAlign = 'center';
+                    ctx.textBaseline = 'middle';
+                    ctx.fillText(String(g.length), x, y);
+                }
+            },
+            _haloText: function (ctx, text, x, y, color) {
+                ctx.lineWidth = 2;
+                ctx.lineJoin = 'round';
+                ctx.strokeStyle = '#fff';
+                ctx.strokeText(text, x, y);
+                ctx.fillStyle = color;
+                ctx.fillText(text, x, y);
+            },
+            _drawSymbol: function (ctx, pt, p, scale) {
+                // p = [lat, lon, kind, name, name_color, font_size, label_color, label_size, text_x, text_y]
+                var kind = this.options.kinds[p[2]];
+                ctx.save();
+                // DivIcon الافتراضي 12x12 ومرساته في وسطه: مركز الأيقونة يقع عند (-6, -6) من النقطة
+                ctx.translate(pt.x - 6, pt.y - 6);
+                ctx.scale(scale, scale);
+                ctx.textAlign = 'center';
+                ctx.textBaseline = 'middle';
+                var symbolY = 0;
+                if (kind.label) {
+                    var labelHeight = p[7] * 1.2, total = labelHeight + 18 * 1.2;
+                    ctx.font = '900 ' + p[7] + 'px Arial, sans-serif';
+                    this._haloText(ctx, kind.label, 0, -total / 2 + labelHeight / 2, p[6]);
+                    symbolY = -total / 2 + labelHeight + 9 * 1.2;
+                }
+                ctx.shadowColor = 'rgba(0,0,0,0.4)';
+                ctx.shadowOffsetX = 2;
+                ctx.shadowOffsetY = 3;
+                ctx.shadowBlur = 3;
+                if (kind.letter) {
+                    ctx.font = '900 24px Arial, sans-serif';
+                    ctx.fillStyle = kind.letterColor;
+                    ctx.fillText(kind.letter, 0, symbolY);
+                } else {
+                    ctx.font = '18px sans-serif';
+                    ctx.fillText(kind.emoji, 0, symbolY);
+                }
+                ctx.shadowColor = 'transparent';
+                if (this.options.showNames && p[3]) {
+                    ctx.font = '900 ' + p[5] + 'px Arial, sans-serif';
+                    ctx.direction = this.options.rtl ? 'rtl' : 'ltr';
+                    ctx.textBaseline = 'top';
+                    this._haloText(ctx, p[3], -20 + p[8], -20 + p[9], p[4]);
+                }
+                ctx.restore();
+            }
+        });
+    }
+    var {{ this.get_name() }} = new window.FacilityCanvasLayer({{ this.points_json }}, {{ this.options_json }});
+    {{ this._parent.get_name() }}.addLayer({{ this.get_name() }});
+    {% endmacro %}
+    """)
+
+    def __init__(self, markers, lang, show_names, default_font_size, type_colors, cluster_below_zoom=CLUSTER_BELOW_ZOOM):
+        super().__init__()
+        self._name = "FacilityCanvasLayer"
+        kinds, kind_index, points = [], {}, []
+        for marker in markers:
+            m_type = marker.get('type', 'مستشفى')
+            def_col = type_colors.get(m_type, "#b71c1c")
+            if m_type not in kind_index:
+                kind_index[m_type] = len(kinds)
+                kinds.append(dict(facility_symbol(m_type), color=def_col))
+            points.append([
+                round(marker["lat"], 6), round(marker["lon"], 6), kind_index[m_type],
+                display_name(marker, lang),
+                marker.get('name_color', def_col), marker.get('font_size', default_font_size),
+                marker.get('label_color', def_col), marker.get('label_size', 15),
+                marker.get('text_x', 0), marker.get('text_y', 35),
+            ])
+        # "</" داخل الأسماء لا يجب أن يغلق وسم <script>
+        self.points_json = json.dumps(points, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+        self.options_json = json.dumps({
+            "kinds": kinds,
+            "showNames": show_names,
+            "rtl": lang == "العربية",
+            "clusterBelowZoom": cluster_below_zoom,
+            "clusterRadius": CLUSTER_RADIUS_PX,
+        }, ensure_ascii=False).replace("</", "<\\/")
@@ -0,0 +1,152 @@
+import json
+
+from branca.element import MacroElement
+from jinja2 import Template
+
+from marker_canvas import CLINIC_TYPES, display_name
+
+# ==========================================
+# أيقونات DivIcon بأصناف CSS مشتركة بدل الأنماط المكررة داخل كل أيقونة
+# ورقة الأنماط تُرسل مرة واحدة مع الخريطة، وكل أيقونة تحمل متغيراتها فقط
+# (الموضع، اللون، الحجم، النص) عبر قالب Jinja مُترجم مرة واحدة
+# ==========================================
+# قاموس ألوان أنواع المرافق (مشترك بين الخريطة والتصدير)
+FACILITY_COLORS = {
+    "مستشفى": "#b71c1c",
+    "عيادة H24": "#d32f2f",
+    "عيادة H12": "#f57c00",
+    "عيادة H8": "#1976d2",
+    "قاعة علاج": "#388e3c"
+}
+DEFAULT_LABEL_SIZE = 15
+DEFAULT_TEXT_X = 0
+DEFAULT_TEXT_Y = 35
+
+HALO = "text-shadow: -1px -1px 0 #fff, 1px -1px 0 #fff, -1px 1px 0 #fff, 1px 1px 0 #fff;"
+ZOOM_SCALE = "transform: translate(-50%, -50%) scale(var(--marker-scale, 1)); transform-origin: center center; transition: transform 0.2s ease-out;"
+
+BASE_CSS = f"""
+.hm-rtl {{ direction: rtl; }}
+.hm-ltr {{ direction: ltr; }}
+.hm-commune {{ font-size: 13px; font-weight: bold; color: #1a237e; background: transparent; {HALO} {ZOOM_SCALE} white-space: nowrap; pointer-events: none; }}
+.hm-facility {{ position: relative; display: flex; flex-direction: column; align-items: center; justify-content: center; {ZOOM_SCALE} width: 40px; height: 40px; }}
+.hm-stack {{ display: flex; flex-direction: column; align-items: center; }}
+.hm-badge {{ font-weight: 900; font-size: {DEFAULT_LABEL_SIZE}px; background: transparent; {HALO} }}
+.hm-symbol {{ font-size: 18px; filter: drop-shadow(2px 3px 3px rgba(0,0,0,0.4)); }}
+.hm-letter {{ color: #b71c1c; font-weight: 900; font-size: 24px; font-family: Arial, sans-serif; }}
+.hm-name {{ position: absolute; transform: translateX(-50%); font-family: Arial, sans-serif; font-weight: 900; background: transparent; white-space: nowrap; text-align: center; {HALO} pointer-events: none; }}
+"""
+
+FACILITY_ICON = Template(
+    '<div class="hm-facility hm-{{ kind }}"><div class="hm-stack">'
+    '{% if badge %}<div class="hm-badge"{% if badge_style %} style="{{ badge_style }}"{% endif %}>{{ badge }}</div>{% endif %}'
+    '<div class="hm-symbol">{% if emoji %}{{ emoji }}{% else %}<div class="hm-letter">H</div>{% endif %}</div>'
+    '</div>'
+    '{% if name %}<div class="hm-name hm-{{ dir }}" style="top:{{ y }}px;left:{{ x }}px;font-size:{{ size }}px{% if color %};color:{{ color }}{% endif %}">{{ name|e }}</div>{% endif %}'
+    '</div>'
+)
+
+COMMUNE_LABEL = Template('<div class="hm-commune hm-{{ dir }}">{{ name|e }}</div>')
+
+
+def icon_kind(m_type):
+    # اسم الصنف: h24/h12/h8 للعيادات، care لقاعة العلاج، hospital لغير ذلك
+    if m_type in CLINIC_TYPES:
+        return m_type.split(" ")[1].lower()
+    if m_type == "قاعة علاج":
+        return "care"
+    return "hospital"
+
+
+def icon_stylesheet(type_colors):
+    # لون الشارة واسم المرفق الافتراضي لكل نوع يصبح صنفاً واحداً
+    rules = [BASE_CSS]
+    for m_type, color in type_colors.items():
+        kind = icon_kind(m_type)
+        rules.append(f".hm-{kind} .hm-badge, .hm-{kind} .hm-name {{ color: {color}; }}")
+    return "\n".join(rules)
+
+
+def marker_scale(zoom):
+    # نفس معادلة DynamicScalePlugin
+    return max(0.3, min(1.25 ** (zoom - 9), 3.5))
+
+
+def text_direction(lang):
+    return "rtl" if lang == "العربية" else "ltr"
+
+
+def facility_icon_html(marker, lang, show_names, default_font_size, type_colors):
+    m_type = marker.get('type', 'مستشفى')
+    def_col = type_colors.get(m_type, "#b71c1c")
+    kind = icon_kind(m_type)
+
+    badge, badge_style, emoji = "", "", ""
+    if kind == "care":
+        emoji = "🩺"
+    elif kind != "hospital":
+        badge, emoji = m_type.split(" ")[1], "🏥"
+        # نكتب في الأيقونة فقط ما يخالف قيم الصنف الافتراضية
+        lbl_color = marker.get('label_color', def_col)
+        lbl_size = marker.get('label_size', DEFAULT_LABEL_SIZE)
+        styles = []
+        if lbl_color != def_col:
+            styles.append(f"color:{lbl_color}")
+        if lbl_size != DEFAULT_LABEL_SIZE:
+            styles.append(f"font-size:{lbl_size}px")
+        badge_style = ";".join(styles)
+
+    name, color = "", ""
+    if show_names:
+        name = display_name(marker, lang)
+        n_color = marker.get('name_color', def_col)
+        color = n_color if n_color != def_col else ""
+
+    return FACILITY_ICON.render(
+        kind=kind, badge=badge, badge_style=badge_style, emoji=emoji,
+        name=name, dir=text_direction(lang), color=color,
+        x=marker.get('text_x', DEFAULT_TEXT_X), y=marker.get('text_y', DEFAULT_TEXT_Y),
+        size=marker.get('font_size', default_font_size),
+    )
+
+
+def commune_label_html(name, lang):
+    return COMMUNE_LABEL.render(name=name, dir=text_direction(lang))
+
+
+class IconStyleSheet(MacroElement):
+    # تُضاف للخريطة الأساسية: مجموعات feature_group_to_add لا تحمل إلا JavaScript
+    _template = Template("""
+    {% macro header(this, kwargs) %}
+    <style>{{ this.css }}</style>
+    {% endmacro %}
+    """)
+
+    def __init__(self, type_colors):
+        super().__init__()
+        self._name = "IconStyleSheet"
+        self.css = icon_stylesheet(type_colors)
+
+
+class DivIconLayer(MacroElement):
+    # كل الأيقونات في مصفوفة واحدة [lat, lon, html] بدل عنصر folium لكل أيقونة
+    _template = Template("""
+    {% macro script(this, kwargs) %}
+    (function (group, icons) {
+        for (var i = 0; i < icons.length; i++) {
+            L.marker([icons[i][0], icons[i][1]], {
+                icon: L.divIcon({html: icons[i][2], className: 'empty'})
+            }).addTo(group);
+        }
+    })({{ this._parent.get_name() }}, {{ this.icons_json }});
+    {% endmacro %}
+    """)
+
+    def __init__(self, icons):
+        super().__init__()
+        self._name = "DivIconLayer"
+        # "</" داخل الأسماء لا يجب أن يغلق وسم <script>
+        self.icons_json = json.dumps(
+            [[round(lat, 6), round(lon, 6), html] for lat, lon, html in icons],
+            ensure_ascii=False, separators=(",", ":")
+        ).replace("</", "<\\/")
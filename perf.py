@@ -0,0 +1,164 @@
+import collections
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import streamlit as st
+
+# ==========================================
+# قياس زمن مراحل التطبيق (تحميل البيانات، بناء الخريطة، الحفظ...)
+# بدون أي مستمع مسجل لا يُقاس شيء: كلفة كل نقطة قياس فحص قائمة فارغة فقط
+# ==========================================
+_listeners = []
+_started = {}
+_IDLE = contextlib.nullcontext()
+
+
+def add_listener(listener):
+    # listener(name, seconds, info) يُستدعى عند نهاية كل مرحلة
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def enabled():
+    return bool(_listeners)
+
+
+def record(name, seconds, **info):
+    for listener in list(_listeners):
+        listener(name, seconds, info)
+
+
+def start(name):
+    # لمراحل لا تقع في كتلة واحدة (مثل بناء الخريطة الموزع على عدة أجزاء من السكربت)
+    if _listeners:
+        _started[(threading.get_ident(), name)] = time.perf_counter()
+
+
+def stop(name, **info):
+    if _listeners:
+        started = _started.pop((threading.get_ident(), name), None)
+        if started is not None:
+            record(name, time.perf_counter() - started, **info)
+
+
+def stage(name, **info):
+    # بدون مستمع: سياق فارغ مشترك بدل إنشاء مولّد جديد في كل مرة
+    if not _listeners:
+        return _IDLE
+    return _timed(name, info)
+
+
+@contextlib.contextmanager
+def _timed(name, info):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started, **info)
+
+
+# ==========================================
+# مراقب الأداء: تجميع المراحل لكل إعادة تشغيل، ونسب مئوية متحركة، وسجل JSON سطر لكل إعادة تشغيل
+# يُفعّل بالمتغير HEALTHMAP_PERF=1 (والسجل في ملف عبر HEALTHMAP_PERF_LOG، وإلا في stderr)
+# ==========================================
+# عدد إعادات التشغيل الأخيرة المحسوبة في النسب المئوية لكل مرحلة
+PERF_WINDOW = 200
+PERF_PERCENTILES = (50, 95, 99)
+# كل هذا العدد من إعادات التشغيل يُكتب سطر ملخص بنسب كل المراحل
+PERF_SUMMARY_EVERY = 50
+PERF_LOGGER = "healthmap.perf"
+
+
+def perf_enabled():
+    return os.environ.get("HEALTHMAP_PERF", "").lower() in ("1", "true", "on")
+
+
+def _perf_logger(log_path):
+    logger = logging.getLogger(PERF_LOGGER)
+    if not logger.handlers:
+        handler = logging.FileHandler(log_path, encoding="utf-8") if log_path else logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+class PerfMonitor:
+    # مشترك بين الجلسات؛ كل إعادة تشغيل تُجمع في خيطها ثم تُضاف للنوافذ المتحركة
+    def __init__(self, window=PERF_WINDOW, log_path=None):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.reruns = 0
+        self.logger = _perf_logger(log_path)
+        add_listener(self)
+
+    def __call__(self, name, seconds, info):
+        current = getattr(self._local, "rerun", None)
+        if current is None:
+            # مراحل خارج أي إعادة تشغيل (مثل الكتابة المؤجلة في خيط المؤقت)
+            with self._lock:
+                self._samples[name].append(seconds)
+            self._log({"event": "stage", "ts": round(time.time(), 3), "stage": name, "ms": round(seconds * 1000, 2), **info})
+            return
+        entry = current["stages"].setdefault(name, {"ms": 0.0, "calls": 0})
+        entry["ms"] += seconds * 1000
+        entry["calls"] += 1
+        for key, value in info.items():
+            entry[key] = entry.get(key, 0) + value
+
+    def begin_rerun(self, session):
+        # إعادة تشغيل سابقة لم تكتمل (st.rerun أو st.stop) تُهمل
+        self._local.rerun = {"session": session, "started": time.perf_counter(), "stages": {}}
+
+    def end_rerun(self):
+        current = getattr(self._local, "rerun", None)
+        if current is None:
+            return None
+        self._local.rerun = None
+        total = time.perf_counter() - current["started"]
+        stages = {name: dict(entry, ms=round(entry["ms"], 2)) for name, entry in current["stages"].items()}
+        record = {"event": "rerun", "ts": round(time.time(), 3), "session": current["session"],
+                  "total_ms": round(total * 1000, 2), "stages": stages}
+        with self._lock:
+            self.reruns += 1
+            self._samples["total"].append(total)
+            for name, entry in current["stages"].items():
+                self._samples[name].append(entry["ms"] / 1000)
+            record["rolling"] = {"total": self._percentiles("total")}
+            summary = self.reruns % PERF_SUMMARY_EVERY == 0
+        self._log(record)
+        if summary:
+            self._log({"event": "summary", "ts": record["ts"], "reruns": self.reruns, "percentiles": self.percentiles()})
+        return record
+
+    def _percentiles(self, name):
+        values = np.array(self._samples[name]) * 1000
+        result = {f"p{p}": round(float(v), 2) for p, v in zip(PERF_PERCENTILES, np.percentile(values, PERF_PERCENTILES))}
+        result["n"] = len(values)
+        return result
+
+    def percentiles(self):
+        # مرحلة -> {p50, p95, p99 بالملي ثانية، n}
+        with self._lock:
+            return {name: self._percentiles(name) for name, values in self._samples.items() if values}
+
+    def _log(self, record):
+        self.logger.info(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+
+@st.cache_resource(show_spinner=False)
+def get_monitor(log_path=None) -> PerfMonitor:
+    return PerfMonitor(log_path=log_path)
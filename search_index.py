@@ -0,0 +1,228 @@
+import collections
+import re
+import unicodedata
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# ==========================================
+# بحث تقريبي بالعربية والفرنسية في أسماء المرافق والبلديات
+# كل اسم يُطبّع (الهمزات، التاء المربوطة، التشكيل، الحروف اللاتينية المنبورة) ثم يُقطّع إلى ثلاثيات حروف،
+# والبحث عدّ الثلاثيات المشتركة دفعة واحدة (numpy) بدل مقارنة كل اسم: أخطاء إملائية قليلة لا تمنع التطابق
+# الفهرس يُحدّث مرفقاً مرفقاً (مثل FacilityIndex.sync): لا يُعاد تقطيع إلا الأسماء الجديدة أو المعدلة
+# أسماء البلديات تُقرأ من فهرس الولاية المحفوظ (.bbox.json) فلا يُحمّل أي ملف حدود للبحث
+# ==========================================
+NGRAM = 3
+# أقل نسبة من ثلاثيات نص البحث موجودة في الاسم لظهور النتيجة (تسمح بحرف خاطئ أو ناقص في الكلمات القصيرة)
+SEARCH_MIN_SCORE = 0.5
+# وزن معامل Dice (التشابه الكلي) في الترتيب: عند تساوي التغطية يتقدم الاسم الأقصر والأقرب
+DICE_WEIGHT = 0.1
+SEARCH_LIMIT = 10
+# خصائص البلديات المفهرسة (إضافة لكل long_name:*)
+COMMUNE_FIELDS = ("name:ar", "name:fr", "name:en", "name:ber")
+# تُعاد كتابة القوائم عندما تصبح أغلب الخانات لأسماء محذوفة أو قديمة
+COMPACT_MIN_SLOTS = 1024
+
+ARABIC_FOLD = str.maketrans({"ٱ": "ا", "ى": "ي", "ة": "ه", "ء": "", "ـ": ""})
+NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    # NFKD يفصل الهمزة (أ إ آ ؤ ئ) والتشكيل والنبرات عن الحروف، ثم تُحذف العلامات المركبة
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return NON_WORD.sub(" ", text.translate(ARABIC_FOLD).casefold()).strip()
+
+
+def commune_texts(properties):
+    # الأسماء المفهرسة لبلدية: name:ar, name:fr, ... ثم كل long_name*
+    texts = [properties.get(field) for field in COMMUNE_FIELDS]
+    texts += [value for field, value in properties.items() if field.startswith("long_name")]
+    return [str(text) for text in texts if text]
+
+
+def ngrams(text, n=NGRAM):
+    grams = set()
+    for word in text.split():
+        padded = f" {word} "
+        if len(padded) <= n:
+            grams.add(padded)
+        else:
+            grams.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+class SearchEntry(NamedTuple):
+    # kind: "facility" أو "commune"؛ key: رقم المرفق أو (الولاية، البلدية)
+    kind: str
+    key: object
+    label: str
+    detail: str
+    lat: float
+    lon: float
+    # إطار البلدية (min_x, min_y, max_x, max_y)، None للمرافق؛ موضع البلدية مركز إطارها
+    bbox: Optional[Tuple[float, float, float, float]] = None
+
+
+class SearchIndex:
+    def __init__(self):
+        self.entries = {}
+        # خانة لكل حقل مفهرس من كل عنصر
+        self._slot_key = []
+        self._slot_text = []
+        self._slot_size = []
+        self._slot_kind = []
+        self._alive = []
+        self._postings = collections.defaultdict(list)
+        self._arrays = {}
+        self._slots = {}
+        self._versions = {}
+        self._dead = 0
+        self._dense = None
+        self._kind_keys = {"facility": set(), "commune": set()}
+
+    def __len__(self):
+        return len(self.entries)
+
+    # ------------------------------------------
+    # التحديث
+    # ------------------------------------------
+    def upsert(self, entry, texts, version=None):
+        if self._versions.get(entry.key, object()) == version and entry.key in self.entries:
+            return False
+        self.remove(entry.key)
+        slots = []
+        for text in dict.fromkeys(normalize(t) for t in texts if t):
+            grams = ngrams(text)
+            if not grams:
+                continue
+            slot = len(self._slot_key)
+            self._slot_key.append(entry.key)
+            self._slot_text.append(text)
+            self._slot_size.append(len(grams))
+            self._slot_kind.append(entry.kind)
+            self._alive.append(True)
+            for gram in grams:
+                self._postings[gram].append(slot)
+                self._arrays.pop(gram, None)
+            slots.append(slot)
+        self.entries[entry.key] = entry
+        self._slots[entry.key] = slots
+        self._versions[entry.key] = version
+        self._dense = None
+        return True
+
+    def remove(self, key):
+        if key not in self.entries:
+            return False
+        for slot in self._slots.pop(key):
+            self._alive[slot] = False
+            self._dead += 1
+        del self.entries[key]
+        self._versions.pop(key, None)
+        self._dense = None
+        if self._dead > COMPACT_MIN_SLOTS and self._dead > len(self._slot_key) // 2:
+            self._compact()
+        return True
+
+    def _compact(self):
+        # خانات العناصر المحذوفة تبقى في القوائم حتى تصبح أغلبها، ثم يُعاد بناء القوائم من الخانات الحية
+        live = [slot for slot, alive in enumerate(self._alive) if alive]
+        renumber = {old: new for new, old in enumerate(live)}
+        self._slot_key = [self._slot_key[slot] for slot in live]
+        self._slot_text = [self._slot_text[slot] for slot in live]
+        self._slot_size = [self._slot_size[slot] for slot in live]
+        self._slot_kind = [self._slot_kind[slot] for slot in live]
+        self._alive = [True] * len(live)
+        self._postings = collections.defaultdict(list)
+        for slot, text in enumerate(self._slot_text):
+            for gram in ngrams(text):
+                self._postings[gram].append(slot)
+        self._slots = {key: [renumber[s] for s in slots] for key, slots in self._slots.items()}
+        self._arrays = {}
+        self._dead = 0
+
+    def sync_facilities(self, markers, name_of):
+        # المرافق الجديدة أو التي تغير رقم نسختها فقط؛ name_of(marker) -> اسم العرض
+        current = set()
+        changed = 0
+        for marker in markers:
+            key = ("facility", marker["id"])
+            current.add(key)
+            if key in self.entries and self._versions[key] == marker.get("version"):
+                continue
+            entry = SearchEntry("facility", key, name_of(marker), marker.get("type", ""), marker["lat"], marker["lon"])
+            changed += self.upsert(entry, (marker.get("name_ar"), marker.get("name_fr")), marker.get("version"))
+        return changed + self._drop_missing("facility", current)
+
+    def sync_communes(self, regions):
+        # regions: RegionEntry من سجل الطبقات؛ لا يُعاد تقطيع ولاية إلا إذا تغير توقيع ملفها
+        current = set()
+        changed = 0
+        for entry in regions:
+            for name, box, texts in zip(entry.names, entry.boxes, entry.texts):
+                key = ("commune", entry.region, name)
+                current.add(key)
+                if key in self.entries and self._versions[key] == entry.signature:
+                    continue
+                bbox = tuple(float(v) for v in box)
+                result = SearchEntry("commune", key, name, entry.region,
+                                     (bbox[1] + bbox[3]) / 2, (bbox[0] + bbox[2]) / 2, bbox)
+                changed += self.upsert(result, [name] + list(texts), entry.signature)
+        return changed + self._drop_missing("commune", current)
+
+    def _drop_missing(self, kind, current):
+        removed = sum(self.remove(key) for key in self._kind_keys[kind] - current)
+        self._kind_keys[kind] = current
+        return removed
+
+    # ------------------------------------------
+    # البحث
+    # ------------------------------------------
+    def _array(self, gram):
+        array = self._arrays.get(gram)
+        if array is None:
+            array = self._arrays[gram] = np.array(self._postings[gram], dtype=np.int32)
+        return array
+
+    def _dense_arrays(self):
+        if self._dense is None:
+            self._dense = (np.array(self._slot_size, dtype=np.float32), np.array(self._alive, dtype=bool),
+                           np.array(self._slot_kind))
+        return self._dense
+
+    def search(self, query, limit=SEARCH_LIMIT, kind=None, min_score=SEARCH_MIN_SCORE):
+        # [(SearchEntry, التغطية)] الأقرب أولاً؛ التغطية نسبة ثلاثيات نص البحث الموجودة في الاسم،
+        # فالبحث أثناء الكتابة (بداية الاسم أو جزء منه) يطابق مثل الاسم الكامل، والاسم الذي يحتويه حرفياً يتقدم
+        text = normalize(query)
+        query_grams = ngrams(text)
+        grams = [gram for gram in query_grams if gram in self._postings]
+        if not grams:
+            return []
+        size, alive, kinds = self._dense_arrays()
+        hits = np.bincount(np.concatenate([self._array(gram) for gram in grams]), minlength=len(size))
+        coverage = hits / len(query_grams)
+        coverage[~alive] = 0.0
+        if kind is not None:
+            coverage[kinds != kind] = 0.0
+        candidates = np.flatnonzero(coverage >= min_score)
+        if not len(candidates):
+            return []
+        rank = coverage[candidates] + DICE_WEIGHT * 2.0 * hits[candidates] / (len(query_grams) + size[candidates])
+        # عدة خانات لنفس العنصر (عربي وفرنسي...): هامش قبل الاقتطاع
+        keep = limit * 4
+        if len(candidates) > keep:
+            top = np.argpartition(-rank, keep)[:keep]
+            candidates, rank = candidates[top], rank[top]
+        ranked = sorted(((text in self._slot_text[slot], float(value), int(slot)) for slot, value in zip(candidates, rank)),
+                        reverse=True)
+        results, seen = [], set()
+        for _, _, slot in ranked:
+            key = self._slot_key[slot]
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append((self.entries[key], float(coverage[slot])))
+            if len(results) == limit:
+                break
+        return results
@@ -0,0 +1,165 @@
+import json
+import math
+import os
+
+import streamlit as st
+
+from topology import build_topology, from_topojson, read_topojson, to_topojson, write_topojson
+
+# ==========================================
+# تبسيط الحدود حسب مستوى التكبير (Level of Detail)
+# التبسيط يتم على الأقواس المشتركة، لذلك تبقى حدود البلديات المتجاورة متطابقة
+# ==========================================
+LOD_ZOOMS = (6, 7, 8, 9, 10, 11, 12)
+# هامش للتكبير داخل المتصفح بعد الرسم (1 = تكبير مرتين قبل ظهور التبسيط)
+LOD_ZOOM_HEADROOM = 1
+LOD_CACHE_SUFFIX = ".lod.json"
+# الخصائص التي تُرسل للمتصفح مع الحدود (الألوان تُحسب في الخادم)
+TRANSPORT_PROPERTIES = ("name", "name:ar", "name:fr")
+
+
+def pixel_size(zoom):
+    # حجم البكسل بدرجات مركاتور عند مستوى تكبير معين (بلاطات 256)
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def _mercator(p):
+    lat = max(min(p[1], 85.0), -85.0)
+    return p[0], math.degrees(math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)))
+
+
+def _segment_distance(p, a, b):
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    if dx == 0 and dy == 0:
+        return math.hypot(p[0] - a[0], p[1] - a[1])
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy)
+
+
+def _farthest(projected, first, last):
+    best, best_index = -1.0, None
+    for i in range(first + 1, last):
+        d = _segment_distance(projected[i], projected[first], projected[last])
+        if d > best:
+            best, best_index = d, i
+    return best, best_index
+
+
+def simplify_arc(arc, tolerance):
+    # Douglas-Peucker مع إبقاء الطرفين وأبعد نقطة داخلية على الأقل (حتى لا تنهار الحلقات الصغيرة)
+    if len(arc) < 4:
+        return list(arc)
+    projected = [_mercator(p) for p in arc]
+    keep = {0, len(arc) - 1}
+    if arc[0] == arc[-1]:
+        # قوس مغلق: نقسمه عند أبعد نقطة عن البداية
+        split = max(range(1, len(arc) - 1), key=lambda i: math.hypot(
+            projected[i][0] - projected[0][0], projected[i][1] - projected[0][1]))
+        keep.add(split)
+        stack = [(0, split, True), (split, len(arc) - 1, True)]
+    else:
+        stack = [(0, len(arc) - 1, True)]
+    while stack:
+        first, last, force = stack.pop()
+        distance, index = _farthest(projected, first, last)
+        if index is not None and (force or distance > tolerance):
+            keep.add(index)
+            stack.append((first, index, False))
+            stack.append((index, last, False))
+    return [arc[i] for i in sorted(keep)]
+
+
+class CommuneLOD:
+    def __init__(self, base_geojson, levels, topology=None, level_arcs=None):
+        self.base = base_geojson
+        # zoom -> FeatureCollection مبسطة
+        self.levels = levels
+        self.topology = topology
+        self.level_arcs = level_arcs or {}
+        self._topojson = {}
+
+    def level_for(self, zoom, pixel_ratio=1.0):
+        target = zoom + LOD_ZOOM_HEADROOM + math.log2(max(pixel_ratio, 1e-6))
+        for level_zoom in sorted(self.levels):
+            if level_zoom >= target:
+                return level_zoom
+        return None
+
+    def select(self, zoom, pixel_ratio=1.0):
+        level = self.level_for(zoom, pixel_ratio)
+        return self.base if level is None else self.levels[level]
+
+    def topojson(self, zoom, pixel_ratio=1.0):
+        # نفس المستوى الذي تختاره select() لكن كـ TopoJSON مكمّم لإرساله للمتصفح
+        level = self.level_for(zoom, pixel_ratio)
+        if level not in self._topojson:
+            arcs = self.topology.arcs if level is None else self.level_arcs[level]
+            properties = [
+                {k: f["properties"][k] for k in TRANSPORT_PROPERTIES if k in f["properties"]}
+                for f in self.base["features"]
+            ]
+            self._topojson[level] = to_topojson(self.topology, properties, arcs)
+        return self._topojson[level]
+
+
+def _feature_collection(base_geojson, topology, arcs):
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "properties": f["properties"], "geometry": topology.to_geometry(i, arcs)}
+            for i, f in enumerate(base_geojson["features"])
+        ],
+    }
+
+
+def _read_cache(cache_path, version):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("version") != version or cached.get("zooms") != list(LOD_ZOOMS):
+        return None
+    return cached
+
+
+def _write_cache(cache_path, payload):
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # مجلد للقراءة فقط: نكتفي بالذاكرة
+        pass
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _build_lod(path, version, _layer):
+    # الطوبولوجيا تُقرأ من الملف المُترجم مسبقاً (python topology.py ...) إن وُجد لنفس النسخة
+    topojson = read_topojson(path, version)
+    if topojson is not None:
+        topology, _ = from_topojson(topojson)
+    else:
+        topology = build_topology(_layer.geojson["features"])
+        write_topojson(path, version, to_topojson(topology, [f["properties"] for f in _layer.geojson["features"]]))
+    cache_path = path + LOD_CACHE_SUFFIX
+    cached = _read_cache(cache_path, version)
+    if cached is not None:
+        level_arcs = {int(z): [[tuple(p) for p in arc] for arc in arcs] for z, arcs in cached["levels"].items()}
+    else:
+        level_arcs = {
+            z: [simplify_arc(arc, pixel_size(z)) for arc in topology.arcs]
+            for z in LOD_ZOOMS
+        }
+        _write_cache(cache_path, {
+            "version": version,
+            "zooms": list(LOD_ZOOMS),
+            "levels": {str(z): arcs for z, arcs in level_arcs.items()},
+        })
+    levels = {z: _feature_collection(_layer.geojson, topology, arcs) for z, arcs in level_arcs.items()}
+    return CommuneLOD(_layer.geojson, levels, topology, level_arcs)
+
+
+def level_of_detail(layer) -> CommuneLOD:
+    return _build_lod(layer.path, layer.version, layer)
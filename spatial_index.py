@@ -0,0 +1,188 @@
+import heapq
+import math
+from collections import defaultdict
+
+import streamlit as st
+
+from geometry import communes_for_points, point_in_feature, polygons
+
+# ==========================================
+# فهارس مكانية: شبكة منتظمة فوق حدود البلديات وأخرى فوق المرافق
+# ==========================================
+COMMUNE_GRID_SIZE = 64
+# حجم خلية شبكة المرافق بالدرجات (حوالي 5 كم)
+FACILITY_CELL_DEGREES = 0.05
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class CommuneIndex:
+    # كل خلية إما داخل بلدية واحدة بالكامل (جواب مباشر)،
+    # أو تقطعها حدود: نختبر فقط البلديات التي تمر حدودها بالخلية
+    def __init__(self, layer, grid_size=COMMUNE_GRID_SIZE):
+        self.layer = layer
+        self.n = grid_size
+        self.min_x, self.min_y, self.max_x, self.max_y = layer.extent
+        self.dx = (self.max_x - self.min_x) / grid_size
+        self.dy = (self.max_y - self.min_y) / grid_size
+        self.edge_cells = defaultdict(set)
+        for name, feature in layer.by_name.items():
+            for polygon in polygons(feature["geometry"]):
+                for ring in polygon:
+                    for a, b in zip(ring[:-1], ring[1:]):
+                        i0, j0 = self._cell(min(a[0], b[0]), min(a[1], b[1]))
+                        i1, j1 = self._cell(max(a[0], b[0]), max(a[1], b[1]))
+                        for i in range(i0, i1 + 1):
+                            for j in range(j0, j1 + 1):
+                                self.edge_cells[(i, j)].add(name)
+        interior = [(i, j) for i in range(grid_size) for j in range(grid_size) if (i, j) not in self.edge_cells]
+        centers_x = [self.min_x + (i + 0.5) * self.dx for i, _ in interior]
+        centers_y = [self.min_y + (j + 0.5) * self.dy for _, j in interior]
+        self.interior = dict(zip(interior, communes_for_points(layer, centers_x, centers_y)))
+
+    def _cell(self, x, y):
+        i = min(max(int((x - self.min_x) / self.dx), 0), self.n - 1)
+        j = min(max(int((y - self.min_y) / self.dy), 0), self.n - 1)
+        return i, j
+
+    def commune_at(self, lon, lat):
+        if not (self.min_x <= lon <= self.max_x and self.min_y <= lat <= self.max_y):
+            return None
+        cell = self._cell(lon, lat)
+        if cell in self.interior:
+            return self.interior[cell]
+        # get: الخلية الفارغة لا تُضاف إلى defaultdict مع كل بحث
+        for name in self.edge_cells.get(cell, ()):
+            if point_in_feature(lon, lat, self.layer.by_name[name]):
+                return name
+        return None
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _build_commune_index(version, _layer):
+    return CommuneIndex(_layer)
+
+
+def commune_index(layer) -> CommuneIndex:
+    return _build_commune_index(layer.version, layer)
+
+
+class FacilityIndex:
+    # شبكة منتظمة فوق إحداثيات المرافق، تُحدّث مرفقاً مرفقاً عبر sync()
+    def __init__(self, locate=None, cell_degrees=FACILITY_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.locate = locate
+        self.cells = defaultdict(set)
+        self.by_commune = defaultdict(set)
+        # id -> (version, lat, lon, type, commune)
+        self.entries = {}
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def remove(self, marker_id):
+        entry = self.entries.pop(marker_id, None)
+        if entry is None:
+            return
+        _, lat, lon, _, commune = entry
+        self.cells[self._cell(lat, lon)].discard(marker_id)
+        self.by_commune[commune].discard(marker_id)
+
+    def upsert(self, marker):
+        self.remove(marker["id"])
+        commune = marker.get("commune")
+        if commune is None and self.locate is not None:
+            commune = self.locate(marker["lon"], marker["lat"])
+        self.entries[marker["id"]] = (marker.get("version"), marker["lat"], marker["lon"], marker.get("type"), commune)
+        self.cells[self._cell(marker["lat"], marker["lon"])].add(marker["id"])
+        self.by_commune[commune].add(marker["id"])
+
+    def sync(self, markers):
+        # نعيد فهرسة المرافق الجديدة أو التي تغير رقم نسختها فقط
+        current = set()
+        changed = 0
+        for marker in markers:
+            current.add(marker["id"])
+            entry = self.entries.get(marker["id"])
+            if entry is None or entry[0] != marker.get("version"):
+                self.upsert(marker)
+                changed += 1
+        for marker_id in [mid for mid in self.entries if mid not in current]:
+            self.remove(marker_id)
+            changed += 1
+        return changed
+
+    def _ring(self, ci, cj, r):
+        if r == 0:
+            yield ci, cj
+            return
+        for i in range(ci - r, ci + r + 1):
+            yield i, cj - r
+            yield i, cj + r
+        for j in range(cj - r + 1, cj + r):
+            yield ci - r, j
+            yield ci + r, j
+
+    def nearest(self, lat, lon, k=1, types=None):
+        # بحث حلقي حول خلية النقطة حتى تصبح الحلقة التالية أبعد من أبعد نتيجة
+        if not self.entries:
+            return []
+        ci, cj = self._cell(lat, lon)
+        km_per_cell = haversine_km(lat, lon, lat, lon + self.cell_degrees)
+        km_per_cell = min(km_per_cell, haversine_km(lat, lon, lat + self.cell_degrees, lon))
+        max_ring = max(max(abs(i - ci), abs(j - cj)) for (i, j), ids in self.cells.items() if ids) + 1
+        best = []
+        for r in range(max_ring):
+            for cell in self._ring(ci, cj, r):
+                for marker_id in self.cells.get(cell, ()):
+                    _, m_lat, m_lon, m_type, _ = self.entries[marker_id]
+                    if types is not None and m_type not in types:
+                        continue
+                    d = haversine_km(lat, lon, m_lat, m_lon)
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, marker_id))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, marker_id))
+            if len(best) == k and r * km_per_cell >= -best[0][0]:
+                break
+        return sorted(((marker_id, -d) for d, marker_id in best), key=lambda item: item[1])
+
+    def within(self, lat, lon, radius_km, types=None):
+        d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        d_lon = d_lat / max(math.cos(math.radians(lat)), 1e-6)
+        i0, j0 = self._cell(lat - d_lat, lon - d_lon)
+        i1, j1 = self._cell(lat + d_lat, lon + d_lon)
+        found = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for marker_id in self.cells.get((i, j), ()):
+                    _, m_lat, m_lon, m_type, _ = self.entries[marker_id]
+                    if types is not None and m_type not in types:
+                        continue
+                    d = haversine_km(lat, lon, m_lat, m_lon)
+                    if d <= radius_km:
+                        found.append((marker_id, d))
+        return sorted(found, key=lambda item: item[1])
+
+    def commune_of(self, marker_id):
+        entry = self.entries.get(marker_id)
+        return entry[4] if entry else None
+
+    def in_commune(self, commune):
+        return set(self.by_commune.get(commune, ()))
+
+    def counts_per_commune(self, types=None):
+        counts = {}
+        for commune, ids in self.by_commune.items():
+            if commune is None:
+                continue
+            n = sum(1 for mid in ids if types is None or self.entries[mid][3] in types)
+            if n:
+                counts[commune] = n
+        return counts
@@ -0,0 +1,468 @@
+import abc
+import atexit
+import contextlib
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+import uuid
+
+import streamlit as st
+
+from perf import stage
+
+# ==========================================
+# حفظ البيانات: كتابة مؤجلة ومجمعة، وذرية (ملف مؤقت ثم استبدال)
+# ==========================================
+# التعديلات المتتالية خلال هذه المدة تُكتب مرة واحدة
+SAVE_DEBOUNCE_SECONDS = 1.0
+# mkstemp ينشئ الملف بصلاحيات 0600؛ الملف الجديد يأخذ صلاحيات open() العادية (0666 بعد umask)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def atomic_write(path, text):
+    # الكتابة في ملف مؤقت بنفس المجلد ثم os.replace: لا يبقى ملف مبتور عند انقطاع مفاجئ
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # os.replace ينقل صلاحيات الملف المؤقت: نحافظ على صلاحيات الملف الأصلي
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class JsonStore:
+    def __init__(self, path, debounce=SAVE_DEBOUNCE_SECONDS):
+        self.path = path
+        self.debounce = debounce
+        self._lock = threading.RLock()
+        self._written_digest = None
+        self._pending = None
+        self._last_write = 0.0
+        self._timer = None
+        self.writes = 0
+        self.bytes_written = 0
+
+    def load(self):
+        # نكتب أي تعديل معلق أولاً حتى لا تقرأ جلسة جديدة نسخة قديمة
+        self.flush()
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        data = json.loads(raw.decode("utf-8"))
+        with self._lock:
+            self._written_digest = hashlib.sha1(raw).hexdigest()
+        return data
+
+    def save(self, data):
+        # التسلسل يتم فوراً (لقطة ثابتة من البيانات)، أما الكتابة على القرص فتؤجل
+        text = json.dumps(data, ensure_ascii=False, indent=4)
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            if self._pending is None and digest == self._written_digest:
+                return False
+            if self._pending is not None and digest == self._pending[1]:
+                return False
+            self._pending = (text, digest)
+            wait = self._last_write + self.debounce - time.monotonic()
+            if wait <= 0:
+                self._write_pending()
+            elif self._timer is None:
+                self._timer = threading.Timer(wait, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            return True
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._pending is not None:
+                self._write_pending()
+
+    def _write_pending(self):
+        text, digest = self._pending
+        self._pending = None
+        if digest != self._written_digest:
+            size = len(text.encode("utf-8"))
+            with stage("save_write", bytes=size):
+                atomic_write(self.path, text)
+            self._written_digest = digest
+            self.writes += 1
+            self.bytes_written += size
+        self._last_write = time.monotonic()
+
+
+# ==========================================
+# واجهات التخزين: كل عملية تخص سجلاً واحداً (مرفق، بلدية، أو الإعدادات)
+# ==========================================
+class ConflictError(Exception):
+    # المرفق عُدل أو حُذف من جلسة أخرى منذ آخر تحميل
+    pass
+
+
+def new_marker_id():
+    return uuid.uuid4().hex
+
+
+def _matches(marker, types=None, commune=None, bbox=None):
+    if types is not None and marker.get("type") not in types:
+        return False
+    if commune is not None and marker.get("commune") != commune:
+        return False
+    if bbox is not None:
+        south, west, north, east = bbox
+        if not (south <= marker["lat"] <= north and west <= marker["lon"] <= east):
+            return False
+    return True
+
+
+class StorageBackend(abc.ABC):
+    @abc.abstractmethod
+    def revision(self):
+        # رقم يتغير مع كل كتابة، لمعرفة متى يجب إعادة التحميل
+        ...
+
+    @abc.abstractmethod
+    def load_settings(self):
+        # يُرجع (commune_styles, global_settings أو None)
+        ...
+
+    @abc.abstractmethod
+    def load_markers(self, types=None, commune=None, bbox=None):
+        ...
+
+    def count_markers(self, types=None, commune=None, bbox=None):
+        return len(self.load_markers(types, commune, bbox))
+
+    @abc.abstractmethod
+    def insert_marker(self, marker):
+        ...
+
+    @abc.abstractmethod
+    def insert_markers(self, markers):
+        # إضافة دفعة كاملة (استيراد جماعي) في كتابة واحدة
+        ...
+
+    @abc.abstractmethod
+    def update_marker(self, marker):
+        ...
+
+    @abc.abstractmethod
+    def delete_marker(self, marker_id, version):
+        ...
+
+    @abc.abstractmethod
+    def set_commune_style(self, name, style):
+        ...
+
+    @abc.abstractmethod
+    def delete_commune_style(self, name):
+        ...
+
+    @abc.abstractmethod
+    def set_global_settings(self, settings):
+        ...
+
+    def flush(self):
+        pass
+
+
+class JsonBackend(StorageBackend):
+    # الملف كاملاً في الذاكرة ومشترك بين الجلسات، ويُكتب عبر JsonStore
+    def __init__(self, path):
+        self.store = JsonStore(path)
+        self._lock = threading.RLock()
+        self._data = None
+        self._revision = 0
+
+    def _doc(self):
+        if self._data is None:
+            try:
+                data = self.store.load()
+            except json.decoder.JSONDecodeError:
+                data = None
+            data = data or {}
+            data.setdefault("markers", [])
+            data.setdefault("commune_styles", {})
+            for marker in data["markers"]:
+                marker.setdefault("id", new_marker_id())
+                marker.setdefault("version", 1)
+            self._data = data
+        return self._data
+
+    def _commit(self):
+        self._revision += 1
+        with stage("save_data"):
+            self.store.save(self._data)
+
+    def _find(self, marker_id, version):
+        for i, marker in enumerate(self._doc()["markers"]):
+            if marker["id"] == marker_id:
+                if marker["version"] != version:
+                    raise ConflictError(marker_id)
+                return i
+        raise ConflictError(marker_id)
+
+    def revision(self):
+        return self._revision
+
+    def load_settings(self):
+        with self._lock:
+            doc = self._doc()
+            return copy.deepcopy(doc["commune_styles"]), copy.deepcopy(doc.get("global_settings"))
+
+    def load_markers(self, types=None, commune=None, bbox=None):
+        with self._lock:
+            return [copy.deepcopy(m) for m in self._doc()["markers"] if _matches(m, types, commune, bbox)]
+
+    def insert_marker(self, marker):
+        with self._lock:
+            marker = dict(marker, id=marker.get("id") or new_marker_id(), version=1)
+            self._doc()["markers"].append(copy.deepcopy(marker))
+            self._commit()
+            return marker
+
+    def insert_markers(self, markers):
+        with self._lock:
+            markers = [dict(m, id=m.get("id") or new_marker_id(), version=1) for m in markers]
+            self._doc()["markers"].extend(copy.deepcopy(markers))
+            self._commit()
+            return markers
+
+    def update_marker(self, marker):
+        with self._lock:
+            i = self._find(marker["id"], marker["version"])
+            marker = dict(marker, version=marker["version"] + 1)
+            self._doc()["markers"][i] = copy.deepcopy(marker)
+            self._commit()
+            return marker
+
+    def delete_marker(self, marker_id, version):
+        with self._lock:
+            i = self._find(marker_id, version)
+            self._doc()["markers"].pop(i)
+            self._commit()
+
+    def set_commune_style(self, name, style):
+        with self._lock:
+            self._doc()["commune_styles"][name] = copy.deepcopy(style)
+            self._commit()
+
+    def delete_commune_style(self, name):
+        with self._lock:
+            if self._doc()["commune_styles"].pop(name, None) is not None:
+                self._commit()
+
+    def set_global_settings(self, settings):
+        with self._lock:
+            self._doc()["global_settings"] = copy.deepcopy(settings)
+            self._commit()
+
+    def flush(self):
+        self.store.flush()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS markers (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    commune TEXT,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_markers_type ON markers(type);
+CREATE INDEX IF NOT EXISTS idx_markers_commune ON markers(commune);
+CREATE INDEX IF NOT EXISTS idx_markers_lat_lon ON markers(lat, lon);
+CREATE INDEX IF NOT EXISTS idx_markers_position ON markers(position);
+CREATE TABLE IF NOT EXISTS commune_styles (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0);
+"""
+
+
+class SqliteBackend(StorageBackend):
+    # كل مرفق صف مستقل، والتحديث مشروط برقم النسخة (تزامن متفائل)
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock, stage("save_data"):
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _where(types=None, commune=None, bbox=None):
+        clauses, params = [], []
+        if types is not None:
+            types = list(types)
+            clauses.append("type IN (%s)" % ",".join("?" * len(types)))
+            params.extend(types)
+        if commune is not None:
+            clauses.append("commune = ?")
+            params.append(commune)
+        if bbox is not None:
+            clauses.append("lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?")
+            south, west, north, east = bbox
+            params.extend([south, north, west, east])
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    @staticmethod
+    def _row(marker):
+        data = {k: v for k, v in marker.items() if k not in ("id", "version")}
+        return (marker.get("type", ""), marker.get("commune"), marker["lat"], marker["lon"],
+                json.dumps(data, ensure_ascii=False))
+
+    def revision(self):
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+    def is_empty(self):
+        with self._lock:
+            return (self._conn.execute("SELECT COUNT(*) FROM markers").fetchone()[0] == 0 and
+                    self._conn.execute("SELECT COUNT(*) FROM settings").fetchone()[0] == 0 and
+                    self._conn.execute("SELECT COUNT(*) FROM commune_styles").fetchone()[0] == 0)
+
+    def load_settings(self):
+        with self._lock:
+            styles = {name: json.loads(data) for name, data in
+                      self._conn.execute("SELECT name, data FROM commune_styles")}
+            row = self._conn.execute("SELECT data FROM settings WHERE key = 'global_settings'").fetchone()
+        return styles, json.loads(row[0]) if row else None
+
+    def load_markers(self, types=None, commune=None, bbox=None):
+        where, params = self._where(types, commune, bbox)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, version, data FROM markers" + where + " ORDER BY position", params).fetchall()
+        return [dict(json.loads(data), id=marker_id, version=version) for marker_id, version, data in rows]
+
+    def count_markers(self, types=None, commune=None, bbox=None):
+        where, params = self._where(types, commune, bbox)
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM markers" + where, params).fetchone()[0]
+
+    def _insert(self, conn, markers):
+        # الموضع الأخير يُقرأ مرة واحدة (من فهرس position) ثم تُكتب كل الصفوف دفعة واحدة
+        start = conn.execute("SELECT COALESCE(MAX(position), 0) FROM markers").fetchone()[0]
+        markers = [dict(m, id=m.get("id") or new_marker_id(), version=1) for m in markers]
+        conn.executemany(
+            "INSERT INTO markers (id, position, type, commune, lat, lon, version, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, 1, ?)",
+            [(m["id"], start + n + 1) + self._row(m) for n, m in enumerate(markers)])
+        return markers
+
+    def insert_marker(self, marker):
+        with self._transaction() as conn:
+            return self._insert(conn, [marker])[0]
+
+    def insert_markers(self, markers):
+        with self._transaction() as conn:
+            return self._insert(conn, markers)
+
+    def update_marker(self, marker):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE markers SET type = ?, commune = ?, lat = ?, lon = ?, data = ?, version = version + 1 "
+                "WHERE id = ? AND version = ?",
+                self._row(marker) + (marker["id"], marker["version"]))
+            if cursor.rowcount == 0:
+                raise ConflictError(marker["id"])
+        return dict(marker, version=marker["version"] + 1)
+
+    def delete_marker(self, marker_id, version):
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM markers WHERE id = ? AND version = ?", (marker_id, version))
+            if cursor.rowcount == 0:
+                raise ConflictError(marker_id)
+
+    def set_commune_style(self, name, style):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO commune_styles (name, data) VALUES (?, ?)",
+                         (name, json.dumps(style, ensure_ascii=False)))
+
+    def delete_commune_style(self, name):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM commune_styles WHERE name = ?", (name,))
+
+    def set_global_settings(self, settings):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO settings (key, data) VALUES ('global_settings', ?)",
+                         (json.dumps(settings, ensure_ascii=False),))
+
+    def import_json(self, json_path, locate=None):
+        # ترحيل ملف saved_data.json القديم كاملاً في معاملة واحدة
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        markers = data.get("markers", [])
+        if locate is not None:
+            markers = [m if m.get("commune") is not None else dict(m, commune=locate(m["lon"], m["lat"]))
+                       for m in markers]
+        with self._transaction() as conn:
+            self._insert(conn, markers)
+            for name, style in data.get("commune_styles", {}).items():
+                conn.execute("INSERT OR REPLACE INTO commune_styles (name, data) VALUES (?, ?)",
+                             (name, json.dumps(style, ensure_ascii=False)))
+            if data.get("global_settings") is not None:
+                conn.execute("INSERT OR REPLACE INTO settings (key, data) VALUES ('global_settings', ?)",
+                             (json.dumps(data["global_settings"], ensure_ascii=False),))
+        return len(data.get("markers", []))
+
+
+@st.cache_resource(show_spinner=False)
+def get_backend(kind, path, legacy_json=None, _locate=None):
+    if kind == "sqlite":
+        backend = SqliteBackend(path)
+        if legacy_json and os.path.exists(legacy_json) and backend.is_empty():
+            try:
+                backend.import_json(legacy_json, _locate)
+            except json.decoder.JSONDecodeError:
+                pass
+        return backend
+    if kind == "json":
+        backend = JsonBackend(path)
+        atexit.register(backend.flush)
+        return backend
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+
+if __name__ == "__main__":
+    # python storage.py saved_data.json saved_data.sqlite
+    import sys
+    count = SqliteBackend(sys.argv[2]).import_json(sys.argv[1])
+    print(f"{count} markers migrated to {sys.argv[2]}")
@@ -0,0 +1,20 @@
+from benchmark import icon_layer_items, legacy_icon_html, synthetic_markers
+from geometry import load_communes
+from marker_icons import DivIconLayer
+
+# ==========================================
+# أيقونات المرافق بالأصناف المشتركة (DivIconLayer) مقابل الشكل القديم (أنماط كاملة داخل كل أيقونة)
+# على 5000 مرفق اصطناعي؛ مقارنة الزمن وJavaScript folium الكامل في: python benchmark.py --markers --icons 5000
+# ==========================================
+MARKER_COUNT = 5000
+
+
+def test_div_icon_layer_smaller_than_inline_markers():
+    markers = synthetic_markers(load_communes("msila_communes.geojson"), MARKER_COUNT)
+    assert len(markers) == MARKER_COUNT
+
+    # HTML الأيقونات القديمة وحده، بدون JavaScript لكل Marker و DivIcon: الحد أدنى من الفرق الحقيقي
+    legacy_size = sum(len(legacy_icon_html(marker)) for marker in markers)
+    new_size = len(DivIconLayer(icon_layer_items(markers)).icons_json)
+    # المقاس على هذه البيانات: حوالي 18% من الحجم القديم
+    assert new_size < legacy_size / 4, (new_size, legacy_size)
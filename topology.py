@@ -0,0 +1,239 @@
+import json
+import os
+from typing import Dict, List, Tuple
+
+from geometry import COMMUNE_GEOMETRY_TYPES, polygons
+
+# ==========================================
+# طوبولوجيا الأقواس المشتركة (نفس مبدأ TopoJSON)
+# كل حد مشترك بين بلديتين يُخزن مرة واحدة كقوس، وكل حلقة تُعرّف بقائمة أرقام أقواس
+# (الرقم السالب ~i يعني القوس i معكوساً)
+# ==========================================
+
+
+def _open_ring(ring):
+    pts = [tuple(p[:2]) for p in ring]
+    if len(pts) > 1 and pts[0] == pts[-1]:
+        pts.pop()
+    return pts
+
+
+def _cut_ring(pts, junctions):
+    cuts = [i for i, p in enumerate(pts) if p in junctions]
+    if not cuts:
+        # حلقة بدون نقاط التقاء (جزيرة أو جيب): نبدأ من أصغر نقطة حتى تتطابق نسختا الحلقة المشتركة
+        start = pts.index(min(pts))
+        rotated = pts[start:] + pts[:start]
+        return [rotated + [rotated[0]]]
+    rotated = pts[cuts[0]:] + pts[:cuts[0]]
+    arcs, current = [], [rotated[0]]
+    for p in rotated[1:]:
+        current.append(p)
+        if p in junctions:
+            arcs.append(current)
+            current = [p]
+    current.append(rotated[0])
+    arcs.append(current)
+    return arcs
+
+
+class Topology:
+    def __init__(self, arcs, objects):
+        self.arcs: List[List[Tuple[float, float]]] = arcs
+        # لكل عنصر: قائمة مضلعات، كل مضلع قائمة حلقات، كل حلقة قائمة أرقام أقواس
+        self.objects: List[List[List[List[int]]]] = objects
+
+    @property
+    def vertex_count(self):
+        return sum(len(a) for a in self.arcs)
+
+    def ring_coordinates(self, ring_arcs, arcs=None):
+        arcs = self.arcs if arcs is None else arcs
+        coords = []
+        for ref in ring_arcs:
+            arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+            coords.extend(arc[1:] if coords else arc)
+        return [list(p) for p in coords]
+
+    def to_geometry(self, index, arcs=None):
+        parts = [
+            [self.ring_coordinates(ring, arcs) for ring in polygon]
+            for polygon in self.objects[index]
+        ]
+        if len(parts) == 1:
+            return {"type": "Polygon", "coordinates": parts[0]}
+        return {"type": "MultiPolygon", "coordinates": parts}
+
+
+def build_topology(features) -> Topology:
+    rings = []
+    layout = []
+    for feature in features:
+        feature_layout = []
+        for polygon in polygons(feature["geometry"]):
+            ring_ids = []
+            for ring in polygon:
+                ring_ids.append(len(rings))
+                rings.append(_open_ring(ring))
+            feature_layout.append(ring_ids)
+        layout.append(feature_layout)
+
+    membership: Dict[Tuple[float, float], set] = {}
+    for ring_id, pts in enumerate(rings):
+        for p in pts:
+            membership.setdefault(p, set()).add(ring_id)
+
+    # نقطة الالتقاء: حيث تتغير مجموعة الحلقات التي تمر بها النقطة من جار لآخر
+    junctions = set()
+    for pts in rings:
+        n = len(pts)
+        for i, p in enumerate(pts):
+            here = membership[p]
+            if len(here) > 1 and (here != membership[pts[i - 1]] or here != membership[pts[(i + 1) % n]]):
+                junctions.add(p)
+
+    arcs: List[List[Tuple[float, float]]] = []
+    arc_index: Dict[tuple, int] = {}
+
+    def arc_ref(arc):
+        key = tuple(arc)
+        if key in arc_index:
+            return arc_index[key]
+        reverse_key = key[::-1]
+        if reverse_key in arc_index:
+            return ~arc_index[reverse_key]
+        arc_index[key] = len(arcs)
+        arcs.append(arc)
+        return arc_index[key]
+
+    objects = []
+    for feature_layout in layout:
+        objects.append([
+            [[arc_ref(arc) for arc in _cut_ring(rings[ring_id], junctions)] for ring_id in polygon]
+            for polygon in feature_layout
+        ])
+    return Topology(arcs, objects)
+
+
+# ==========================================
+# ترميز TopoJSON مكمّم: الإحداثيات أعداد صحيحة داخل الإطار المحيط،
+# وكل نقطة في القوس تُكتب كفرق عن النقطة التي قبلها
+# ==========================================
+# عدد الخطوات على كل محور (حوالي 2 م لولاية المسيلة)
+QUANTIZATION = 100000
+TOPOJSON_SUFFIX = ".topo.json"
+TOPOJSON_OBJECT = "communes"
+
+
+def quantize_arcs(arcs, quantization=QUANTIZATION):
+    xs = [p[0] for arc in arcs for p in arc]
+    ys = [p[1] for arc in arcs for p in arc]
+    x0, y0 = min(xs), min(ys)
+    kx = (max(xs) - x0) / (quantization - 1) or 1.0
+    ky = (max(ys) - y0) / (quantization - 1) or 1.0
+    encoded = []
+    for arc in arcs:
+        points = [(round((p[0] - x0) / kx), round((p[1] - y0) / ky)) for p in arc]
+        # نقاط متتالية صارت متطابقة بعد التكميم تُحذف، ما دام القوس يبقى صالحاً
+        deduped = [points[0]] + [p for prev, p in zip(points, points[1:]) if p != prev]
+        if len(deduped) >= (4 if points[0] == points[-1] else 2):
+            points = deduped
+        delta, px, py = [], 0, 0
+        for x, y in points:
+            delta.append([x - px, y - py])
+            px, py = x, y
+        encoded.append(delta)
+    return {"scale": [kx, ky], "translate": [x0, y0]}, encoded
+
+
+def decode_arcs(topojson):
+    (kx, ky), (x0, y0) = topojson["transform"]["scale"], topojson["transform"]["translate"]
+    arcs = []
+    for delta in topojson["arcs"]:
+        arc, x, y = [], 0, 0
+        for dx, dy in delta:
+            x, y = x + dx, y + dy
+            arc.append((x * kx + x0, y * ky + y0))
+        arcs.append(arc)
+    return arcs
+
+
+def to_topojson(topology, properties, arcs=None, quantization=QUANTIZATION):
+    transform, encoded = quantize_arcs(topology.arcs if arcs is None else arcs, quantization)
+    geometries = []
+    for parts, props in zip(topology.objects, properties):
+        if len(parts) == 1:
+            geometries.append({"type": "Polygon", "arcs": parts[0], "properties": props})
+        else:
+            geometries.append({"type": "MultiPolygon", "arcs": parts, "properties": props})
+    return {
+        "type": "Topology",
+        "transform": transform,
+        "arcs": encoded,
+        "objects": {TOPOJSON_OBJECT: {"type": "GeometryCollection", "geometries": geometries}},
+    }
+
+
+def from_topojson(topojson):
+    # (Topology بإحداثيات حقيقية، خصائص كل عنصر)
+    objects, properties = [], []
+    for geometry in topojson["objects"][TOPOJSON_OBJECT]["geometries"]:
+        objects.append([geometry["arcs"]] if geometry["type"] == "Polygon" else geometry["arcs"])
+        properties.append(geometry.get("properties", {}))
+    return Topology(decode_arcs(topojson), objects), properties
+
+
+def subset_topojson(topojson, indices):
+    # العناصر المختارة فقط، مع الأقواس التي تستعملها مرقمة من جديد (نفس التكميم)
+    remap = {}
+
+    def ref(arc):
+        index = arc if arc >= 0 else ~arc
+        if index not in remap:
+            remap[index] = len(remap)
+        return remap[index] if arc >= 0 else ~remap[index]
+
+    geometries = []
+    for i in indices:
+        geometry = topojson["objects"][TOPOJSON_OBJECT]["geometries"][i]
+        if geometry["type"] == "Polygon":
+            arcs = [[ref(a) for a in ring] for ring in geometry["arcs"]]
+        else:
+            arcs = [[[ref(a) for a in ring] for ring in polygon] for polygon in geometry["arcs"]]
+        geometries.append(dict(geometry, arcs=arcs))
+    return dict(topojson, arcs=[topojson["arcs"][i] for i in remap],
+                objects={TOPOJSON_OBJECT: {"type": "GeometryCollection", "geometries": geometries}})
+
+
+def read_topojson(path, version):
+    # الملف المُترجم مسبقاً صالح فقط لنفس نسخة الملف المصدر
+    try:
+        with open(path + TOPOJSON_SUFFIX, "r", encoding="utf-8") as f:
+            topojson = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return topojson if topojson.get("version") == version else None
+
+
+def write_topojson(path, version, topojson):
+    tmp_path = path + TOPOJSON_SUFFIX + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(topojson, version=version), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path + TOPOJSON_SUFFIX)
+    except OSError:
+        # مجلد للقراءة فقط: نكتفي بالذاكرة
+        pass
+
+
+if __name__ == "__main__":
+    # تحويل مسبق: python topology.py msila_communes.geojson
+    import hashlib
+    import sys
+
+    source = sys.argv[1]
+    with open(source, "rb") as f:
+        raw = f.read()
+    features = [f for f in json.loads(raw)["features"] if (f.get("geometry") or {}).get("type") in COMMUNE_GEOMETRY_TYPES]
+    write_topojson(source, hashlib.sha1(raw).hexdigest(), to_topojson(build_topology(features), [f["properties"] for f in features]))
+    print(f"{os.path.getsize(source)} -> {os.path.getsize(source + TOPOJSON_SUFFIX)} bytes ({source + TOPOJSON_SUFFIX})")
@@ -0,0 +1,69 @@
+import json
+
+from branca.element import MacroElement
+from jinja2 import Template
+
+# ==========================================
+# طبقة البلديات في المتصفح من TopoJSON مكمّم بدل GeoJSON كامل
+# فك الترميز (فروق الإحداثيات والأقواس المشتركة) يتم في المتصفح،
+# والألوان تُحسب في الخادم وتُرسل كجدول صغير مع رقم النمط لكل بلدية
+# ==========================================
+
+
+class TopoJsonLayer(MacroElement):
+    _template = Template("""
+    {% macro script(this, kwargs) %}
+    var {{ this.get_name() }} = (function (topo, styles, styleIndex, highlight) {
+        var t = topo.transform;
+        var arcs = topo.arcs.map(function (delta) {
+            var x = 0, y = 0;
+            return delta.map(function (d) {
+                x += d[0];
+                y += d[1];
+                return [x * t.scale[0] + t.translate[0], y * t.scale[1] + t.translate[1]];
+            });
+        });
+        function ring(refs) {
+            var coords = [];
+            for (var i = 0; i < refs.length; i++) {
+                var arc = refs[i] >= 0 ? arcs[refs[i]] : arcs[~refs[i]].slice().reverse();
+                for (var j = coords.length ? 1 : 0; j < arc.length; j++) coords.push(arc[j]);
+            }
+            return coords;
+        }
+        var features = topo.objects.{{ this.object_name }}.geometries.map(function (g, i) {
+            var coords = g.type === 'Polygon' ? g.arcs.map(ring) : g.arcs.map(function (p) { return p.map(ring); });
+            return {type: 'Feature', properties: g.properties || {}, id: i, geometry: {type: g.type, coordinates: coords}};
+        });
+        var layer = L.geoJson({type: 'FeatureCollection', features: features}, {
+            style: function (feature) { return styles[styleIndex[feature.id]]; },
+            onEachFeature: function (feature, featureLayer) {
+                if (!highlight) return;
+                featureLayer.on('mouseover', function () { featureLayer.setStyle(highlight); });
+                featureLayer.on('mouseout', function () { layer.resetStyle(featureLayer); });
+            }
+        });
+        return layer;
+    })({{ this.topojson_json }}, {{ this.styles_json }}, {{ this.style_index_json }}, {{ this.highlight_json }});
+    {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+    {% endmacro %}
+    """)
+
+    def __init__(self, topojson, features, style_function, highlight=None, object_name="communes"):
+        super().__init__()
+        self._name = "TopoJsonLayer"
+        self.object_name = object_name
+        # أنماط متطابقة تُرسل مرة واحدة
+        styles, style_keys, style_index = [], {}, []
+        for feature in features:
+            style = style_function(feature)
+            key = json.dumps(style, sort_keys=True)
+            if key not in style_keys:
+                style_keys[key] = len(styles)
+                styles.append(style)
+            style_index.append(style_keys[key])
+        # "</" داخل الأسماء لا يجب أن يغلق وسم <script>
+        self.topojson_json = json.dumps(topojson, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+        self.styles_json = json.dumps(styles, separators=(",", ":"))
+        self.style_index_json = json.dumps(style_index, separators=(",", ":"))
+        self.highlight_json = json.dumps(highlight)